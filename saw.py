@@ -7,6 +7,9 @@ from src.plot import *
 from src.zeopp import *
 from src.test import *
 from src.gui import *
+from src.adaptive import *
+from src.structure_db import *
+from src.validate import *
 
 def main():
     """
@@ -30,8 +33,9 @@ def main():
 
     # Run simulations
     if args.command == "run": 
-        cif_names, sim_dir_names, grid_use = prepare_input_files(args)                                  # 1.
-        run_simulations(args,sim_dir_names,grid_use=grid_use)                                           # 2.
+        cif_names, sim_dir_names, grid_dir_names = prepare_input_files(args)                            # 1.
+        run_simulations(args,sim_dir_names,grid_dir_names=grid_dir_names)                               # 2.
+        sim_dir_names = refine_isotherms(args,sim_dir_names)
         output_isotherms_to_csv(args.output_dir,sim_dir_names)                                                     # 3.
         export_simulation_result_to_json(args.input_file,args.output_dir,sim_dir_names,verbose=False)
         output_isotherms_to_json(args.output_dir,f"{glob.glob(f'{args.output_dir}/gcmc/run*json')[0]}")
@@ -44,6 +48,16 @@ def main():
                                                 isotherm_filename=f'isotherms.json',
                                                 isotherm_dir=f'{args.output_dir}')
 
+    # Check an input file and its structures, without running simulations
+    if args.command == "validate":
+        problems = validate_campaign(args)
+        if len(problems) > 0:
+            exit(1)
+
+    # Import structures in the local structure store
+    if args.command == "db" and args.db_command == "import":
+        import_archive(args.archive,database=args.database,version=args.version)
+
     # Run a Graphical User Interface for plotting isotherms results
     if args.command == "plot":
         run_gui_output()
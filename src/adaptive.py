@@ -0,0 +1,158 @@
+"""
+Adaptive placement of the pressure points of isotherms.
+
+A coarse log-spaced set of pressures is simulated first; points are then added
+only where the isotherm is poorly described by a linear interpolation in log(P),
+until a tolerance or a maximum number of points per isotherm is reached.
+"""
+import os,json,ast
+import numpy as np
+import pandas as pd
+from src.wraspa2 import *
+from src.wraspa2 import _has_simulation_inputs
+from src.convergence import get_loading
+
+def refine_isotherms(args,sim_dir_names):
+    """
+    Refine the isotherms of a workflow run with `pressure_spacing` set to 'adaptive'.
+
+    The following keywords of the `defaults` field of the JSON input are used:
+    - `adaptive_tolerance` : maximal interpolation error, relative to the largest uptake of the isotherm (default 0.05),
+    - `adaptive_max_points` : maximal number of points per isotherm (default: twice `npoints`).
+
+    At each iteration, the uptakes of all points are read, new pressures are chosen
+    for each isotherm (see `get_refinement_pressures`), and the new simulations are run.
+
+    Args:
+        args (argparse.Namespace): Parsed command-line arguments.
+        sim_dir_names (list): List of simulation directory names of the seed points.
+
+    Returns:
+        sim_dir_names (list): List of all simulation directory names, including the added points.
+    """
+    with open(args.input_file, 'r') as f:
+        data = json.load(f)
+    if data["defaults"].get("pressure_spacing","linear") != "adaptive":
+        return sim_dir_names
+    tolerance = data["defaults"].get("adaptive_tolerance",0.05)
+    max_points = data["defaults"].get("adaptive_max_points",2*data["parameters"]["npoints"])
+
+    sim_dir_names = list(sim_dir_names)
+    iteration = 0
+    while True:
+        iteration += 1
+        df_index = pd.read_csv(f"{args.output_dir}/gcmc/index.csv")
+        df = df_index.loc[df_index["simkey"].isin(sim_dir_names)]
+        group_columns = [column for column in df.columns if column not in ["simkey","pressure"]]
+
+        new_params = []
+        for group,data_group in df.groupby(group_columns,dropna=False):
+            if len(data_group) >= max_points:
+                continue
+            uptakes = [_read_uptake(args.output_dir,row["simkey"],row["molecule_name"])
+                       for _,row in data_group.iterrows()]
+            pressures = [p for p,u in zip(data_group["pressure"],uptakes) if u is not None]
+            uptakes = [u for u in uptakes if u is not None]
+            for pressure in get_refinement_pressures(pressures,uptakes,tolerance,
+                                                     max_new_points=max_points-len(data_group)):
+                params = _row_to_params(data_group.iloc[0])
+                params["pressure"] = pressure
+                params["simkey_previous"] = _get_previous_point(data_group,pressure)
+                new_params.append(params)
+
+        if len(new_params) == 0:
+            break
+        print(f"Adaptive isotherms (iteration {iteration}) : {len(new_params)} pressure points added.")
+        new_dir_names = []
+        for params in new_params:
+            simkey_previous = params.pop("simkey_previous")
+            simkey = find_simkey(df_index,params) if getattr(args,"resume",False) else None
+            # When resuming, the directory of a point added by the previous run is kept as it is
+            if simkey is not None and _has_simulation_inputs(f"{args.output_dir}/gcmc/{simkey}"):
+                params["simkey"] = simkey
+            else:
+                write_simulation_inputs(params,args.output_dir,simkey=simkey)
+                if params.get("warm_start","no") == "yes" and simkey_previous is not None:
+                    write_warm_start_inputs(params,simkey_previous,args.output_dir)
+            new_dir_names.append(params["simkey"])
+        # The exit codes of the new points are added to the ones of the previous rounds
+        run_simulations(args,new_dir_names,append=True)
+        sim_dir_names += new_dir_names
+    print(f"Adaptive isotherms : {len(sim_dir_names)} pressure points in total.")
+    return sim_dir_names
+
+def get_refinement_pressures(pressures,uptakes,tolerance=0.05,max_new_points=None):
+    """
+    Choose new pressure points where an isotherm is poorly described by its current points.
+
+    The error of each interval between two consecutive points is estimated in log(P):
+    for each interior point, the deviation between its uptake and the linear interpolation
+    of its two neighbours measures the local curvature, and is assigned to the two adjacent
+    intervals. Intervals with an error larger than `tolerance` (relative to the largest
+    uptake) are split at their geometric mean pressure, the largest errors first.
+
+    Args:
+        pressures (list): Pressures of the current points (Pa).
+        uptakes (list): Uptakes of the current points.
+        tolerance (float): Maximal error relative to the largest uptake.
+        max_new_points (int, optional): Maximal number of new points.
+
+    Returns:
+        new_pressures (list): The pressures to add, sorted.
+    """
+    order = np.argsort(pressures)
+    x = np.log10(np.asarray(pressures,dtype=float)[order])
+    y = np.asarray(uptakes,dtype=float)[order]
+    scale = np.max(np.abs(y)) if len(y) > 0 else 0
+    if len(x) < 2 or scale == 0:
+        return []
+
+    errors = np.zeros(len(x)-1)
+    if len(x) == 2:
+        errors[:] = np.inf
+    for j in range(1,len(x)-1):
+        y_interp = y[j-1] + (y[j+1]-y[j-1])*(x[j]-x[j-1])/(x[j+1]-x[j-1])
+        deviation = abs(y[j]-y_interp)/scale
+        errors[j-1] = max(errors[j-1],deviation)
+        errors[j] = max(errors[j],deviation)
+
+    intervals = [i for i in np.argsort(-errors) if errors[i] > tolerance]
+    if max_new_points is not None:
+        intervals = intervals[:max(0,max_new_points)]
+    return sorted(float(10**((x[i]+x[i+1])/2)) for i in intervals)
+
+def _get_previous_point(data_group,pressure):
+    '''
+    Simulation key of the point of the isotherm with the largest pressure below `pressure`.
+    '''
+    below = data_group.loc[data_group["pressure"] < pressure]
+    if len(below) == 0:
+        return None
+    return below.sort_values("pressure")["simkey"].iloc[-1]
+
+def _read_uptake(output_dir,simkey,molecule_name):
+    '''
+    Read the absolute uptake (cm^3 (STP)/cm^3 framework) of a simulation, None if it failed.
+    '''
+    path = f'{output_dir}/gcmc/{simkey}/Output/System_0/'
+    try:
+        with open(os.path.join(path,os.listdir(path)[0]),'r') as f:
+            r = parse(f.read())
+        return get_loading(f'{output_dir}/gcmc/{simkey}',r,molecule_name)
+    except Exception as e:
+        print(f"Uptake of simulation {simkey} cannot be read : {e}")
+        return None
+
+def _row_to_params(row):
+    '''
+    Convert a row of the index file `gcmc/index.csv` back into simulation parameters.
+    '''
+    params = {}
+    for key,value in row.drop("simkey").items():
+        if isinstance(value,float) and np.isnan(value):
+            value = None
+        elif isinstance(value,np.generic):
+            value = value.item()
+        params[key] = value
+    params["unit_cells"] = tuple(ast.literal_eval(str(params["unit_cells"])))
+    return params
@@ -0,0 +1,107 @@
+"""
+Persistent caches shared by successive runs of the workflow.
+
+The caches are stored in `$SAW_CACHE_DIR` (default : `~/.cache/simple-adsorption-workflow`),
+one subdirectory per kind of data. Each entry is a file or a directory named after the
+hash of everything its content depends on, so that two runs (or two campaigns) computing
+the same data share it. The modification time of an entry is its last use, which is used
+to evict the least recently used entries when a cache exceeds its disk budget.
+New entries are written under a temporary name (containing '.tmp') and renamed once complete.
+"""
+import os,shutil,hashlib,time
+
+# Age in seconds after which a temporary entry is considered abandoned (e.g. by a killed process)
+TMP_MAX_AGE = 3600
+
+def get_cache_dir(name):
+    """
+    Return the directory of a cache, created if needed.
+
+    Args:
+        name (str): Name of the cache (e.g. 'grids').
+
+    Returns:
+        path (str): Path of the cache directory.
+    """
+    root = os.environ.get("SAW_CACHE_DIR",os.path.expanduser("~/.cache/simple-adsorption-workflow"))
+    path = f"{root}/{name}"
+    os.makedirs(path,exist_ok=True)
+    return path
+
+def hash_file(filename):
+    """
+    Return the SHA-256 hash of the content of a file.
+    """
+    h = hashlib.sha256()
+    with open(filename,"rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20),b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def hash_items(*items):
+    """
+    Return the SHA-256 hash of a sequence of strings (e.g. other hashes and parameters).
+    """
+    h = hashlib.sha256()
+    for item in items:
+        h.update(str(item).encode())
+        h.update(b"\0")
+    return h.hexdigest()
+
+def touch(path):
+    """
+    Mark a cache entry as used now.
+    """
+    os.utime(path,None)
+
+def get_size(path):
+    """
+    Return the size in bytes of a file or of all the files of a directory.
+    """
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    size = 0
+    for root,_,files in os.walk(path):
+        size += sum(os.path.getsize(os.path.join(root,f)) for f in files)
+    return size
+
+def evict_lru(cache_dir,max_size_gb):
+    """
+    Remove the least recently used entries of a cache until its size is below a budget.
+
+    The temporary entries still being written by another process are never removed;
+    the ones older than `TMP_MAX_AGE` seconds are abandoned and removed as any other entry.
+
+    Args:
+        cache_dir (str): Path of the cache directory.
+        max_size_gb (float): Disk budget of the cache, in GB.
+
+    Returns:
+        removed (list): The paths of the removed entries.
+    """
+    now = time.time()
+    mtimes = {}
+    for name in os.listdir(cache_dir):
+        entry = os.path.join(cache_dir,name)
+        try:
+            mtime = os.path.getmtime(entry)
+        except FileNotFoundError:
+            # Renamed or removed by another process meanwhile
+            continue
+        if ".tmp" in name and now - mtime < TMP_MAX_AGE:
+            continue
+        mtimes[entry] = mtime
+    entries = sorted(mtimes,key=mtimes.get)
+    sizes = {entry: get_size(entry) for entry in entries}
+    total = sum(sizes.values())
+    removed = []
+    for entry in entries:
+        if total <= max_size_gb*1e9:
+            break
+        if os.path.isdir(entry):
+            shutil.rmtree(entry,ignore_errors=True)
+        else:
+            os.remove(entry)
+        total -= sizes[entry]
+        removed.append(entry)
+    return removed
@@ -0,0 +1,182 @@
+"""
+Cache of the structures converted to a canonical P1 CIF file, ready to be read by RASPA.
+
+RASPA expands the symmetry of a CIF file at the start of every simulation, and some CIF files
+have atom labels RASPA handles slowly or wrongly. With `"canonical_cif":"yes"` in the `defaults`
+field, each structure is converted once to a canonical P1 CIF file, from the structure store
+(see `src/structure_store.py`):
+- all the atoms of the unit cell, with the symmetry operation `x,y,z` only,
+- fractional coordinates wrapped into [0, 1),
+- labels `<element><index>` and type symbols `<element>`,
+- the partial charges, when the original CIF file has some.
+
+The canonical files are stored in `$SAW_CACHE_DIR/canonical/<key>.cif`, keyed by the hash of the
+original CIF file, and copied into the directory of each simulation under the name of the original
+CIF file (a copy, not a link, so that writing over a simulation file never changes the cache). A structure which cannot be converted (e.g. a CIF file with a charge column
+whose charges cannot all be assigned to the atoms of the cell) is read by RASPA from its original CIF file.
+"""
+import os,shutil,threading,warnings
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from ase.data import chemical_symbols
+from src.cache import *
+from src.qmof import has_charges
+from src.structure_store import load_structure
+
+# Version of the canonical format, part of the cache key
+CANONICAL_VERSION = 1
+
+def get_canonical_key(cif_path_filename):
+    """
+    Cache key of the canonical CIF file of a structure.
+    """
+    return hash_items("canonical",hash_file(cif_path_filename),CANONICAL_VERSION)
+
+def write_canonical_cif(structure,filename,name="I"):
+    """
+    Write a structure of the structure store as a canonical P1 CIF file.
+
+    Args:
+        structure (SimpleNamespace): A structure read by `load_structure`.
+        filename (str): Path of the CIF file.
+        name (str): Name of the data block.
+
+    Raises:
+        ValueError: If only some of the atoms have a partial charge (the charges would be lost).
+    """
+    a, b, c, alpha, beta, gamma = structure.cellpar
+    elements = [chemical_symbols[number] for number in structure.numbers]
+    counts = {}
+    labels = []
+    for element in elements:
+        counts[element] = counts.get(element,0) + 1
+        labels.append(f"{element}{counts[element]}")
+
+    fractional = structure.frac - np.floor(structure.frac)
+    fractional[fractional > 1 - 1e-10] = 0.0
+    missing_charges = np.isnan(structure.charges)
+    with_charges = len(structure.charges) > 0 and not missing_charges.all()
+    if with_charges and missing_charges.any():
+        raise ValueError(f"{missing_charges.sum()} of {len(missing_charges)} atoms have no partial charge.")
+
+    lines = [f"data_{name}",
+             f"_cell_length_a {a:.6f}",
+             f"_cell_length_b {b:.6f}",
+             f"_cell_length_c {c:.6f}",
+             f"_cell_angle_alpha {alpha:.6f}",
+             f"_cell_angle_beta {beta:.6f}",
+             f"_cell_angle_gamma {gamma:.6f}",
+             "_symmetry_space_group_name_H-M 'P 1'",
+             "_symmetry_Int_Tables_number 1",
+             "loop_",
+             "    _symmetry_equiv_pos_as_xyz",
+             "    x,y,z",
+             "loop_",
+             "    _atom_site_label",
+             "    _atom_site_type_symbol",
+             "    _atom_site_fract_x",
+             "    _atom_site_fract_y",
+             "    _atom_site_fract_z"]
+    if with_charges:
+        lines.append("    _atom_site_charge")
+        lines += [f"    {label:<7s} {element:<4s} {x:.6f} {y:.6f} {z:.6f} {charge:9.6f}"
+                  for label,element,(x,y,z),charge in zip(labels,elements,fractional,structure.charges)]
+    else:
+        lines += [f"    {label:<7s} {element:<4s} {x:.6f} {y:.6f} {z:.6f}"
+                  for label,element,(x,y,z) in zip(labels,elements,fractional)]
+    with open(filename,"w") as f:
+        f.write("\n".join(lines) + "\n")
+
+def canonicalize_cif(cif_path_filename):
+    """
+    Convert a CIF file to a canonical P1 CIF file, unless it is already in the cache.
+
+    Args:
+        cif_path_filename (str): Path of the original CIF file.
+
+    Returns:
+        canonical_filename (str): Path of the canonical CIF file in the cache.
+
+    Raises:
+        ValueError: If the CIF file has partial charges which cannot all be assigned to the atoms of the cell.
+    """
+    canonical_filename = f"{get_cache_dir('canonical')}/{get_canonical_key(cif_path_filename)}.cif"
+    if os.path.isfile(canonical_filename):
+        touch(canonical_filename)
+        return canonical_filename
+    structure = load_structure(cif_path_filename)
+    if np.isnan(structure.charges).all() and has_charges(cif_path_filename):
+        raise ValueError("the partial charges of the CIF file cannot be assigned to the atoms of the cell.")
+    # Write in a temporary file, then rename it, so that a partial file is never read
+    tmp_filename = f"{canonical_filename}.tmp{os.getpid()}_{threading.get_ident()}"
+    name = os.path.splitext(os.path.basename(cif_path_filename))[0]
+    try:
+        write_canonical_cif(structure,tmp_filename,name=name)
+    except ValueError:
+        if os.path.isfile(tmp_filename):
+            os.remove(tmp_filename)
+        raise
+    os.replace(tmp_filename,canonical_filename)
+    return canonical_filename
+
+# CIF files which could not be converted, read by RASPA in their original form : key -> error
+_CANONICAL_FAILURES = {}
+
+def get_raspa_cif(cif_path_filename,canonical=False):
+    """
+    CIF file read by RASPA for a framework : its canonical P1 CIF file, or the original CIF file
+    if `canonical` is False or if the structure cannot be converted (see `canonicalize_cif`).
+    """
+    if not canonical:
+        return cif_path_filename
+    key = get_canonical_key(cif_path_filename)
+    if key not in _CANONICAL_FAILURES:
+        try:
+            return canonicalize_cif(cif_path_filename)
+        except Exception as e:
+            _CANONICAL_FAILURES[key] = repr(e)
+    return cif_path_filename
+
+def canonicalize_cifs(cif_dir,cifnames,max_workers=None,max_size_gb=None):
+    """
+    Convert the structures of a run to canonical P1 CIF files in parallel.
+
+    Args:
+        cif_dir (str): Directory of the CIF files.
+        cifnames (list): CIF names, without the extension.
+        max_workers (int, optional): Number of processes; default is the number of CPUs.
+        max_size_gb (float, optional): Disk budget of the cache in GB,
+                                       defaults to `$SAW_CANONICAL_CACHE_MAX_GB` or 10.
+
+    Returns:
+        failures (dict): A dictionary CIF name -> error, for the structures which could not be converted.
+    """
+    failures = {}
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {cifname:executor.submit(canonicalize_cif,f"{cif_dir}/{cifname}.cif") for cifname in cifnames}
+        for cifname,future in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                failures[cifname] = repr(e)
+                warnings.warn(f"{cifname}.cif could not be converted to a canonical P1 CIF file, "
+                              f"the original file is used : {e!r}")
+    if max_size_gb is None:
+        max_size_gb = float(os.environ.get("SAW_CANONICAL_CACHE_MAX_GB",10))
+    evict_lru(get_cache_dir("canonical"),max_size_gb)
+    return failures
+
+def copy_framework_cif(cif_path_filename,work_dir,canonical=False):
+    """
+    Put the CIF file of a framework in the directory of a simulation, under its original name.
+
+    Args:
+        cif_path_filename (str): Path of the original CIF file.
+        work_dir (str): Directory of the simulation.
+        canonical (bool): If True, copy the canonical P1 CIF file instead of the original one (see `get_raspa_cif`).
+    """
+    target = os.path.join(work_dir,os.path.basename(cif_path_filename))
+    # Replace the file rather than write through it : it may be a link to a cache file written by a previous version
+    if os.path.lexists(target):
+        os.remove(target)
+    shutil.copyfile(get_raspa_cif(cif_path_filename,canonical),target)
@@ -1,22 +1,34 @@
-import os,glob,sys,shutil
-from io import StringIO
+import os,glob,sys,shutil,time
+from math import ceil
+import traceback
+from functools import partial
+from multiprocessing import Process
+from multiprocessing.connection import wait
+import pandas as pd
+import warnings
 
 from openbabel import openbabel
 from pyeqeq import run_on_cif
 from pacmof2 import pacmof2
+from src.scheduler import get_usable_cores
+from src.charge_cache import get_charged_cifname
+from src.qmof import *
 
 
-def run_EQeq(cif_dir,cifnames,verbose=False,output_type="files",**kwargs):
+def run_EQeq(cif_dir,cifnames,verbose=False,max_workers=None,timeout=600,**kwargs):
     '''
     Compute the partial charges of framework using the EQeq method (10.1021/jz3008485). 
 
     The new CIF files are located in the same directory as the original CIF files.
+    The structures are processed by a pool of processes (see `run_in_process_pool`),
+    in memory : only the CIF files with partial charges are written.
 
     Parameters:
         cifnames (str) : Absolute paths for cif input files.
-        verbose (bool) : if True, print the stdout/stderr from EQeq C++ code
-        output_type (str): the type of output among "cif","mol","pdb","list","json" and "file";
-                           default : "files", all possible are created
+        verbose (bool) : if True, print the stdout/stderr from EQeq C++ code,
+                         otherwise it is written in `<cif_dir>/logs/<structure>_EQeq.log`
+        max_workers (int) : maximum number of structures processed at once (default : number of usable cores)
+        timeout (float) : maximum time in seconds for one structure (default : 600)
         kwargs : other arguments (see documentation at https://github.com/lsmo-epfl/EQeq)
 
     Returns:
@@ -24,100 +36,243 @@ def run_EQeq(cif_dir,cifnames,verbose=False,output_type="files",**kwargs):
     '''
     print('Running EQeq calculations ...')
 
-    # Capture current stdout
-    if verbose == False :
-        original_stdout,original_stderr = sys.stdout,sys.stderr
-        captured_output,captured_error = StringIO(),StringIO()
-        sys.stdout,sys.stderr = captured_output,captured_error
-
     # Input filenames must be absolute
     cifnames = [ _to_absolute_path(cif_dir,cifname,'.cif') for cifname in cifnames]
     
     # Run EQeq with defaults parameters
-    for file in cifnames:
-        if "EQeq" not in file and "openbabel" not in file:
-            if verbose : print(f"Converting file {file} into Openbabel CIF standard format and running charge equilibration.")
-            new_cif = _convert_cif_standard_format(file)
-            _ = run_on_cif(new_cif, output_type="files", method="ewald")
-    # Clean the directory
-    _clean_cif_directory(cif_dir)
+    files = [file for file in cifnames if "EQeq" not in file and "openbabel" not in file]
+    failures = run_in_process_pool(partial(_run_EQeq_on_file,cif_dir=cif_dir,verbose=verbose),files,
+                                   max_workers=max_workers,timeout=timeout,
+                                   log_dir=None if verbose else f"{cif_dir}/logs",method="EQeq")
+    _report_failures(cif_dir,"EQeq",failures)
 
     cifnames_new = glob.glob(f"{cif_dir}/*EQeq*.cif")
-    print(f'Partial charges with method EQeq have been calculated for {len(cifnames)} structures.')
-
-    # Restore stdout
-    if verbose == False:
-        sys.stdout,sys.stderr = original_stdout,original_stderr
-        output_text,error_text = captured_output.getvalue(),captured_error.getvalue()
-#        print(output_text,error_text)
+    print(f'Partial charges with method EQeq have been calculated for {len(files)-len(failures)} structures.')
 
     return cifnames_new
 
-def run_pacmof(cif_dir,cifnames,verbose=False,**kwargs):
+def _run_EQeq_on_file(file,cif_dir,verbose=False):
+    '''
+    Convert a CIF file into the Openbabel CIF standard format and run EQeq on it, in memory.
+    The CIF file with partial charges is written in `cif_dir`.
+    '''
+    if verbose : print(f"Converting file {file} into Openbabel CIF standard format and running charge equilibration.")
+    cif_standard_format = _convert_cif_standard_format(file,output_type="stream")
+    cif_with_charges = run_on_cif(cif_standard_format, output_type="cif", method="ewald")
+    # Write in a temporary file, then rename it, so that a partial CIF file is never read
+    output = get_charged_cifname(cif_dir,file,"EQeq")
+    with open(f"{output}.tmp{os.getpid()}","w") as f:
+        f.write(cif_with_charges)
+    os.replace(f"{output}.tmp{os.getpid()}",output)
+
+def run_pacmof(cif_dir,cifnames,verbose=False,max_workers=None,timeout=600,batch_size=50,**kwargs):
     '''
     Compute the partial charges of framework using the PACMOF method (10.1021/acs.jpcc.4c04879). 
 
     The new CIF files are located in the same directory as the original CIF files.
+    The structures are processed in batches by a pool of processes (see `run_in_process_pool`):
+    each process loads the PACMOF2 model once for all the structures of its batch. The structures
+    of a batch which fails are then processed one by one, to identify those which fail.
 
     Parameters:
         cifnames (str) : Absolute paths for cif input files.
-        verbose (bool) : if True, print the stdout/stderr PACMOF code
+        verbose (bool) : if True, print the stdout/stderr PACMOF code,
+                         otherwise it is written in `<cif_dir>/logs/batch_<i>_pacmof2.log`
+        max_workers (int) : maximum number of batches processed at once (default : number of usable cores)
+        timeout (float) : maximum time in seconds for one structure (default : 600)
+        batch_size (int) : maximum number of structures in a batch (default : 50)
 
     Returns:
         cifnames_new (list) : the list of CIF filenames with partial charges
     '''
     print('Predicting partial charges from PACMOF2 ...')
 
-    # Capture current stdout
-    if verbose == False :
-        original_stdout,original_stderr = sys.stdout,sys.stderr
-        captured_output,captured_error = StringIO(),StringIO()
-        sys.stdout,sys.stderr = captured_output,captured_error
-
     # Input filenames must be absolute
     cifnames = [ _to_absolute_path(cif_dir,cifname,'.cif') for cifname in cifnames]
     
-    # Run EQeq with defaults parameters
-    for file in cifnames:
-        if "EQeq" not in file and "openbabel" not in file:
-            pacmof2.get_charges(file, cif_dir, identifier="_pacmof2")
-    
-    # Clean the directory
-    #_clean_cif_directory(cif_dir)
+    # Run PACMOF2 with defaults parameters
+    files = [file for file in cifnames if "EQeq" not in file and "openbabel" not in file]
+    log_dir = None if verbose else f"{cif_dir}/logs"
+    max_workers = max(1, max_workers or get_usable_cores())
+    batches = _stage_batches(f"{cif_dir}/.staging",files,n_batches=max(min(max_workers,len(files)),
+                                                                         ceil(len(files)/batch_size)))
+    batch_timeout = timeout*max([len(batch) for batch in batches.values()],default=1) if timeout else None
+    run_in_process_pool(partial(_run_pacmof_on_batch,cif_dir=cif_dir),list(batches),
+                        max_workers=max_workers,timeout=batch_timeout,log_dir=log_dir,method="pacmof2")
+    shutil.rmtree(f"{cif_dir}/.staging",ignore_errors=True)
 
-    cifnames_new = glob.glob(f"{cif_dir}/*_pacmof*.cif")
-    print(f'Partial charges with PACMOF2 method have been calculated for {len(cifnames)} structures.')
+    # Structures of the failed batches, one by one
+    missing = [file for file in files if not os.path.isfile(get_charged_cifname(cif_dir,file,"pacmof2"))]
+    failures = run_in_process_pool(partial(_run_pacmof_on_file,cif_dir=cif_dir),missing,
+                                   max_workers=max_workers,timeout=timeout,log_dir=log_dir,method="pacmof2")
+    _report_failures(cif_dir,"pacmof2",failures)
 
-    # Restore stdout
-    if verbose == False:
-        sys.stdout,sys.stderr = original_stdout,original_stderr
-        output_text,error_text = captured_output.getvalue(),captured_error.getvalue()
-#        print(output_text,error_text)
+    cifnames_new = glob.glob(f"{cif_dir}/*_pacmof*.cif")
+    print(f'Partial charges with PACMOF2 method have been calculated for {len(files)-len(failures)} structures.')
 
     return cifnames_new
 
-def fetch_QMOF(cifnames,verbose=False):
+def _stage_batches(staging_dir,files,n_batches):
+    '''
+    Link (or copy) the files into `n_batches` directories `<staging_dir>/batch_<i>`.
+    Returns a dictionary batch directory -> files.
+    '''
+    batches = {}
+    for i in range(min(n_batches,len(files))):
+        batch_dir = f"{staging_dir}/batch_{i}"
+        shutil.rmtree(batch_dir,ignore_errors=True)
+        os.makedirs(batch_dir)
+        batches[batch_dir] = files[i::n_batches]
+        for file in batches[batch_dir]:
+            try:
+                os.link(file,f"{batch_dir}/{os.path.basename(file)}")
+            except OSError:
+                shutil.copyfile(file,f"{batch_dir}/{os.path.basename(file)}")
+    return batches
+
+def _run_pacmof_on_batch(batch_dir,cif_dir):
+    '''
+    Predict the partial charges of all the CIF files of `batch_dir` with PACMOF2, in one process.
+    The new CIF files are written in `cif_dir`.
+
+    With the option `multiple_cifs` of `pacmof2.get_charges`, the model is loaded once for the batch;
+    PACMOF2 still predicts the charges of the CIF files one by one, so the batching only shares the
+    model load and the process start. With a version of PACMOF2 without this option, the files of
+    the batch are processed one by one.
+    '''
+    try:
+        pacmof2.get_charges(batch_dir, cif_dir, identifier="_pacmof2", multiple_cifs=True)
+    except TypeError as e:
+        if "multiple_cifs" not in str(e):
+            raise
+        for file in sorted(glob.glob(f"{batch_dir}/*.cif")):
+            _run_pacmof_on_file(file,cif_dir)
+
+def _run_pacmof_on_file(file,cif_dir):
+    '''
+    Predict the partial charges of a CIF file with PACMOF2, the new CIF file being written in `cif_dir`.
+    '''
+    pacmof2.get_charges(file, cif_dir, identifier="_pacmof2")
+
+def run_in_process_pool(function,files,max_workers=None,timeout=600,log_dir=None,method="charges"):
+    '''
+    Run `function(file)` for each file in its own process, with at most `max_workers` processes at once.
+
+    A process running for more than `timeout` seconds is killed (e.g. EQeq hanging on an unusual CIF).
+    The standard output and error of each process, including those of compiled codes, are written in
+    `<log_dir>/<structure>_<method>.log`; if `log_dir` is None, they are not redirected.
+
+    Parameters:
+        function (callable) : the function applied to each file.
+        files (list) : absolute paths of the input files.
+        max_workers (int) : maximum number of concurrent processes (default : number of usable cores).
+        timeout (float) : maximum time in seconds for one file, None for no limit.
+        log_dir (str) : directory of the log files.
+        method (str) : name of the method, used in the log filenames.
+
+    Returns:
+        failures (dict) : a dictionary file -> reason of the failure.
+    '''
+    max_workers = max(1, max_workers or get_usable_cores())
+    if log_dir is not None:
+        os.makedirs(log_dir,exist_ok=True)
+    pending = list(files)
+    running = {}
+    failures = {}
+    while pending or running:
+        while pending and len(running) < max_workers:
+            file = pending.pop(0)
+            log = None if log_dir is None else f"{log_dir}/{os.path.splitext(os.path.basename(file))[0]}_{method}.log"
+            process = Process(target=_run_with_log,args=(function,file,log))
+            process.start()
+            running[file] = (process,time.time(),log)
+
+        # Wait for a process to finish, or for the next timeout
+        deadlines = [start+timeout-time.time() for _,start,_ in running.values()] if timeout else []
+        wait([process.sentinel for process,_,_ in running.values()],
+             timeout=max(0,min(deadlines)) if deadlines else None)
+
+        for file,(process,start,log) in list(running.items()):
+            if not process.is_alive():
+                process.join()
+                if process.exitcode != 0:
+                    failures[file] = f"exit code {process.exitcode}" + (f", see {log}" if log else "")
+                del running[file]
+            elif timeout and time.time()-start > timeout:
+                process.kill()
+                process.join()
+                failures[file] = f"timeout after {timeout} s"
+                del running[file]
+    return failures
+
+def _run_with_log(function,file,log=None):
+    '''
+    Target of the processes of `run_in_process_pool` : redirect the output file descriptors to the log file.
+    '''
+    if log is not None:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        fd = os.open(log,os.O_WRONLY|os.O_CREAT|os.O_TRUNC,0o644)
+        os.dup2(fd,1)
+        os.dup2(fd,2)
+        os.close(fd)
+    try:
+        function(file)
+    except BaseException:
+        traceback.print_exc()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(1)
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+def _report_failures(cif_dir,method,failures):
+    '''
+    Write the structures whose charges could not be computed in `<cif_dir>/charge_errors_<method>.csv`.
+    '''
+    report = f"{cif_dir}/charge_errors_{method}.csv"
+    if len(failures) > 0:
+        pd.DataFrame({"structure":list(failures.keys()),"error":list(failures.values())}).to_csv(report,index=False)
+        warnings.warn(f"Partial charges with method {method} failed for {len(failures)} structures, see {report}.")
+    elif os.path.isfile(report):
+        os.remove(report)
+
+def fetch_QMOF(cif_dir,cifnames,verbose=False,qmof_dir=None):
     '''
     Fetch the structure in QMOF which corresponds to the same CIF as in COREMOF 
-    and download the new structures with DDED partial charges partial charges .
+    and copy the structures with DDEC partial charges from a local QMOF snapshot (see `src/qmof.py`).
 
     The new CIF files are located in the same directory as the original CIF files.
 
     Parameters:
         cifnames (str) : Absolute paths for cif input files.
+        qmof_dir (str) : Directory of the QMOF snapshot (default : `$SAW_QMOF_DIR`).
 
     Returns:
         cifnames_new (list) : the list of CIF filenames with partial charges.
+        misses (list) : the CIF filenames whose structure has no DDEC charges in the QMOF snapshot.
     '''
-    print('\n\nWARNING : Access to QMOF partial charges not implemented yet, in the current test loop, it only creates copies of the original cif files from the database !')
-    cifnames_new = []
+    print('Fetching DDEC partial charges from the QMOF snapshot ...')
+    index = get_qmof_index(qmof_dir)
+    if len(index) == 0:
+        warnings.warn("No local QMOF snapshot found, set the environment variable SAW_QMOF_DIR.")
+
+    # Input filenames must be absolute
+    cifnames = [ _to_absolute_path(cif_dir,cifname,'.cif') for cifname in cifnames]
+
+    cifnames_new,misses = [],[]
     for cifname in cifnames:
-        cifname_qmof = f'{cifname}_QMOF.cif'
-        shutil.copyfile(cifname,cifname_qmof)
-        print(f"File {cifname_qmof} created.")
+        qmof_cifnames = [qmof_cifname for qmof_cifname in index.get(qmof_refcode(os.path.basename(cifname)),[])
+                         if has_charges(qmof_cifname)]
+        if len(qmof_cifnames) == 0:
+            misses.append(cifname)
+            continue
+        cifname_qmof = get_charged_cifname(cif_dir,cifname,'QMOF')
+        shutil.copyfile(qmof_cifnames[0],cifname_qmof)
+        if verbose : print(f"File {cifname_qmof} created from {qmof_cifnames[0]}.")
         cifnames_new.append(cifname_qmof)
-    print("\n")
-    return cifnames_new
+    print(f'Partial charges from QMOF have been found for {len(cifnames_new)} structures.')
+    return cifnames_new,misses
 
 def _convert_cif_standard_format(input_cif,output_type="file"):
     '''
@@ -137,14 +292,6 @@ def _convert_cif_standard_format(input_cif,output_type="file"):
     else :
         raise ValueError('Output type must be "file" or "stream".')
     
-def _clean_cif_directory(cif_dir):
-    '''
-    A local function to remove files with extension different than '.cif'.
-    '''
-    for file in glob.glob(f'{cif_dir}/*'):
-        if not file.endswith('.cif'):
-            os.remove(file)
-
 def _to_absolute_path(root_directory, file_path, extension):
     # Check if the file path is already absolute
     if os.path.isabs(file_path):
@@ -0,0 +1,128 @@
+"""
+Persistent cache of the CIF files with partial charges computed by EQeq or PACMOF2.
+
+Each charged CIF file is keyed by a hash of the content of the original CIF file, the charge
+method, its parameters and the version of the code computing the charges, and stored in
+`$SAW_CACHE_DIR/charges/<key>/` with a `meta.json` file. Before the charge assignment, the cached
+CIF files are linked (or copied) into the CIF directory of the run, and the charges are only
+computed for the other structures. The cache is limited to `$SAW_CHARGE_CACHE_MAX_GB` GB
+(default 10), the least recently used entries being removed first.
+"""
+import os,json,shutil,threading
+from importlib import metadata
+from src.cache import *
+
+# Parameters of each method, as written by the codes in the name of the charged CIF files
+CHARGE_METHOD_PARAMETERS = {"EQeq":"ewald_1.20_-2.00","pacmof2":"PACMOF2_neutral"}
+CHARGE_METHOD_PACKAGES = {"EQeq":"pyeqeq","pacmof2":"pacmof2"}
+
+def get_charged_cifname(cif_dir,cifname,method):
+    """
+    Name of the CIF file with the partial charges of a method, as written by `run_EQeq`, `run_pacmof` and `fetch_QMOF`.
+
+    Args:
+        cif_dir (str): Directory of the charged CIF files.
+        cifname (str): Path of the original CIF file.
+        method (str): Charge method, 'EQeq', 'pacmof2' or 'QMOF'.
+
+    Returns:
+        cifname (str): Path of the charged CIF file.
+    """
+    stem = os.path.splitext(os.path.basename(cifname))[0]
+    if method == "EQeq":
+        return os.path.join(cif_dir,f"{stem}_openbabel.cif_EQeq_{CHARGE_METHOD_PARAMETERS['EQeq']}.cif")
+    elif method == "pacmof2":
+        return os.path.join(cif_dir,f"{stem}_pacmof2.cif")
+    elif method == "QMOF":
+        return os.path.join(cif_dir,f"{os.path.basename(cifname)}_QMOF.cif")
+    raise ValueError(f"No charged CIF files for method {method}.")
+
+def get_method_version(method):
+    '''
+    Version of the package computing the charges of a method, 'unknown' if it is not installed.
+    '''
+    try:
+        return metadata.version(CHARGE_METHOD_PACKAGES[method])
+    except (KeyError,metadata.PackageNotFoundError):
+        return "unknown"
+
+def get_charge_key(cifname,method):
+    """
+    Cache key of the charged CIF file of a structure.
+    """
+    return hash_items("charges",hash_file(cifname),method,CHARGE_METHOD_PARAMETERS.get(method,""),
+                      get_method_version(method))
+
+def restore_charged_cif(cifname,charged_cifname,method):
+    """
+    Link (or copy) the cached charged CIF file of a structure to `charged_cifname`.
+
+    Args:
+        cifname (str): Path of the original CIF file.
+        charged_cifname (str): Path of the charged CIF file.
+        method (str): Charge method.
+
+    Returns:
+        found (bool): True if the structure was in the cache.
+    """
+    entry = f"{get_cache_dir('charges')}/{get_charge_key(cifname,method)}"
+    if not os.path.isfile(f"{entry}/meta.json"):
+        return False
+    with open(f"{entry}/meta.json") as f:
+        sha256 = json.load(f)["sha256"]
+    if hash_file(f"{entry}/cif") != sha256:
+        # Corrupted entry : compute the charges again
+        shutil.rmtree(entry,ignore_errors=True)
+        return False
+    if os.path.lexists(charged_cifname):
+        os.remove(charged_cifname)
+    try:
+        os.link(f"{entry}/cif",charged_cifname)
+    except OSError:
+        shutil.copyfile(f"{entry}/cif",charged_cifname)
+    touch(entry)
+    return True
+
+def store_charged_cif(cifname,charged_cifname,method):
+    """
+    Add a charged CIF file to the cache (see `evict_charge_cache` for the disk budget).
+
+    Args:
+        cifname (str): Path of the original CIF file.
+        charged_cifname (str): Path of the charged CIF file.
+        method (str): Charge method.
+
+    Returns:
+        stored (bool): True if the file was added to the cache.
+    """
+    cache_dir = get_cache_dir("charges")
+    entry = f"{cache_dir}/{get_charge_key(cifname,method)}"
+    if not os.path.isfile(charged_cifname) or os.path.isdir(entry):
+        return False
+    # Write in a temporary directory, then rename it, so that a partial entry is never read
+    tmp_entry = f"{entry}.tmp{os.getpid()}_{threading.get_ident()}"
+    os.makedirs(tmp_entry,exist_ok=True)
+    shutil.copyfile(charged_cifname,f"{tmp_entry}/cif")
+    with open(f"{tmp_entry}/meta.json","w") as f:
+        json.dump({"source":os.path.basename(cifname),"method":method,
+                   "parameters":CHARGE_METHOD_PARAMETERS.get(method,""),
+                   "version":get_method_version(method),
+                   "sha256":hash_file(f"{tmp_entry}/cif")},f,indent=4)
+    try:
+        os.rename(tmp_entry,entry)
+    except OSError:
+        shutil.rmtree(tmp_entry,ignore_errors=True)
+        return False
+    return True
+
+def evict_charge_cache(max_size_gb=None):
+    """
+    Remove the least recently used charged CIF files when the cache exceeds its disk budget.
+
+    Args:
+        max_size_gb (float, optional): Disk budget of the cache in GB,
+                                       defaults to `$SAW_CHARGE_CACHE_MAX_GB` or 10.
+    """
+    if max_size_gb is None:
+        max_size_gb = float(os.environ.get("SAW_CHARGE_CACHE_MAX_GB",10))
+    return evict_lru(get_cache_dir("charges"),max_size_gb)
@@ -0,0 +1,144 @@
+"""
+Local cache of the CIF files fetched from MOFXDB.
+
+The CIF files returned by MOFXDB for a structure name are stored in
+`$SAW_CACHE_DIR/cif/<mofdb version>/<structure>/`, with a `meta.json` file listing
+the SHA-256 hash of each CIF file. The MOFXDB version is the one reported by the last
+online fetch (stored in `$SAW_CACHE_DIR/cif/mofdb_version`), or the version pinned in
+`parameters/mofdb-version_<version>.txt` if MOFXDB has never been reached.
+
+In offline mode (`saw.py run --offline`, or the environment variable `SAW_OFFLINE=1`),
+structures are only read from the cache and the network is never used.
+
+The origin of each CIF file of a run (local structure store, CIF cache or MOFXDB) and its version
+are recorded in `<cif_dir>/cif_sources.csv`, and reported in the metadata of the workflow outputs.
+"""
+import os,glob,json,shutil,threading
+import pandas as pd
+from src.cache import *
+
+def is_offline():
+    """
+    True if the workflow must not use the network.
+    """
+    return os.environ.get("SAW_OFFLINE","0") not in ["0",""]
+
+def get_pinned_mofdb_version():
+    '''
+    MOFXDB version pinned in `parameters/mofdb-version_<version>.txt`.
+    '''
+    files = glob.glob(f"{os.environ.get('PACKAGE_DIR')}/parameters/mofdb-version_*.txt")
+    if len(files) == 0:
+        return None
+    return os.path.basename(files[0])[len("mofdb-version_"):-len(".txt")]
+
+def get_mofdb_version():
+    """
+    MOFXDB version used as key of the cache : the version reported by the last online fetch,
+    or the pinned version.
+    """
+    version_file = f"{get_cache_dir('cif')}/mofdb_version"
+    if os.path.isfile(version_file):
+        with open(version_file) as f:
+            return f.read().strip()
+    return get_pinned_mofdb_version()
+
+def set_mofdb_version(version):
+    '''
+    Record the MOFXDB version reported by an online fetch.
+    '''
+    if version is None or version == get_mofdb_version():
+        return
+    version_file = f"{get_cache_dir('cif')}/mofdb_version"
+    tmp_file = f"{version_file}.tmp{os.getpid()}_{threading.get_ident()}"
+    with open(tmp_file,"w") as f:
+        f.write(str(version))
+    os.replace(tmp_file,version_file)
+
+def read_cached_cifs(structure,cif_dir,substring="coremof-2019",version=None):
+    """
+    Copy the cached CIF files of a structure into `cif_dir`.
+
+    Args:
+        structure (str): Name of the structure, as passed to MOFXDB.
+        cif_dir (str): Directory where the CIF files are copied.
+        substring (str): Only the CIF files whose name contains `substring` are copied.
+        version (str, optional): MOFXDB version, defaults to `get_mofdb_version()`.
+
+    Returns:
+        cifnames (list) : A list of cif names with absolute path, or None if the structure is not
+                          in the cache (an empty list means that MOFXDB has no such structure in the subset).
+    """
+    version = version or get_mofdb_version()
+    entry = f"{get_cache_dir('cif')}/{version}/{structure}"
+    if not os.path.isfile(f"{entry}/meta.json"):
+        return None
+    with open(f"{entry}/meta.json") as f:
+        hashes = json.load(f)["cifs"]
+    cifnames = []
+    for filename,sha256 in hashes.items():
+        if substring not in filename:
+            continue
+        if hash_file(f"{entry}/{filename}") != sha256:
+            # Corrupted entry : fetch the structure again
+            shutil.rmtree(entry,ignore_errors=True)
+            return None
+        cifname = os.path.join(cif_dir,filename)
+        shutil.copy(f"{entry}/{filename}",cifname)
+        cifnames.append(cifname)
+    touch(entry)
+    return cifnames
+
+def write_cached_cifs(structure,cifs,version=None):
+    """
+    Store the CIF files of a structure fetched from MOFXDB in the cache.
+
+    Args:
+        structure (str): Name of the structure, as passed to MOFXDB.
+        cifs (dict): A dictionary CIF filename -> CIF content, for all the entries returned by MOFXDB.
+        version (str, optional): MOFXDB version of the entries, defaults to `get_mofdb_version()`.
+    """
+    version = version or get_mofdb_version()
+    entry = f"{get_cache_dir('cif')}/{version}/{structure}"
+    if os.path.isdir(entry):
+        shutil.rmtree(entry,ignore_errors=True)
+    # Write in a temporary directory, then rename it, so that a partial entry is never read
+    tmp_entry = f"{entry}.tmp{os.getpid()}_{threading.get_ident()}"
+    os.makedirs(tmp_entry,exist_ok=True)
+    hashes = {}
+    for filename,cif in cifs.items():
+        with open(f"{tmp_entry}/{filename}","w") as f:
+            print(cif,file=f)
+        hashes[filename] = hash_file(f"{tmp_entry}/{filename}")
+    with open(f"{tmp_entry}/meta.json","w") as f:
+        json.dump({"structure":structure,"mofdb_version":version,"cifs":hashes},f,indent=4)
+    try:
+        os.rename(tmp_entry,entry)
+    except OSError:
+        shutil.rmtree(tmp_entry,ignore_errors=True)
+
+def write_cif_sources(cif_dir,sources):
+    """
+    Record the origin of CIF files in `<cif_dir>/cif_sources.csv`, keeping the records of the other files.
+
+    Args:
+        cif_dir (str): Directory of the CIF files.
+        sources (dict): A dictionary CIF filename -> dictionary with the fields `structure`,
+                        `source` ('store', 'cache' or 'mofxdb') and `version`.
+    """
+    records = read_cif_sources(cif_dir)
+    records.update(sources)
+    if len(records) == 0:
+        return
+    df = pd.DataFrame([{"cif":cif,**record} for cif,record in sorted(records.items())])
+    df.to_csv(f"{cif_dir}/cif_sources.csv",index=False)
+
+def read_cif_sources(cif_dir):
+    """
+    Origin of the CIF files of a run (see `write_cif_sources`), empty if it was not recorded.
+    """
+    if not os.path.isfile(f"{cif_dir}/cif_sources.csv"):
+        return {}
+    df = pd.read_csv(f"{cif_dir}/cif_sources.csv",dtype=str,keep_default_na=False)
+    return {row["cif"]:{"structure":row["structure"],"source":row["source"],"version":row["version"]}
+            for _,row in df.iterrows()}
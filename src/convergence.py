@@ -0,0 +1,200 @@
+"""
+Convergence-driven control of the number of cycles of GCMC simulations.
+
+A simulation with a target uncertainty is run in chunks: after each chunk, the average
+absolute loading and its error bar are read from the RASPA output, and combined with the
+ones of the previous chunks, weighted by their numbers of cycles (see `combine_chunks`).
+If the relative uncertainty of the combined loading is above the target, the simulation is
+continued from its restart file for the number of cycles expected to reach the target, until
+the maximal number of cycles is reached. The combined loading is the result of the simulation
+(see `get_loading`); the RASPA outputs of the previous chunks are kept in `Chunks/`.
+
+This module is called from the `run.sh` script of each simulation directory:
+    python -m src.convergence <work_dir>
+which exits with 0 if a new chunk has been prepared, 1 otherwise.
+"""
+import os,sys,glob,json,shutil,math,re
+from src.output_parser import parse
+
+def write_convergence_settings(work_dir,molecule_name,target_uncertainty,max_cycles=None,cycles=2000):
+    """
+    Write the file `convergence.json` which enables the convergence control of a simulation.
+
+    If the file already exists (e.g. a resumed simulation), its chunks, status and combined loading
+    are kept, and only the target uncertainty and the maximal number of cycles are updated.
+
+    Args:
+        work_dir (str): Path of the simulation directory.
+        molecule_name (str): The adsorbed molecule, whose loading is monitored.
+        target_uncertainty (float): Target relative standard error of the absolute loading.
+        max_cycles (int, optional): Maximal number of production cycles, all chunks included.
+                                    Defaults to ten times `cycles`.
+        cycles (int): Number of cycles of the first chunk, and minimal length of the other chunks.
+    """
+    settings_file = f"{work_dir}/convergence.json"
+    settings = {"molecule_name":molecule_name,
+                "cycles":cycles,
+                "chunks":[],
+                "status":"running"}
+    if os.path.isfile(settings_file):
+        with open(settings_file) as f:
+            settings = json.load(f)
+    settings["target_uncertainty"] = target_uncertainty
+    settings["max_cycles"] = max_cycles if max_cycles is not None else 10*cycles
+    with open(settings_file,"w") as f:
+        json.dump(settings,f,indent=4)
+
+def get_loading_error(info,molecule_name):
+    """
+    Read the average absolute loading and its error bar from a parsed RASPA output.
+
+    RASPA splits the production cycles into blocks and prints the error bar of the
+    average loading computed from the block averages. The block entries of the
+    'Number of molecules' section cannot be used directly: `output_parser.parse`
+    stores the blocks of the absolute and excess loadings under the same keys.
+
+    Args:
+        info (dict): A RASPA output parsed with `output_parser.parse`.
+        molecule_name (str): The adsorbed molecule.
+
+    Returns:
+        mean (float): The average absolute loading (cm^3 (STP)/cm^3 framework).
+        error (float): The error bar of the average (NaN if it cannot be read).
+    """
+    loading = info["Number of molecules"][molecule_name]["Average loading absolute [cm^3 (STP)/cm^3 framework]"]
+    mean = loading[0]
+    if "+/-" not in loading or not isinstance(loading[loading.index("+/-")+1],float):
+        return mean, math.nan
+    return mean, loading[loading.index("+/-")+1]
+
+def _relative_error(mean,error):
+    '''
+    Error bar divided by the average : 0 or infinite for a zero average, NaN if the error bar is unknown.
+    '''
+    if math.isnan(error):
+        return math.nan
+    if mean == 0:
+        return 0.0 if error == 0 else math.inf
+    return abs(error/mean)
+
+def get_relative_standard_error(info,molecule_name):
+    """
+    Compute the relative uncertainty of the absolute loading from a parsed RASPA output.
+
+    Args:
+        info (dict): A RASPA output parsed with `output_parser.parse`.
+        molecule_name (str): The adsorbed molecule.
+
+    Returns:
+        mean (float): The average absolute loading (cm^3 (STP)/cm^3 framework).
+        rse (float): The error bar of the absolute loading divided by its average
+                     (NaN if it cannot be read).
+    """
+    mean,error = get_loading_error(info,molecule_name)
+    return mean, _relative_error(mean,error)
+
+def combine_chunks(chunks):
+    """
+    Combine the averages of the chunks of a simulation, weighted by their numbers of cycles.
+
+    The chunks are independent runs of the same Markov chain : the error bar of the combined
+    average is sqrt(sum((n_i*e_i)^2))/N, for chunks of n_i cycles with error bars e_i, N cycles in total.
+
+    Args:
+        chunks (list): A list of dictionaries with the `cycles`, `loading` and `error` of each chunk.
+
+    Returns:
+        loading (float): The combined average absolute loading.
+        rse (float): Its relative uncertainty (NaN if the error bar of a chunk is unknown).
+    """
+    total = sum(chunk["cycles"] for chunk in chunks)
+    loading = sum(chunk["cycles"]*chunk["loading"] for chunk in chunks)/total
+    error = math.sqrt(sum((chunk["cycles"]*chunk["error"])**2 for chunk in chunks))/total
+    return loading, _relative_error(loading,error)
+
+def prepare_continuation(work_dir):
+    """
+    Check the convergence of a simulation after its last chunk and prepare the next chunk if needed.
+
+    The convergence is judged on the average of all the chunks (see `combine_chunks`), written with
+    its relative uncertainty in `convergence.json` (`loading` and `relative_uncertainty`).
+    The number of cycles of the next chunk is estimated from the current relative standard
+    error, which decreases as the inverse square root of the total number of cycles.
+
+    Args:
+        work_dir (str): Path of the simulation directory.
+
+    Returns:
+        bool: True if a new chunk has been prepared, False if the simulation is converged,
+              reached the maximal number of cycles or has no convergence control.
+    """
+    settings_file = f"{work_dir}/convergence.json"
+    output_files = glob.glob(f"{work_dir}/Output/System_0/*.data")
+    if not os.path.isfile(settings_file) or len(output_files) != 1:
+        return False
+    with open(settings_file) as f:
+        settings = json.load(f)
+    with open(f"{work_dir}/simulation.input") as f:
+        script = f.read()
+    cycles = int(re.search(r"^\s*NumberOfCycles\s+(\d+)",script,re.M).group(1))
+
+    with open(output_files[0]) as f:
+        loading,error = get_loading_error(parse(f.read()),settings["molecule_name"])
+    settings["chunks"].append({"cycles":cycles,"loading":loading,"error":error,
+                               "relative_uncertainty":_relative_error(loading,error)})
+    settings["loading"],rse = combine_chunks(settings["chunks"])
+    settings["relative_uncertainty"] = rse
+    total = sum(chunk["cycles"] for chunk in settings["chunks"])
+    remaining = settings["max_cycles"] - total
+
+    if rse <= settings["target_uncertainty"]:
+        settings["status"] = "converged"
+    elif not math.isfinite(rse) or remaining < settings["cycles"]:
+        settings["status"] = "not converged"
+    if settings["status"] != "running":
+        with open(settings_file,"w") as f:
+            json.dump(settings,f,indent=4)
+        return False
+
+    next_cycles = math.ceil(1.1*total*(rse/settings["target_uncertainty"])**2) - total
+    next_cycles = int(min(max(next_cycles,settings["cycles"]),remaining))
+
+    # Keep the output of the chunk, and start the next one from its final configuration
+    os.makedirs(f"{work_dir}/Chunks",exist_ok=True)
+    shutil.move(output_files[0],f"{work_dir}/Chunks/chunk_{len(settings['chunks'])}.data")
+    restart = glob.glob(f"{work_dir}/Restart/System_0/restart_*")[0]
+    os.makedirs(f"{work_dir}/RestartInitial/System_0",exist_ok=True)
+    shutil.copy(restart,f"{work_dir}/RestartInitial/System_0/")
+    shutil.rmtree(f"{work_dir}/CrashRestart",ignore_errors=True)
+    for keyword,value in [("NumberOfCycles",next_cycles),("NumberOfInitializationCycles",0),
+                          ("PrintEvery",max(next_cycles//10,1)),("RestartFile","yes")]:
+        script = re.sub(rf"^(\s*{keyword}\s+)\S+",rf"\g<1>{value}",script,flags=re.M)
+    with open(f"{work_dir}/simulation.input","w") as f:
+        f.write(script)
+    with open(settings_file,"w") as f:
+        json.dump(settings,f,indent=4)
+    print(f"Relative uncertainty {rse:.3f} > {settings['target_uncertainty']}, running {next_cycles} more cycles.")
+    return True
+
+def get_loading(work_dir,info,molecule_name):
+    """
+    Average absolute loading (cm^3 (STP)/cm^3 framework) of a simulation.
+
+    Args:
+        work_dir (str): Path of the simulation directory.
+        info (dict): The RASPA output of the simulation (of its last chunk), parsed with `output_parser.parse`.
+        molecule_name (str): The adsorbed molecule.
+
+    Returns:
+        loading (float): The average of all the chunks with the convergence control, the average of the RASPA output otherwise.
+    """
+    settings_file = f"{work_dir}/convergence.json"
+    if os.path.isfile(settings_file):
+        with open(settings_file) as f:
+            settings = json.load(f)
+        if len(settings["chunks"]) > 0 and "loading" in settings:
+            return settings["loading"]
+    return info["Number of molecules"][molecule_name]["Average loading absolute [cm^3 (STP)/cm^3 framework]"][0]
+
+if __name__ == "__main__":
+    sys.exit(0 if prepare_continuation(sys.argv[1]) else 1)
@@ -1,6 +1,7 @@
 import os,glob
 from src.output_parser import *
 from src.input_parser import *
+from src.convergence import get_loading
 import pandas as pd
 import secrets
 import platform
@@ -181,9 +182,8 @@ def output_isotherms_to_csv(output_dir,sim_dir_names=None,verbose=False):
             results.append(parse(string_output))
         gas = row['molecule_name']
         uptakes = [[r['Thermo/Baro-stat NHC parameters']['External Pressure'][0],
-                    r["Number of molecules"][gas]
-                    ["Average loading absolute [cm^3 (STP)/cm^3 framework]"][0]]
-                    for r in results]
+                    get_loading(f'{output_dir}/gcmc/{simkey}',r,gas)]
+                    for simkey,r in zip(simkeys,results)]
         df_iso = pd.DataFrame(uptakes,columns=['pressure(Pa)','uptake(cm^3 (STP)/cm^3 framework)']).sort_values(by='pressure(Pa)')
         df_iso['pressure(bar)'] = df_iso['pressure(Pa)']/100000
         file_out = f'{isotherm_dir}/{row["isokey"]}.csv'
@@ -212,7 +212,7 @@ def output_to_json(json_file,output_dir,sim_dir_names=None,verbose=False):
     dict_results.update({"input":dict_input})
 
     # Add running metadata
-    dict_metadata = get_workflow_metadata(dict_input)
+    dict_metadata = get_workflow_metadata(dict_input,output_dir)
     dict_results.update({"metadata":dict_metadata})
 
     # Add parameters for each simulation
@@ -391,7 +391,7 @@ def get_git_commit_hash():
         else :
             return commit_hash
 
-def get_workflow_metadata(dict_input):
+def get_workflow_metadata(dict_input,output_dir=None):
     metadata = {}
 
     # Timestamp of the workflow run
@@ -419,11 +419,22 @@ def get_workflow_metadata(dict_input):
     metadata['workflow_package_git_hash'] = git_hash
     os.chdir(original_dir)
 
+    # Origin of each CIF file (local structure store, CIF cache or MOFXDB) and its version
+    cif_sources = read_cif_sources(f"{output_dir}/cif") if output_dir is not None else {}
+    if len(cif_sources) > 0:
+        metadata['cif_sources'] = cif_sources
+    versions = set(record['version'] for record in cif_sources.values())
+
     # Metadata with source of cif structural file (e.g : MOFXDB version)
     try:
         cif_source = dict_input.get('database', 'mofxdb')
 
-        if cif_source == 'mofxdb':
+        if cif_source == 'mofxdb' and len(versions) == 1:
+            # All the structures have the same version, whatever their origin
+            metadata['cif_source'] = {'database': 'mofxdb', 'version': versions.pop()}
+        elif cif_source == 'mofxdb' and is_offline():
+            metadata['cif_source'] = {'database': 'mofxdb', 'version': get_mofdb_version()}
+        elif cif_source == 'mofxdb':
             for mof in fetch():
                 mofdb_version = mof.json_repr['mofdb_version']
                 metadata['cif_source'] = {'database': 'mofxdb', 'version': mofdb_version}
@@ -460,7 +471,7 @@ def extract_properties(row,root_output_dir):
     r = parse(string_output)
     gas = row['molecule_name']
     row['Pressure(Pa)'] = r['Thermo/Baro-stat NHC parameters']['External Pressure'][0]
-    row['uptake(cm^3 (STP)/cm^3 framework)'] = r["Number of molecules"][gas]["Average loading absolute [cm^3 (STP)/cm^3 framework]"][0]
+    row['uptake(cm^3 (STP)/cm^3 framework)'] = get_loading(f'{root_output_dir}/gcmc/{simkey}',r,gas)
     return row
 
 def merge_json(output_dir, json_runfiles, filename='run_merged.json'):
@@ -0,0 +1,146 @@
+"""
+Content-addressed cache of the energy grids computed by RASPA (MakeGrid).
+
+RASPA stores the grids of a framework in `$RASPA_DIR/share/raspa/grids/<forcefield>/<framework>/<spacing>/`,
+one file per pseudo-atom type (`<framework>_<atom type>_shifted.grid`) plus one file for the
+electrostatic potential (`<framework>_Electrostatics_Ewald.grid`). These paths only depend on the
+names of the framework and forcefield, not on their content.
+
+In the cache, each grid file is keyed by a hash of the CIF content, the forcefield files, the grid
+spacing, the pseudo-atom type and the cutoff. Before the grid calculations, the cached grids are
+copied into the RASPA directory and only the missing atom types are computed; the new grids are
+added to the cache once computed. The cache is limited to `$SAW_GRID_CACHE_MAX_GB` GB (default 50),
+the least recently used grids being removed first.
+"""
+import os,glob,json,shutil
+from src.cache import *
+
+CUTOFF = 12
+ELECTROSTATICS = "Electrostatics"
+
+def get_raspa_grid_dir(forcefield,structure,spacing):
+    """
+    Return the directory where RASPA reads and writes the grids of a framework.
+    """
+    return f"{os.environ.get('RASPA_DIR')}/share/raspa/grids/{forcefield}/{structure}/{float(spacing):f}"
+
+def get_forcefield_hash(forcefield):
+    '''
+    Hash of the files of a forcefield, read in the RASPA directory or in `parameters/forcefield`.
+    '''
+    for path in [f"{os.environ.get('RASPA_DIR')}/share/raspa/forcefield/{forcefield}",
+                 f"{os.environ.get('PACKAGE_DIR')}/parameters/forcefield/{forcefield}"]:
+        if os.path.isdir(path):
+            files = sorted(f for f in glob.glob(f"{path}/*") if os.path.isfile(f))
+            return hash_items(*[hash_file(f) for f in files])
+    return hash_items(forcefield)
+
+def get_grid_keys(cif_path_filename,forcefield,spacing,grid_types,cutoff=CUTOFF):
+    """
+    Compute the cache keys of the grids of a framework.
+
+    Args:
+        cif_path_filename (str): Path of the CIF file of the framework.
+        forcefield (str): Name of the forcefield.
+        spacing (float): Grid spacing (angstrom).
+        grid_types (list): The pseudo-atom types, and 'Electrostatics' for the Coulomb grid.
+        cutoff (float): Cutoff of the interactions (angstrom).
+
+    Returns:
+        keys (dict): A dictionary grid type -> cache key.
+    """
+    cif_hash = hash_file(cif_path_filename)
+    forcefield_hash = get_forcefield_hash(forcefield)
+    return {grid_type: hash_items("grid",cif_hash,forcefield_hash,f"{float(spacing):f}",grid_type,cutoff)
+            for grid_type in grid_types}
+
+def restore_grids(cif_path_filename,structure,forcefield,spacing,grid_types):
+    """
+    Copy the cached grids of a framework into the RASPA grid directory.
+
+    Args:
+        cif_path_filename (str): Path of the CIF file of the framework.
+        structure (str): Framework name used by RASPA.
+        forcefield (str): Name of the forcefield.
+        spacing (float): Grid spacing (angstrom).
+        grid_types (list): The pseudo-atom types, and 'Electrostatics' for the Coulomb grid.
+
+    Returns:
+        missing (list): The grid types which are not in the cache.
+    """
+    cache_dir = get_cache_dir("grids")
+    raspa_grid_dir = get_raspa_grid_dir(forcefield,structure,spacing)
+    keys = get_grid_keys(cif_path_filename,forcefield,spacing,grid_types)
+    missing = []
+    for grid_type,key in keys.items():
+        entry = f"{cache_dir}/{key}"
+        if not os.path.isfile(f"{entry}/meta.json"):
+            missing.append(grid_type)
+            continue
+        with open(f"{entry}/meta.json") as f:
+            suffix = json.load(f)["suffix"]
+        os.makedirs(raspa_grid_dir,exist_ok=True)
+        shutil.copy(f"{entry}/grid",f"{raspa_grid_dir}/{structure}_{grid_type}_{suffix}")
+        touch(entry)
+    return missing
+
+def write_grid_keys(work_dir,cif_path_filename,structure,forcefield,spacing,grid_types):
+    """
+    Write the cache keys of the grids computed by a MakeGrid job in `<work_dir>/grid_cache.json`,
+    so that `store_grids` adds them to the cache once the job has run.
+
+    Args:
+        work_dir (str): Directory of the MakeGrid job.
+        cif_path_filename (str): Path of the CIF file of the framework.
+        structure (str): Framework name used by RASPA.
+        forcefield (str): Name of the forcefield.
+        spacing (float): Grid spacing (angstrom).
+        grid_types (list): The grid types computed by the job.
+    """
+    keys = get_grid_keys(cif_path_filename,forcefield,spacing,grid_types)
+    with open(f"{work_dir}/grid_cache.json","w") as f:
+        json.dump({"structure":structure,"forcefield":forcefield,"spacing":spacing,"keys":keys},f,indent=4)
+
+def store_grids(work_dir,max_size_gb=None):
+    """
+    Add the grids computed by the MakeGrid job of `work_dir` to the cache.
+
+    Args:
+        work_dir (str): Directory of a finished MakeGrid job, with its `grid_cache.json` file.
+        max_size_gb (float, optional): Disk budget of the cache in GB,
+                                       defaults to `$SAW_GRID_CACHE_MAX_GB` or 50.
+
+    Returns:
+        stored (list): The grid types added to the cache.
+    """
+    if not os.path.isfile(f"{work_dir}/grid_cache.json"):
+        return []
+    with open(f"{work_dir}/grid_cache.json") as f:
+        info = json.load(f)
+    cache_dir = get_cache_dir("grids")
+    raspa_grid_dir = get_raspa_grid_dir(info["forcefield"],info["structure"],info["spacing"])
+    stored = []
+    for grid_type,key in info["keys"].items():
+        entry = f"{cache_dir}/{key}"
+        prefix = f"{info['structure']}_{grid_type}_"
+        files = [f for f in glob.glob(f"{raspa_grid_dir}/{prefix}*.grid")
+                 if os.path.basename(f)[len(prefix):] in ["shifted.grid","not_shifted.grid","Ewald.grid"]]
+        if len(files) == 0 or os.path.isdir(entry):
+            continue
+        # Write in a temporary directory, then rename it, so that a partial entry is never read
+        tmp_entry = f"{entry}.tmp{os.getpid()}"
+        os.makedirs(tmp_entry,exist_ok=True)
+        shutil.copy(files[0],f"{tmp_entry}/grid")
+        with open(f"{tmp_entry}/meta.json","w") as f:
+            json.dump({"suffix":os.path.basename(files[0])[len(prefix):],"grid_type":grid_type,
+                       "structure":info["structure"],"forcefield":info["forcefield"],
+                       "spacing":info["spacing"]},f,indent=4)
+        try:
+            os.rename(tmp_entry,entry)
+            stored.append(grid_type)
+        except OSError:
+            shutil.rmtree(tmp_entry,ignore_errors=True)
+    if max_size_gb is None:
+        max_size_gb = float(os.environ.get("SAW_GRID_CACHE_MAX_GB",50))
+    evict_lru(cache_dir,max_size_gb)
+    return stored
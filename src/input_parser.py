@@ -3,16 +3,24 @@ from itertools import product
 import sys
 import os,glob
 from mofdb_client import fetch
-from ase.io import read
 from math import ceil
 import pandas as pd
 import secrets
 import warnings
 from src.charge import *
+from src.charge import _to_absolute_path,_report_failures
+from src.charge_cache import *
+from src.cif_cache import *
+from src.structure_db import *
+from src.structure_store import *
 import numpy as np
 from pathlib import Path
 import shutil
 import fnmatch
+import time
+import urllib.parse,urllib.request
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
 
 # Careful with these lines, since bugs might appear with C++ shared library call
 #try:
@@ -47,7 +55,16 @@ def parse_json_to_list(filename):#,cifnames):
         raise ValueError("Invalid number of pressure values. Expected 2.")
     Pmin, Pmax = dict_parameters["pressure"]
     npoints = dict_parameters["npoints"]
-    dict_parameters["pressure"] = [Pmin + (Pmax - Pmin) * i / (npoints - 1) for i in range(npoints)]
+    pressure_spacing = dict_default.get("pressure_spacing","linear")
+    if pressure_spacing == "linear":
+        dict_parameters["pressure"] = [Pmin + (Pmax - Pmin) * i / (npoints - 1) for i in range(npoints)]
+    elif pressure_spacing in ["log","adaptive"]:
+        # Adaptive isotherms start from a log-spaced seed set, refined after the first simulations
+        if Pmin <= 0:
+            raise ValueError("The minimum pressure must be positive for log-spaced pressures.")
+        dict_parameters["pressure"] = [float(p) for p in np.geomspace(Pmin, Pmax, npoints)]
+    else:
+        raise ValueError(f"Invalid pressure spacing '{pressure_spacing}'. Expected 'linear', 'log' or 'adaptive'.")
 
     # Check consistency of RASPA inputs
     check_input_raspa(dict_parameters["molecule_name"])
@@ -90,7 +107,8 @@ def parse_json_to_dict(filename):
     data_flat.update(data["defaults"])
     return data_flat
 
-def get_cifs(l_dict_parameters, data_dir, database='mofxdb', verbose=False,**kwargs):
+def get_cifs(l_dict_parameters, data_dir, database='mofxdb', verbose=False, fetch_workers=8,
+             charge_workers=None, charge_timeout=600, charge_cache="yes", qmof_fallback=None, **kwargs):
     """
     Generate CIF files from a JSON file containing structures.
 
@@ -98,6 +116,11 @@ def get_cifs(l_dict_parameters, data_dir, database='mofxdb', verbose=False,**kwa
         l_dict_parameters (list) : a list of dictionaries containing each set of simulation parameters.
         data_dir (str) : the root path for outputs
         database (str, optional): Database name. Default is 'mofxdb'. Possible values : {'moxdb','local'}.
+        fetch_workers (int, optional): Number of structures fetched at once from MOFXDB. Default is 8.
+        charge_workers (int, optional): Number of processes computing partial charges. Default is the number of usable cores.
+        charge_timeout (float, optional): Maximum time in seconds of the charge calculation of one structure. Default is 600.
+        charge_cache (str, optional): If 'yes', charged CIF files are reused from the charge cache. Default is 'yes'.
+        qmof_fallback (str, optional): Charge method ('EQeq' or 'pacmof2') of the structures which are not in the QMOF snapshot. Default is None.
         **kwargs: Additional keyword arguments passed to cif_from_mofxdb.
 
     Raises:
@@ -120,22 +143,27 @@ def get_cifs(l_dict_parameters, data_dir, database='mofxdb', verbose=False,**kwa
             _ = dict_params["charge_method"]
         except Exception as e:
             dict_params["charge_method"]=None
-    structures = set(structures)
-
-    # Download CIF files from databases
+    structures = sorted(set(structures))
+
+    # Download CIF files from databases, several structures at once
+    if database == 'mofxdb':
+        mofxdb_cifnames,_ = fetch_cifs_from_mofxdb(structures, data_dir, max_workers=fetch_workers, **kwargs)
+    elif database == 'mixed':
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter("always")
+            mofxdb_cifnames,_ = fetch_cifs_from_mofxdb(structures, data_dir, max_workers=fetch_workers, **kwargs)
     cifnames_nested = []
     for structure in structures:
         if database == 'mofxdb':
-            cifnames_nested.append(cif_from_mofxdb(structure, data_dir, **kwargs))
+            cifnames_nested.append(mofxdb_cifnames[structure])
         elif database == 'local':
             cifnames_nested.append(cif_from_local_directory(structure, data_dir))
         elif database == 'mixed':
             local_cifs = []
-            mofxdb_cifs = []
+            mofxdb_cifs = mofxdb_cifnames[structure]
             with warnings.catch_warnings(record=True) as w:
                 warnings.simplefilter("always")
                 local_cifs = cif_from_local_directory(structure, data_dir)
-                mofxdb_cifs = cif_from_mofxdb(structure, data_dir, **kwargs)
             if not local_cifs and not mofxdb_cifs:
                 warnings.warn(f"{structure} not found in both local directory and MOFXDB.")
             # By default we take the local CIFs
@@ -163,25 +191,42 @@ def get_cifs(l_dict_parameters, data_dir, database='mofxdb', verbose=False,**kwa
     for charge_method in charge_methods :
         if charge_method not in ["None","",None]:
             cifnames_modified = cif_with_charges(cif_dir=cif_dir,cifnames_input=cifnames_database,
-                                 method=charge_method,verbose=verbose)
+                                 method=charge_method,verbose=verbose,
+                                 max_workers=charge_workers,timeout=charge_timeout,
+                                 use_cache=(charge_cache == "yes"),qmof_fallback=qmof_fallback)
 
     # Assign the correct CIF file depending on the charge method
+    l_dict_parameters_assigned = []
     for dict_params in l_dict_parameters:
         charge_method = dict_params["charge_method"]
         structure = dict_params["structure"]
         if charge_method not in ["None","",None]:
-            # CIF name from charge assignment
+            # Method which actually computed the charges of the structure
+            charge_source = charge_method
+            if (charge_method == "QMOF" and qmof_fallback in ["EQeq","pacmof2"]
+                    and not fnmatch.filter(os.listdir(cif_dir),f"*{structure}*QMOF*.cif")):
+                charge_source = qmof_fallback
+            # CIF name from charge assignment, the structures whose charges failed are skipped
+            if not fnmatch.filter(os.listdir(cif_dir),f"*{structure}*{charge_source}*.cif"):
+                warnings.warn(f"No CIF file with partial charges from {charge_method} for {structure}, its simulations are skipped.")
+                continue
             dict_params["structure"] = _get_cifname_matching(cif_dir,
-                                                             f"*{structure}*{charge_method}*.cif")
+                                                             f"*{structure}*{charge_source}*.cif")
+            dict_params["charge_source"] = charge_source
         else:
-            # CIF name from the original database
+            # CIF name from the original database, the structures which were not found are skipped
             exclude_list = [el for el in CHARGE_METHOD if el not in ["None","",None]]
             exclude_list.append("openbabel")
+            if not [f for f in fnmatch.filter(os.listdir(cif_dir),f"*{structure}*.cif")
+                    if not any(excl in f for excl in exclude_list)]:
+                warnings.warn(f"No CIF file for {structure}, its simulations are skipped.")
+                continue
             dict_params["structure"] = _get_cifname_matching(cif_dir,f"*{structure}*.cif",
                                                              exclude_pattern=exclude_list)
+        l_dict_parameters_assigned.append(dict_params)
     cifnames_database = _get_basename(cifnames_database)
     cifnames_modified = _get_basename(cifnames_modified)
-    return cifnames_modified,l_dict_parameters
+    return cifnames_modified,l_dict_parameters_assigned
 
 def _get_cifname_matching(cif_dir, pattern, exclude_pattern=None):
     """
@@ -239,10 +284,91 @@ def _get_basename(filenames):
     '''
     return [os.path.splitext(os.path.basename(path))[0] for path in filenames]
 
+# Origin of the CIF files written by `cif_from_mofxdb` : CIF path -> structure, source and version
+_CIF_SOURCES = {}
+
+def fetch_cifs_from_mofxdb(structures, data_dir, max_workers=8, retries=3, backoff=1.0, **kwargs):
+    """
+    Fetch the CIF files of several structures from MOFX-DB with a pool of threads.
+
+    A structure whose query fails (e.g. network error, server error) is retried `retries` times,
+    waiting `backoff`, 2*`backoff`, 4*`backoff`, ... seconds between two attempts. The structures
+    which could not be fetched are listed with their error in `<data_dir>/cif/fetch_errors.csv`.
+
+    Args:
+        structures (list): Names of the structures.
+        data_dir (str): Parent directory.
+        max_workers (int, optional): Maximum number of concurrent queries. Default is 8.
+        retries (int, optional): Number of retries of a failed query. Default is 3.
+        backoff (float, optional): Delay before the first retry, in seconds. Default is 1.
+        **kwargs: Additional keyword arguments passed to cif_from_mofxdb.
+
+    Returns:
+        cifnames (dict) : A dictionary structure -> list of cif names with absolute path
+                          (empty if the structure was not found or could not be fetched).
+        errors (dict) : A dictionary structure -> error message, for the structures which could not be fetched.
+    """
+    def fetch_structure(structure):
+        for attempt in range(retries+1):
+            try:
+                return cif_from_mofxdb(structure, data_dir, **kwargs), None
+            except Exception as e:
+                if attempt == retries:
+                    return [], f"{type(e).__name__}: {e}"
+                time.sleep(backoff*2**attempt)
+
+    results = {}
+    if len(structures) > 0:
+        with ThreadPoolExecutor(max_workers=max(1,min(max_workers,len(structures)))) as pool:
+            results = dict(zip(structures, pool.map(fetch_structure, structures)))
+    cifnames = {structure: result[0] for structure,result in results.items()}
+    errors = {structure: result[1] for structure,result in results.items() if result[1] is not None}
+
+    # Origin of each CIF file, reported in the metadata of the outputs
+    write_cif_sources(f"{data_dir}/cif",{os.path.basename(cifname): _CIF_SOURCES[cifname]
+                                         for cifnames_structure in cifnames.values()
+                                         for cifname in cifnames_structure if cifname in _CIF_SOURCES})
+
+    # Report of the structures which could not be fetched
+    report = f"{data_dir}/cif/fetch_errors.csv"
+    if len(errors) > 0:
+        pd.DataFrame({"structure":list(errors.keys()),"error":list(errors.values())}).to_csv(report,index=False)
+        warnings.warn(f"{len(errors)} structures could not be fetched from MOFXDB, see {report}.")
+    elif os.path.isfile(report):
+        os.remove(report)
+    return cifnames, errors
+
+def _fetch_mofxdb(name):
+    '''
+    Query MOFX-DB by structure name with `mofdb_client`, or, if the environment variable `SAW_MOFXDB_URL`
+    is set, from the server at this URL (a mirror or a test server with the same API).
+    '''
+    url = os.environ.get("SAW_MOFXDB_URL")
+    if url is None:
+        return fetch(name=name)
+    mofs = []
+    page, pages = 1, 1
+    while page <= pages:
+        query = urllib.parse.urlencode({"name":name,"page":page})
+        with urllib.request.urlopen(f"{url}/mofs.json?{query}", timeout=60) as response:
+            data = json.load(response)
+        for entry in data["results"]:
+            mofs.append(SimpleNamespace(name=entry["name"],database=entry["database"],cif=entry["cif"],
+                                        isotherms=entry.get("isotherms",[]),json_repr=entry))
+        pages = data.get("pages",1)
+        page += 1
+    return mofs
+
 def cif_from_mofxdb(structure, data_dir, substring = "coremof-2019", verbose=False):
     """
     Generate CIF files from MOFX-DB based on a given structure name.
 
+    The CIF files are looked up first in the local structure store (see `saw.py db import`),
+    then in the local CIF cache when the structure has already been fetched (see `cif_cache.py`);
+    otherwise they are fetched from MOFX-DB and cached. The origin of each CIF file is recorded
+    in `_CIF_SOURCES`.
+    In offline mode, structures which are not in the store or the cache are skipped with a warning.
+
     Args:
         structure (str): Name of the structure.
         data_dir (str): Parent directory.
@@ -251,20 +377,51 @@ def cif_from_mofxdb(structure, data_dir, substring = "coremof-2019", verbose=Fal
         cifnames (list) : A list of cif names with absolute path fetched from the database.
     """
 
+    # Structures imported in the local structure store
     cifnames = []
-    for mof in fetch(name=structure):
-        cifname = os.path.join(f"{data_dir}/cif/{mof.name}_{mof.database.lower().replace(' ', '-')}.cif")
-
-        # Filter using original database key
+    for name, database, version, path in lookup_structure(structure):
+        # Same name as the CIF files fetched from MOFX-DB
+        cifname = f"{data_dir}/cif/{name}_{database_key(database)}.cif"
         if substring in cifname:
-            with open(cifname, 'w') as f:
-                print(mof.cif, file=f)
-                if verbose : print(f'Cif has been written in {cifname}.')
+            shutil.copy(path, cifname)
             cifnames.append(cifname)
-
-            # Indicate the number of isotherms found in MOFXDB (can be used for reproducibility purposes)
-            if verbose:
-                print(f"Mof with name {mof.name} from {mof.database} has already {len(mof.isotherms)} isotherms stored in MOFX-DB.")
+            _CIF_SOURCES[cifname] = {"structure":structure,"source":"store","version":version}
+    if len(cifnames) > 0:
+        if verbose : print(f"{structure} read from the local structure store.")
+        return cifnames
+
+    cifnames = read_cached_cifs(structure, f"{data_dir}/cif", substring=substring)
+    if cifnames is not None:
+        if verbose : print(f"{structure} read from the CIF cache.")
+        for cifname in cifnames:
+            _CIF_SOURCES[cifname] = {"structure":structure,"source":"cache","version":get_mofdb_version()}
+    elif is_offline():
+        warnings.warn(f"{structure} is not in the CIF cache and cannot be fetched from MOFXDB in offline mode.")
+        return []
+    else:
+        cifnames = []
+        cifs = {}
+        mofdb_version = None
+        for mof in _fetch_mofxdb(structure):
+            filename = f"{mof.name}_{mof.database.lower().replace(' ', '-')}.cif"
+            cifname = os.path.join(f"{data_dir}/cif/{filename}")
+            cifs[filename] = mof.cif
+            mofdb_version = getattr(mof, "json_repr", {}).get("mofdb_version", mofdb_version)
+
+            # Filter using original database key
+            if substring in cifname:
+                with open(cifname, 'w') as f:
+                    print(mof.cif, file=f)
+                    if verbose : print(f'Cif has been written in {cifname}.')
+                cifnames.append(cifname)
+                _CIF_SOURCES[cifname] = {"structure":structure,"source":"mofxdb",
+                                         "version":getattr(mof, "json_repr", {}).get("mofdb_version")}
+
+                # Indicate the number of isotherms found in MOFXDB (can be used for reproducibility purposes)
+                if verbose:
+                    print(f"Mof with name {mof.name} from {mof.database} has already {len(mof.isotherms)} isotherms stored in MOFX-DB.")
+        set_mofdb_version(mofdb_version)
+        write_cached_cifs(structure, cifs)
 
     # Add a warning for the structure has no entry in the structural databases
     if len(cifnames)==0:
@@ -272,27 +429,65 @@ def cif_from_mofxdb(structure, data_dir, substring = "coremof-2019", verbose=Fal
 
     return cifnames
 
-def cif_with_charges(cif_dir,cifnames_input,method='EQeq',verbose=False):
+def cif_with_charges(cif_dir,cifnames_input,method='EQeq',verbose=False,max_workers=None,timeout=600,use_cache=True,
+                     qmof_fallback=None):
 
     '''
     Returns only the subset of cif filenames containing partial charges.
 
+    The charged CIF files found in the charge cache (see `src/charge_cache.py`) are linked into `cif_dir`,
+    and the charges are only computed for the other structures.
+
     Args:
         cif_dir (str): The absolute path of the directory where CIFs are stored
         method (str) : A keyword to select the charge assignment method;
-                        possible values : 'EQeq',"pacmof2"
+                        possible values : 'EQeq',"pacmof2","QMOF"
+        max_workers (int) : Number of processes computing partial charges (default : number of usable cores)
+        timeout (float) : Maximum time in seconds for one structure; structures which fail or time out
+                          are listed in `<cif_dir>/charge_errors_<method>.csv`
+        use_cache (bool) : If True, read and write the charge cache
+        qmof_fallback (str) : With method 'QMOF', the method ('EQeq' or 'pacmof2') used for the structures
+                              which are not in the QMOF snapshot; they are skipped if None
     Returns:
         cifnames (list): A list CIF absolute filenames
     '''
-    if method == 'EQeq':
-        cifnames = run_EQeq(cif_dir,cifnames_input,verbose=verbose)
-    elif method == 'QMOF':
-        cifnames = fetch_QMOF(cifnames_input,verbose=verbose)
-    elif method == 'pacmof2':
-        cifnames = run_pacmof(cif_dir,cifnames_input,verbose=verbose)
-    else:
+    if method == 'QMOF':
+        cifnames,misses = fetch_QMOF(cif_dir,cifnames_input,verbose=verbose)
+        failures = {cifname:"not in the QMOF snapshot" for cifname in misses}
+        if qmof_fallback in ['EQeq','pacmof2'] and len(misses) > 0:
+            cif_with_charges(cif_dir,misses,method=qmof_fallback,verbose=verbose,
+                             max_workers=max_workers,timeout=timeout,use_cache=use_cache)
+            for cifname in misses:
+                # The charged CIF file keeps the name of the fallback method, see `get_cifs`
+                charged_cifname = get_charged_cifname(cif_dir,cifname,qmof_fallback)
+                if os.path.isfile(charged_cifname):
+                    cifnames.append(charged_cifname)
+                    failures[cifname] = f"not in the QMOF snapshot, charges from {qmof_fallback}"
+        _report_failures(cif_dir,'QMOF',failures)
+        return cifnames
+    if method not in ['EQeq','pacmof2']:
         raise ValueError(f'Invalid charge method keyword. Expected values : {[el for el in CHARGE_METHOD]}')
-    return cifnames
+
+    cifnames_input = [_to_absolute_path(cif_dir,cifname,'.cif') for cifname in cifnames_input
+                      if "EQeq" not in cifname and "openbabel" not in cifname]
+    charged_cifnames = {cifname:get_charged_cifname(cif_dir,cifname,method) for cifname in cifnames_input}
+    misses = cifnames_input
+    if use_cache:
+        misses = [cifname for cifname in cifnames_input
+                  if not restore_charged_cif(cifname,charged_cifnames[cifname],method)]
+        print(f'Partial charges with method {method} found in the cache for {len(cifnames_input)-len(misses)} structures.')
+
+    if len(misses) > 0:
+        if method == 'EQeq':
+            run_EQeq(cif_dir,misses,verbose=verbose,max_workers=max_workers,timeout=timeout)
+        elif method == 'pacmof2':
+            run_pacmof(cif_dir,misses,verbose=verbose,max_workers=max_workers,timeout=timeout)
+        if use_cache:
+            for cifname in misses:
+                store_charged_cif(cifname,charged_cifnames[cifname],method)
+            evict_charge_cache()
+
+    return [charged_cifnames[cifname] for cifname in cifnames_input if os.path.isfile(charged_cifnames[cifname])]
 
 def cif_from_local_directory(structure, data_dir):
     """Use CIF files provided by the user in a local path
@@ -325,24 +520,117 @@ def cif_from_local_directory(structure, data_dir):
             warnings.warn(f"Failed to copy '{file_path}': {e}")
     return target_cifnames
 
+# Memo of the minimal supercells : (CIF hash, cutoff) -> (nx,ny,nz)
+_UNIT_CELLS_MEMO = {}
+# Memo of the CIF hashes : (path, modification time, size) -> hash
+_CIF_HASH_MEMO = {}
+
+def _get_cif_hash(cif_path_filename):
+    '''
+    Hash of a CIF file, computed again only if the file was modified.
+    '''
+    stat_result = os.stat(cif_path_filename)
+    key = (os.path.abspath(cif_path_filename),stat_result.st_mtime_ns,stat_result.st_size)
+    if key not in _CIF_HASH_MEMO:
+        _CIF_HASH_MEMO[key] = hash_file(cif_path_filename)
+    return _CIF_HASH_MEMO[key]
+
 def get_minimal_unit_cells(cif_path_filename,cutoff=12):
     """
     Get the minimal supercell to avoid pbc artifacts in energy calculations.
     By default, the cutoff is 12 Angstroms. 
     
     TODO : change the cutoff if specified in JSON input. 
+
+    The cell parameters are read from the header of the CIF file, and the result is memoized
+    for each CIF content and cutoff (see `compute_minimal_unit_cells` for many structures at once).
     """
-    with warnings.catch_warnings():
-        warnings.filterwarnings("ignore", category=UserWarning, message="crystal system 'triclinic' is not interpreted")
-        atoms = read(cif_path_filename)
-    a, b, c, alpha, beta, gamma = atoms.cell.cellpar()
-    mat = mat_from_parameters(a, b, c, alpha, beta, gamma)
-    
-    cx,cy,cz = perpendicular_lengths(mat[0],mat[1],mat[2])
-    nx = ceil(cutoff*2/ cx)
-    ny = ceil(cutoff*2/ cy)
-    nz = ceil(cutoff*2/ cz)
-    return nx,ny,nz
+    key = (_get_cif_hash(cif_path_filename),cutoff)
+    if key not in _UNIT_CELLS_MEMO:
+        nx,ny,nz = minimal_unit_cells(np.array([read_cif_cell(cif_path_filename)]),cutoff=cutoff)[0]
+        _UNIT_CELLS_MEMO[key] = (int(nx),int(ny),int(nz))
+    return _UNIT_CELLS_MEMO[key]
+
+def compute_minimal_unit_cells(cif_path_filenames,cutoff=12):
+    """
+    Get the minimal supercells of many structures in one vectorized calculation, and memoize them
+    for `get_minimal_unit_cells`.
+
+    Args:
+        cif_path_filenames (list): Paths of the CIF files.
+        cutoff (float): Cutoff of the interactions (angstrom).
+
+    Returns:
+        unit_cells (dict): A dictionary CIF path -> (nx,ny,nz).
+    """
+    keys = {cif:(_get_cif_hash(cif),cutoff) for cif in cif_path_filenames}
+    missing = list({key:cif for cif,key in keys.items() if key not in _UNIT_CELLS_MEMO}.items())
+    if len(missing) > 0:
+        cellpars = np.array([read_cif_cell(cif) for _,cif in missing])
+        for (key,_),(nx,ny,nz) in zip(missing,minimal_unit_cells(cellpars,cutoff=cutoff)):
+            _UNIT_CELLS_MEMO[key] = (int(nx),int(ny),int(nz))
+    return {cif:_UNIT_CELLS_MEMO[key] for cif,key in keys.items()}
+
+def minimal_unit_cells(cellpars,cutoff=12):
+    """
+    Vectorized minimal supercells : the number of unit cells in each direction such that the
+    perpendicular widths of the simulation box are at least twice the cutoff.
+
+    Args:
+        cellpars (np.ndarray): An (N,6) array of cell parameters a, b, c (angstrom), alpha, beta, gamma (degrees).
+        cutoff (float): Cutoff of the interactions (angstrom).
+
+    Returns:
+        unit_cells (np.ndarray): An (N,3) array of numbers of unit cells.
+    """
+    cellpars = np.atleast_2d(np.asarray(cellpars,dtype=float))
+    a,b,c = cellpars[:,0],cellpars[:,1],cellpars[:,2]
+    cos_alpha,cos_beta,cos_gamma = np.cos(np.radians(cellpars[:,3:6])).T
+    sin_gamma = np.sin(np.radians(cellpars[:,5]))
+    omega = np.sqrt(1 - cos_alpha**2 - cos_beta**2 - cos_gamma**2 + 2*cos_alpha*cos_beta*cos_gamma)
+
+    # Cell vectors, as in mat_from_parameters
+    zeros = np.zeros_like(a)
+    va = np.stack([a,zeros,zeros],axis=1)
+    vb = np.stack([b*cos_gamma,b*sin_gamma,zeros],axis=1)
+    vc = np.stack([c*cos_beta,c*(cos_alpha - cos_beta*cos_gamma)/sin_gamma,c*omega/sin_gamma],axis=1)
+
+    # Perpendicular widths : volume divided by the area of the opposite faces
+    bxc,cxa,axb = np.cross(vb,vc),np.cross(vc,va),np.cross(va,vb)
+    volume = np.abs(np.einsum("ij,ij->i",va,bxc))
+    widths = volume[:,None]/np.linalg.norm(np.stack([bxc,cxa,axb],axis=1),axis=2)
+    return np.ceil(cutoff*2/widths).astype(int)
+
+def read_cif_cell(cif_path_filename):
+    """
+    Read the cell parameters of a CIF file from its header, without reading the atoms.
+
+    Args:
+        cif_path_filename (str): Path of the CIF file.
+
+    Returns:
+        tuple: a, b, c (angstrom), alpha, beta, gamma (degrees).
+    """
+    keys = ["_cell_length_a","_cell_length_b","_cell_length_c",
+            "_cell_angle_alpha","_cell_angle_beta","_cell_angle_gamma"]
+    values = {}
+    with open(cif_path_filename) as f:
+        for line in f:
+            words = line.split()
+            if len(words) >= 2 and words[0] in keys:
+                # Remove the uncertainty, e.g. 10.2345(6)
+                values[words[0]] = float(words[1].split("(")[0])
+                if len(values) == len(keys):
+                    break
+    if len(values) < len(keys):
+        raise ValueError(f"Cell parameters not found in {cif_path_filename}.")
+    return tuple(values[key] for key in keys)
+
+def get_cell_volume(cif_path_filename):
+    """
+    Volume of the unit cell of a CIF file (angstrom^3).
+    """
+    return abs(np.linalg.det(mat_from_parameters(*read_cif_cell(cif_path_filename))))
 
 def mat_from_parameters(a, b, c, alpha, beta, gamma):
     cos_alpha = np.cos(np.radians(alpha))
@@ -423,3 +711,37 @@ def create_dir(dict_parameters,data_dir,simulation_name_length=4,verbose=False):
         if verbose:
             print(f"New file '{index_file}' created.")
     return work_dir
+
+def find_simkey(df_index,dict_parameters):
+    """
+    Find the simulation key of a previous simulation run with the same parameters.
+
+    Parameters:
+        df_index (pd.DataFrame): The content of the index file `gcmc/index.csv`.
+        dict_parameters (dict): A dictionary containing the simulation parameters.
+
+    Returns:
+        str: The simulation key of the last matching row, None if no row matches.
+    """
+    mask = pd.Series(True,index=df_index.index)
+    for key,value in dict_parameters.items():
+        if key == "simkey":
+            continue
+        if key not in df_index.columns:
+            return None
+        mask &= df_index[key].apply(lambda x: _same_value(x,value))
+    matches = df_index.loc[mask,"simkey"]
+    return matches.iloc[-1] if len(matches) > 0 else None
+
+def _same_value(a,b):
+    '''
+    Compare a value read from a CSV file with a parameter value (None, NaN, "" and "None" are equivalent).
+    '''
+    def is_missing(x):
+        return x is None or (isinstance(x,float) and np.isnan(x)) or x in ["","None"]
+    if is_missing(a) or is_missing(b):
+        return is_missing(a) and is_missing(b)
+    try:
+        return bool(np.isclose(float(a),float(b)))
+    except (TypeError,ValueError):
+        return str(a) == str(b)
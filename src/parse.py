@@ -26,6 +26,25 @@ def parse_arguments():
     parser_run.add_argument("-t5","--test-grids", action="store_true", help="run test with GCMC calculation on grids")
     parser_run.add_argument("-t6","--test-cif-local-directory", action="store_true", help="run test with GCMC calculation on user CIF files.")
     parser_run.add_argument("-t7","--test-charges-pacmof", action="store_true", help="run test to generate a CIF structure with partial charges from PACMOF method.")
+    parser_run.add_argument("--offline", action="store_true", help="never use the network: CIF files are only read from the local CIF cache")
+    parser_run.add_argument("-t9","--test-fetch", action="store_true", help="run test fetching CIF files concurrently from a local stand-in for the MOFXDB API")
+    parser_run.add_argument("-r", "--resume", action="store_true", help="resume a previous run in the output directory: only simulations which did not finish are run")
+    parser_run.add_argument("-n", "--max-workers", type=int, default=None, help="maximum number of simulations running at once (default: number of usable cores)")
+    parser_run.add_argument("--max-memory", type=float, default=None, help="memory in GB shared by the simulations running at once (default: available memory of the node)")
+    parser_run.add_argument("--stagger", type=float, default=0.0, help="minimum delay in seconds between two simulation launches")
+    parser_run.add_argument("--schedule", choices=["lpt","fifo"], default="lpt", help="launch order of simulations: most expensive first (lpt) or in input order (fifo)")
+    parser_run.add_argument("-b", "--backend", choices=["local","slurm"], default="local", help="where simulations are run: on the local machine or in a SLURM job array")
+    parser_run.add_argument("--sims-per-task", type=int, default=1, help="number of simulations per SLURM array task (slurm backend)")
+    parser_run.add_argument("--slurm-option", action="append", default=None, help="extra sbatch option, e.g. --slurm-option=--partition=dahu (slurm backend, can be repeated)")
+    parser_run.add_argument("--poll-interval", type=float, default=30, help="delay in seconds between two checks of the SLURM job array (slurm backend)")
+    parser_run.add_argument("-t8","--test-slurm", action="store_true", help="run test with simulations in a SLURM job array, using a local stand-in for sbatch/squeue")
+    parser_run.add_argument("--skip-validation", action="store_true", help="do not check the molecules, forcefields and structures before writing the simulation inputs")
+    
+    # create the parser for the validate command
+    parser_validate = subparsers.add_parser('validate', help='Check an input file and its structures before running simulations.')
+    parser_validate.add_argument("-i", "--input-file", help="path to a json input file")
+    parser_validate.add_argument("-o", "--output-dir", default=default_directory, help="output directory path, where the structures are fetched")
+    parser_validate.add_argument("-n", "--max-workers", type=int, default=None, help="maximum number of checks running at once (default: number of CPUs)")
     
     # create the parser for the merge command
     parser_merge = subparsers.add_parser('merge', help='Merge workflow outputs.')
@@ -33,6 +52,14 @@ def parse_arguments():
     parser_merge.add_argument("-o", "--output-dir", default=default_directory, help="output directory path")
     parser_merge.add_argument("-t3","--test-merge-json", action="store_true", help="run test to merge json databases")
 
+    # create the parser for the db command
+    parser_db = subparsers.add_parser('db', help='Manage the local structure store.')
+    db_subparsers = parser_db.add_subparsers(dest='db_command')
+    parser_db_import = db_subparsers.add_parser('import', help='Import a CoRE MOF 2019 archive or a MOFXDB dump in the local structure store.')
+    parser_db_import.add_argument("archive", help="path to an archive (tar, tar.gz, zip) or a directory of CIF or MOFXDB JSON files")
+    parser_db_import.add_argument("--database", default="CoREMOF 2019", help="database of the CIF files of the archive (default: CoREMOF 2019)")
+    parser_db_import.add_argument("--version", default=None, help="version of the CIF files of the archive (default: archive name)")
+
     # create the parser for the input command
     parser_input = subparsers.add_parser('input', help='Launch interface for generating JSON input.')
 
@@ -53,9 +80,15 @@ def parse_arguments():
         'test_charges'   :          run_test_charges,
         'test_charges_pacmof'   :   run_test_charges_pacmof,
         'test_grids'   :            run_test_grids,
-        'test_cif_local_directory': run_test_cif_local_directory
+        'test_cif_local_directory': run_test_cif_local_directory,
+        'test_slurm':               run_test_slurm,
+        'test_fetch':               run_test_fetch
     }
 
+    # Offline mode, read by the functions fetching data from databases
+    if getattr(args,"offline",False):
+        os.environ["SAW_OFFLINE"] = "1"
+
     # Absolute paths 
     try:
         args.output_dir = os.path.abspath(args.output_dir)
@@ -98,13 +131,13 @@ def check_environment_variables(env_var_list):
 
 def _check_input_file(parser,args):
     # Check input files
-    if args.command=='run' and args.input_file is not None and not os.path.exists(args.input_file):
+    if args.command in ['run','validate'] and args.input_file is not None and not os.path.exists(args.input_file):
         print(f"Input file '{args.input_file}' does not exist. Provide a correct input file using -i option.")
         parser.print_help()
         exit(1)
 
     # Change relative paths to absolute paths
-    if args.command=='run' and args.input_file is not None:  # run
+    if args.command in ['run','validate'] and args.input_file is not None:  # run, validate
         args.input_file = os.path.abspath(args.input_file)
     elif args.command=='merge' and args.input_files is not None: # merge
         for i in range(len(args.input_files)):
@@ -113,6 +146,8 @@ def _check_input_file(parser,args):
         pass
     elif(args.command=='plot'):
         pass
+    elif(args.command=='db'):
+        pass
     else :
         print(f"Input file not provided. Provide a correct input file using -i option.")
         parser.print_help()
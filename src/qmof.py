@@ -0,0 +1,82 @@
+"""
+Partial charges from a local snapshot of the QMOF database (10.1016/j.matt.2021.02.012).
+
+The snapshot is a directory, given by the environment variable `SAW_QMOF_DIR`, with:
+- the QMOF property table `qmof.csv` or `qmof.json`, with the fields `qmof_id` and `name`
+  (e.g. `ABAVIJ_FSR`, whose CSD refcode is `ABAVIJ`),
+- the CIF files `<qmof_id>.cif` with the DDEC charges in the `_atom_site_charge` column,
+  in any subdirectory.
+
+A refcode index (refcode -> CIF files) is built from the table at the first use, and stored in
+`$SAW_CACHE_DIR/qmof/`; it is rebuilt when the table changes.
+"""
+import os,glob,json
+import pandas as pd
+from src.cache import *
+from src.structure_db import refcode_from_filename
+
+def get_qmof_dir():
+    """
+    Directory of the local QMOF snapshot, None if `SAW_QMOF_DIR` is not set.
+    """
+    return os.environ.get("SAW_QMOF_DIR") or None
+
+def _read_qmof_table(qmof_dir):
+    '''
+    Read the QMOF property table of the snapshot; returns the table and its path.
+    '''
+    if os.path.isfile(f"{qmof_dir}/qmof.csv"):
+        return pd.read_csv(f"{qmof_dir}/qmof.csv",usecols=["qmof_id","name"]),f"{qmof_dir}/qmof.csv"
+    if os.path.isfile(f"{qmof_dir}/qmof.json"):
+        with open(f"{qmof_dir}/qmof.json") as f:
+            entries = json.load(f)
+        return pd.DataFrame([{"qmof_id":e["qmof_id"],"name":e["name"]} for e in entries]),f"{qmof_dir}/qmof.json"
+    raise FileNotFoundError(f"No QMOF table (qmof.csv or qmof.json) in {qmof_dir}.")
+
+def qmof_refcode(name):
+    """
+    CSD refcode of a QMOF or CoRE MOF structure name (e.g. 'ABAVIJ_FSR' or 'ABAVIJ_clean_coremof-2019.cif' -> 'ABAVIJ').
+    """
+    return refcode_from_filename(name).split("_")[0]
+
+def get_qmof_index(qmof_dir=None):
+    """
+    Refcode index of a local QMOF snapshot.
+
+    Args:
+        qmof_dir (str, optional): Directory of the snapshot, defaults to `$SAW_QMOF_DIR`.
+
+    Returns:
+        index (dict): A dictionary refcode -> list of CIF paths (sorted by QMOF name), empty if there is no snapshot.
+    """
+    qmof_dir = qmof_dir or get_qmof_dir()
+    if qmof_dir is None or not os.path.isdir(qmof_dir):
+        return {}
+    qmof_dir = os.path.abspath(qmof_dir)
+    table,table_file = _read_qmof_table(qmof_dir)
+    index_file = f"{get_cache_dir('qmof')}/index_{hash_items(qmof_dir)[:16]}.json"
+    table_hash = hash_file(table_file)
+    if os.path.isfile(index_file):
+        with open(index_file) as f:
+            index = json.load(f)
+        if index["table_sha256"] == table_hash:
+            return index["refcodes"]
+
+    cif_paths = {os.path.splitext(os.path.basename(path))[0]:path
+                 for path in glob.glob(f"{qmof_dir}/**/*.cif",recursive=True)}
+    refcodes = {}
+    for qmof_id,name in sorted(zip(table["qmof_id"],table["name"]),key=lambda entry: str(entry[1])):
+        if qmof_id in cif_paths:
+            refcodes.setdefault(qmof_refcode(str(name)),[]).append(cif_paths[qmof_id])
+    tmp_file = f"{index_file}.tmp{os.getpid()}"
+    with open(tmp_file,"w") as f:
+        json.dump({"qmof_dir":qmof_dir,"table_sha256":table_hash,"refcodes":refcodes},f)
+    os.replace(tmp_file,index_file)
+    return refcodes
+
+def has_charges(cifname):
+    """
+    True if a CIF file has a `_atom_site_charge` column.
+    """
+    with open(cifname) as f:
+        return any(line.strip() == "_atom_site_charge" for line in f)
@@ -0,0 +1,450 @@
+"""
+Execution of RASPA jobs prepared by the workflow.
+
+A job is a directory containing a `run.sh` script (see `wraspa2.create_run_script`).
+Jobs are launched on the local machine with a bounded number of concurrent processes.
+"""
+import os
+import glob
+import math
+import time
+import heapq
+import subprocess
+
+def get_usable_cores():
+    """
+    Returns the number of CPU cores that the current process is allowed to use.
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def get_available_memory():
+    """
+    Returns the memory (bytes) available for new processes on the node.
+    """
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+def run_jobs(job_dirs, max_workers=None, priorities=None, dependencies=None, stagger=0.0,
+             poll_interval=0.5, memory=None, max_memory=None, verbose=False):
+    """
+    Run the `run.sh` script of each job directory, with at most `max_workers` jobs at once.
+
+    Jobs are taken from a queue in FIFO order, unless priorities are given, in which
+    case the job with the highest priority is launched first (ties keep the FIFO order).
+    A job with dependencies enters the queue only when all its prerequisites finished
+    successfully; it is skipped (exit code None) if one of them failed. Prerequisites
+    which are not in `job_dirs` are considered done.
+    If memory estimates are given, a job is launched only if the estimates of the running
+    jobs and its own fit in `max_memory`; otherwise a smaller job of the queue is launched
+    instead. A job is always launched when nothing is running, even if it does not fit.
+    The standard output and error of each job are written in `<job_dir>/run.log`.
+
+    Args:
+        job_dirs (list): Paths of the job directories.
+        max_workers (int, optional): Maximum number of concurrent jobs. Defaults to the number of usable cores.
+        priorities (dict, optional): A dictionary job directory -> priority (float).
+        dependencies (dict, optional): A dictionary job directory -> list of prerequisite job directories.
+        stagger (float, optional): Minimum delay in seconds between two launches,
+                                   to avoid filesystem storms when many jobs start together.
+        poll_interval (float, optional): Delay in seconds between two checks of the running jobs.
+        memory (dict, optional): A dictionary job directory -> estimated memory (bytes).
+        max_memory (float, optional): Memory available for the jobs (bytes). Defaults to the
+                                      available memory of the node if `memory` is given.
+        verbose (bool): if True, print each launch and each exit code.
+
+    Returns:
+        exit_codes (dict): A dictionary job directory -> exit code of `run.sh`.
+    """
+    if max_workers is None:
+        max_workers = get_usable_cores()
+    max_workers = max(1, int(max_workers))
+    priorities = priorities or {}
+    memory = memory or {}
+    if max_memory is None:
+        max_memory = get_available_memory() if memory else math.inf
+    order = {job_dir: i for i, job_dir in enumerate(job_dirs)}
+
+    # Jobs waiting for prerequisites, and the reverse mapping
+    waiting = {job_dir: set(d for d in (dependencies or {}).get(job_dir, []) if d in order)
+               for job_dir in job_dirs}
+    successors = {job_dir: [] for job_dir in job_dirs}
+    for job_dir, prerequisites in waiting.items():
+        for prerequisite in prerequisites:
+            successors[prerequisite].append(job_dir)
+
+    queue = []
+    def push(job_dir):
+        heapq.heappush(queue, (-priorities.get(job_dir, 0), order[job_dir], job_dir))
+    for job_dir in job_dirs:
+        if not waiting[job_dir]:
+            push(job_dir)
+
+    def finish(job_dir, returncode):
+        exit_codes[job_dir] = returncode
+        for successor in successors[job_dir]:
+            if successor in exit_codes:
+                continue
+            if returncode != 0:
+                if verbose : print(f"Job {successor} skipped, prerequisite {job_dir} failed.")
+                finish(successor, None)
+            else:
+                waiting[successor].discard(job_dir)
+                if not waiting[successor]:
+                    push(successor)
+
+    running = {}
+    exit_codes = {}
+    last_launch = None
+    while queue or running:
+        # Collect finished jobs
+        for job_dir, (process, log) in list(running.items()):
+            returncode = process.poll()
+            if returncode is not None:
+                log.close()
+                del running[job_dir]
+                if verbose : print(f"Job {job_dir} finished with exit code {returncode}.")
+                finish(job_dir, returncode)
+
+        # Launch new jobs while slots are free
+        while queue and len(running) < max_workers:
+            if stagger and last_launch is not None and time.time() - last_launch < stagger:
+                break
+            # Highest priority job which fits in memory
+            used_memory = sum(memory.get(running_dir, 0) for running_dir in running)
+            job_dir, postponed = None, []
+            while queue:
+                item = heapq.heappop(queue)
+                if not running or used_memory + memory.get(item[2], 0) <= max_memory:
+                    job_dir = item[2]
+                    break
+                postponed.append(item)
+            for item in postponed:
+                heapq.heappush(queue, item)
+            if job_dir is None:
+                break
+            log = open(f"{job_dir}/run.log", "w")
+            process = subprocess.Popen(["./run.sh"], cwd=job_dir, stdout=log, stderr=subprocess.STDOUT)
+            running[job_dir] = (process, log)
+            last_launch = time.time()
+            if verbose : print(f"Job {job_dir} launched.")
+
+        if queue or running:
+            time.sleep(min(poll_interval, stagger) if stagger else poll_interval)
+    return exit_codes
+
+def get_critical_path_costs(costs, dependencies=None):
+    """
+    Add to the cost of each job the largest cost of the jobs which depend on it.
+
+    With dependencies, a cheap job that unlocks a long chain of jobs must start early:
+    ranking jobs by this cumulated cost extends the longest-job-first rule to chains.
+
+    Args:
+        costs (dict): A dictionary job directory -> cost.
+        dependencies (dict, optional): A dictionary job directory -> list of prerequisite job directories.
+
+    Returns:
+        path_costs (dict): A dictionary job directory -> cost of the most expensive chain starting with the job.
+    """
+    successors = {job_dir: [] for job_dir in costs}
+    for job_dir, prerequisites in (dependencies or {}).items():
+        for prerequisite in prerequisites:
+            if prerequisite in successors and job_dir in costs:
+                successors[prerequisite].append(job_dir)
+    path_costs = {}
+    def path_cost(job_dir):
+        if job_dir not in path_costs:
+            path_costs[job_dir] = costs[job_dir] + max([path_cost(s) for s in successors[job_dir]], default=0)
+        return path_costs[job_dir]
+    for job_dir in costs:
+        path_cost(job_dir)
+    return path_costs
+
+def is_simulation_finished(job_dir):
+    """
+    Check if the RASPA job of a directory ran until the end.
+
+    Args:
+        job_dir (str): Path of the job directory.
+
+    Returns:
+        bool: True if an output file `Output/System_0/*.data` contains "Simulation finished".
+    """
+    for filename in glob.glob(f"{job_dir}/Output/System_0/*.data"):
+        with open(filename, errors="ignore") as f:
+            f.seek(max(os.path.getsize(filename) - 4096, 0))
+            if "Simulation finished" in f.read():
+                return True
+    return False
+
+def estimate_cost(job_dir):
+    """
+    Estimate the relative computational cost of a RASPA job from its input files.
+
+    The estimate is only meant to rank jobs (see `sort_by_cost`), not to predict a wall time.
+    It reads `simulation.input` and the framework CIF file of the job directory:
+    - the cost of an energy evaluation grows with the number of framework atoms in the supercell
+      (number of atoms in the CIF times the number of unit cells), or is constant with tabulated grids,
+    - the number of Monte Carlo moves grows with the number of cycles and with the loading (pressure),
+    - Ewald summation for framework charges makes each move several times more expensive,
+    - for a grid calculation, the cost grows with the number of atoms, of grids (including the
+      Coulomb grid) and of grid points.
+
+    Args:
+        job_dir (str): Path of the job directory.
+
+    Returns:
+        cost (float): An estimate of the cost in arbitrary units.
+    """
+    keywords = _read_raspa_input(f"{job_dir}/simulation.input")
+    n_atoms = _count_cif_atoms(f"{job_dir}/{keywords.get('FrameworkName', [''])[0]}.cif")
+    n_cells = 1
+    for n in keywords.get("UnitCells", [1, 1, 1]):
+        n_cells *= int(n)
+
+    if keywords.get("SimulationType", [""])[0] == "MakeGrid":
+        spacing = float(keywords.get("SpacingVDWGrid", [0.1])[0])
+        n_grids = int(keywords.get("NumberOfGrids", [1])[0])
+        if (keywords.get("UseChargesFromCIFFile", ["no"])[0] == "yes"
+                and keywords.get("ChargeMethod", ["Ewald"])[0] != "None"):
+            n_grids += 1  # Coulomb grid
+        return n_atoms * n_grids / spacing**3
+
+    cycles = sum(float(keywords.get(key, [0])[0]) for key in ["NumberOfCycles", "NumberOfInitializationCycles"])
+    pressure = float(keywords.get("ExternalPressure", [0])[0])
+    loading = 1 + math.log10(1 + pressure / 1e4)
+    if keywords.get("UseTabularGrid", ["no"])[0] == "yes":
+        energy = 1.0
+    else:
+        energy = max(n_atoms * n_cells, 1)
+    if keywords.get("UseChargesFromCIFFile", ["no"])[0] == "yes":
+        energy *= 3
+    return cycles * loading * energy
+
+def sort_by_cost(job_dirs, costs=None):
+    """
+    Sort jobs by decreasing estimated cost (longest processing time first).
+
+    Starting the most expensive jobs first prevents a long job launched at the end
+    from setting the total wall time of a campaign on a fixed number of cores.
+
+    Args:
+        job_dirs (list): Paths of the job directories.
+        costs (dict, optional): A dictionary job directory -> cost. Computed with `estimate_cost` if not given.
+
+    Returns:
+        job_dirs (list): The sorted job directories.
+        costs (dict): A dictionary job directory -> cost.
+    """
+    if costs is None:
+        costs = {job_dir: estimate_cost(job_dir) for job_dir in job_dirs}
+    return sorted(job_dirs, key=lambda job_dir: -costs[job_dir]), costs
+
+def _read_raspa_input(filename):
+    """
+    Read a RASPA input file into a dictionary keyword -> list of values (first occurrence only).
+    """
+    keywords = {}
+    with open(filename) as f:
+        for line in f:
+            words = line.split()
+            if len(words) >= 2 and words[0] not in keywords:
+                keywords[words[0]] = words[1:]
+    return keywords
+
+def _count_cif_atoms(cif_filename):
+    """
+    Count the number of atoms in the `_atom_site_` loop of a CIF file (0 if the file cannot be read).
+    """
+    n_atoms = 0
+    try:
+        with open(cif_filename) as f:
+            in_header, in_atom_loop = False, False
+            for line in f:
+                line = line.strip()
+                if line.startswith("loop_"):
+                    in_header, in_atom_loop = True, False
+                elif line.startswith("_"):
+                    if in_header:
+                        in_atom_loop = in_atom_loop or line.startswith("_atom_site_fract_x")
+                    else:
+                        in_atom_loop = False
+                elif line and not line.startswith("#"):
+                    in_header = False
+                    if in_atom_loop:
+                        n_atoms += 1
+    except OSError:
+        pass
+    return n_atoms
+
+def write_exit_codes(exit_codes, filename, append=False):
+    """
+    Write the exit code of each job in a CSV file and print a summary.
+
+    Args:
+        exit_codes (dict): A dictionary job directory -> exit code.
+        filename (str): Path of the CSV file.
+        append (bool): If True, the exit codes are added to the ones already in the file
+                       (e.g. of the previous rounds of the adaptive isotherms).
+
+    Returns:
+        failed (list): Job directories with a non-zero exit code.
+    """
+    failed = [job_dir for job_dir, code in exit_codes.items() if code != 0]
+    header = not (append and os.path.isfile(filename))
+    with open(filename, "a" if append else "w") as f:
+        if header:
+            f.write("job,exit_code\n")
+        for job_dir, code in exit_codes.items():
+            f.write(f"{os.path.basename(job_dir)},{code}\n")
+    print(f"{len(exit_codes) - len(failed)} jobs succeeded, {len(failed)} jobs failed (see {filename}).")
+    return failed
+
+def create_array_script(path, job_dirs, type="gcmc", sims_per_task=1, slurm_options=None,
+                        dependencies=None):
+    """
+    Write a SLURM job-array script that runs all jobs of a given type.
+
+    The jobs are packed into array tasks of `sims_per_task` simulations; the simulations
+    of one task run at the same time on `sims_per_task` CPUs. Jobs chained by dependencies
+    (e.g. warm-started isotherm points) are kept in the same task and run one after
+    the other, a failed job stopping its chain. The exit code of each job is written
+    in `<job_dir>/exit_code`.
+
+    Args:
+        path (str): Directory where the script `array_<type>.sh` is written.
+        job_dirs (list): Paths of the job directories.
+        type (str): Simulation type, used for the job name.
+        sims_per_task (int): Number of simulations (or chains) per array task.
+        slurm_options (list, optional): Extra sbatch options, e.g. ["--partition=dahu", "--time=02:00:00"].
+        dependencies (dict, optional): A dictionary job directory -> list of prerequisite job directories.
+
+    Returns:
+        file_path (str): Path of the job-array script.
+
+    Raises:
+        ValueError: If there is no job (SLURM rejects an empty array).
+    """
+    if len(job_dirs) == 0:
+        raise ValueError("No job to put in a SLURM job array.")
+    sims_per_task = max(1, int(sims_per_task))
+    chains = _get_chains(job_dirs, dependencies)
+    tasks = [chains[i:i + sims_per_task] for i in range(0, len(chains), sims_per_task)]
+    header = [f"#SBATCH --job-name=saw_{type}",
+              f"#SBATCH --array=0-{len(tasks) - 1}",
+              "#SBATCH --ntasks=1",
+              f"#SBATCH --cpus-per-task={sims_per_task}",
+              f"#SBATCH --output={path}/slurm_{type}_%A_%a.log"]
+    header += [f"#SBATCH {option}" for option in (slurm_options or [])]
+    task_lines = [f'TASKS[{i}]="{" ".join(",".join(chain) for chain in task)}"' for i, task in enumerate(tasks)]
+    lines = ["#!/bin/bash"] + header + [""] + task_lines + ["",
+             'for chain in ${TASKS[$SLURM_ARRAY_TASK_ID]} ; do',
+             '    (for dir in ${chain//,/ } ; do',
+             '        (cd $dir && ./run.sh > run.log 2>&1)',
+             '        code=$?',
+             '        echo $code > $dir/exit_code',
+             '        [ $code -eq 0 ] || break',
+             '    done) &',
+             'done',
+             'wait']
+    file_path = f"{path}/array_{type}.sh"
+    with open(file_path, 'w') as f:
+        f.write("\n".join(lines) + "\n")
+    os.chmod(file_path, 0o700)
+    return file_path
+
+def _get_chains(job_dirs, dependencies=None):
+    """
+    Group jobs into chains following their dependencies (each job having at most one prerequisite).
+    Chains are returned in the order of their first job in `job_dirs`.
+    """
+    job_set = set(job_dirs)
+    next_job = {}
+    has_prerequisite = set()
+    for job_dir in job_dirs:
+        for prerequisite in (dependencies or {}).get(job_dir, []):
+            if prerequisite in job_set:
+                next_job[prerequisite] = job_dir
+                has_prerequisite.add(job_dir)
+    chains = []
+    for job_dir in job_dirs:
+        if job_dir in has_prerequisite:
+            continue
+        chain = [job_dir]
+        while chain[-1] in next_job:
+            chain.append(next_job[chain[-1]])
+        chains.append(chain)
+    return chains
+
+def run_jobs_slurm(path, job_dirs, type="gcmc", sims_per_task=1, slurm_options=None,
+                   dependencies=None, poll_interval=30, max_poll_failures=10, verbose=False):
+    """
+    Run jobs as a single SLURM job array and wait for its completion.
+
+    The array is submitted with `sbatch` and its state is polled with `squeue`,
+    both taken from the PATH (a local stand-in can be found in `tests/test_slurm/bin`).
+
+    Args:
+        path (str): Directory where the job-array script is written.
+        job_dirs (list): Paths of the job directories.
+        type (str): Simulation type, used for the job name.
+        sims_per_task (int): Number of simulations per array task.
+        slurm_options (list, optional): Extra sbatch options.
+        dependencies (dict, optional): A dictionary job directory -> list of prerequisite job directories.
+        poll_interval (float): Delay in seconds between two calls to `squeue`.
+        max_poll_failures (int): Number of consecutive failed calls to `squeue` (e.g. a transient
+                                 error of the SLURM controller) after which the polling stops with an error.
+        verbose (bool): if True, print the state of the job array at each poll.
+
+    Returns:
+        exit_codes (dict): A dictionary job directory -> exit code (None if the job did not finish),
+                           empty if there is no job.
+
+    Raises:
+        RuntimeError: If `squeue` fails `max_poll_failures` times in a row.
+    """
+    if len(job_dirs) == 0:
+        return {}
+    for job_dir in job_dirs:
+        if os.path.exists(f"{job_dir}/exit_code"):
+            os.remove(f"{job_dir}/exit_code")
+    script = create_array_script(path, job_dirs, type=type, sims_per_task=sims_per_task,
+                                 slurm_options=slurm_options, dependencies=dependencies)
+    output = subprocess.run(["sbatch", "--parsable", script], capture_output=True, text=True, check=True)
+    job_id = output.stdout.strip().split(";")[0]
+    print(f"Job array {job_id} submitted ({script}).")
+
+    # The array is finished when a successful call to squeue does not list it anymore
+    poll_failures = 0
+    while True:
+        output = subprocess.run(["squeue", "-h", "-j", job_id, "-o", "%i %T"],
+                                capture_output=True, text=True)
+        if verbose : print(output.stdout.strip())
+        if output.returncode != 0:
+            poll_failures += 1
+            if poll_failures >= max_poll_failures:
+                raise RuntimeError(f"squeue failed {poll_failures} times in a row for job array {job_id} : "
+                                   f"{output.stderr.strip()}")
+        elif output.stdout.strip() == "":
+            break
+        else:
+            poll_failures = 0
+        time.sleep(poll_interval)
+
+    exit_codes = {}
+    for job_dir in job_dirs:
+        try:
+            with open(f"{job_dir}/exit_code") as f:
+                exit_codes[job_dir] = int(f.read().strip())
+        except (FileNotFoundError, ValueError):
+            exit_codes[job_dir] = None
+    return exit_codes
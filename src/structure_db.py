@@ -0,0 +1,152 @@
+"""
+Local store of structures imported from a CoRE MOF 2019 archive or a MOFXDB dump.
+
+`saw.py db import <archive>` extracts the CIF files of an archive into
+`$SAW_CACHE_DIR/db/cif/<database>/<name>.cif` and indexes them in the SQLite database
+`$SAW_CACHE_DIR/db/index.sqlite` (name, database -> refcode, CIF path, version). `cif_from_mofxdb`
+looks structures up in this index before the CIF cache and MOFXDB. A structure matches the entries
+of its refcode (e.g. 'MIBQAR' matches 'MIBQAR_clean'), found with the index of the refcodes; otherwise,
+as with MOFXDB, all the entries whose name contains it. The CIF files are written as
+`<name>_<database>.cif`, whether they come from the store or from MOFXDB.
+
+The name of an entry is the name of the CIF file without its extension (e.g. 'ABAVIJ_clean'), or
+the `name` field of a MOFXDB entry; its refcode is the name without the CoRE MOF 2019 suffixes
+(see `refcode_from_filename`), whatever the kind of file it was imported from.
+
+Supported archives (tar, possibly compressed, zip, or a directory) contain:
+- CIF files, named `<refcode>.cif` or `<refcode>_clean*.cif` as in CoRE MOF 2019,
+- or JSON files with MOFXDB entries (a list, or a MOFXDB API page with a `results` list)
+  with the fields `name`, `database`, `cif` and `mofdb_version`.
+"""
+import os,json,sqlite3,tarfile,zipfile,warnings
+from src.cache import *
+
+def get_db_dir():
+    """
+    Directory of the local structure store.
+    """
+    return get_cache_dir("db")
+
+def _connect():
+    '''
+    Connection to the index of the store, created if needed.
+    '''
+    connection = sqlite3.connect(f"{get_db_dir()}/index.sqlite",timeout=60)
+    columns = [row[1] for row in connection.execute("PRAGMA table_info(structures)")]
+    if len(columns) > 0 and "name" not in columns:
+        # Index written by a previous version, keyed by refcode only
+        warnings.warn(f"The local structure store {get_db_dir()} has an old format, import the archives again.")
+        connection.execute("DROP TABLE structures")
+    connection.execute("""CREATE TABLE IF NOT EXISTS structures (
+                              name TEXT, refcode TEXT, database TEXT, version TEXT, path TEXT, sha256 TEXT,
+                              PRIMARY KEY (name, database))""")
+    connection.execute("CREATE INDEX IF NOT EXISTS structures_refcode ON structures (refcode)")
+    return connection
+
+def database_key(database):
+    """
+    Key of a database in CIF names, as in `cif_from_mofxdb` (e.g. 'CoREMOF 2019' -> 'coremof-2019').
+    """
+    return database.lower().replace(' ', '-')
+
+def refcode_from_filename(filename):
+    """
+    Refcode of a CIF file of CoRE MOF 2019 (e.g. 'ABAVIJ_clean.cif' -> 'ABAVIJ').
+    """
+    name = os.path.splitext(os.path.basename(filename))[0]
+    for suffix in ["_clean","_charged"]:
+        name = name.split(suffix)[0]
+    return name
+
+def _iter_archive(archive):
+    '''
+    Iterate over the (filename, content) of the CIF and JSON files of an archive or a directory.
+    '''
+    extensions = (".cif",".json")
+    if os.path.isdir(archive):
+        for root,_,files in os.walk(archive):
+            for filename in sorted(files):
+                if filename.endswith(extensions):
+                    with open(os.path.join(root,filename),"rb") as f:
+                        yield filename,f.read()
+    elif zipfile.is_zipfile(archive):
+        with zipfile.ZipFile(archive) as z:
+            for member in z.namelist():
+                if member.endswith(extensions):
+                    yield os.path.basename(member),z.read(member)
+    elif tarfile.is_tarfile(archive):
+        with tarfile.open(archive) as tar:
+            for member in tar:
+                if member.isfile() and member.name.endswith(extensions):
+                    yield os.path.basename(member.name),tar.extractfile(member).read()
+    else:
+        raise ValueError(f"{archive} is not a directory, a tar or a zip archive.")
+
+def import_archive(archive,database="CoREMOF 2019",version=None):
+    """
+    Import the structures of an archive into the local structure store.
+
+    Args:
+        archive (str): Path of the archive (tar, tar.gz, zip) or directory.
+        database (str, optional): Database of the CIF files of the archive. Default is 'CoREMOF 2019'.
+                                  The entries of JSON files keep their own database.
+        version (str, optional): Version of the CIF files of the archive. Defaults to the archive name.
+                                 The entries of JSON files keep their `mofdb_version`.
+
+    Returns:
+        n_structures (int): Number of structures imported.
+    """
+    if version is None:
+        version = os.path.basename(os.path.normpath(archive)).split(".")[0]
+    db_dir = get_db_dir()
+    connection = _connect()
+    n_structures = 0
+
+    def add(name,entry_database,entry_version,cif):
+        path = f"{db_dir}/cif/{database_key(entry_database)}/{name}.cif"
+        os.makedirs(os.path.dirname(path),exist_ok=True)
+        with open(path,"wb") as f:
+            f.write(cif)
+        connection.execute("INSERT OR REPLACE INTO structures VALUES (?,?,?,?,?,?)",
+                           (name,refcode_from_filename(name),entry_database,entry_version,path,hash_file(path)))
+
+    for filename,content in _iter_archive(archive):
+        if filename.endswith(".cif"):
+            add(os.path.splitext(filename)[0],database,version,content)
+            n_structures += 1
+        else:
+            entries = json.loads(content)
+            if isinstance(entries,dict):
+                entries = entries.get("results",[entries])
+            for entry in entries:
+                # Same content as the CIF files written by `cif_from_mofxdb`
+                add(entry["name"],entry["database"],str(entry.get("mofdb_version",version)),
+                    (entry["cif"]+"\n").encode())
+                n_structures += 1
+    connection.commit()
+    connection.close()
+    print(f"{n_structures} structures imported from {archive} in {db_dir}.")
+    return n_structures
+
+def lookup_structure(structure):
+    """
+    Look up a structure in the local structure store : the entries whose refcode is `structure`, or if there
+    are none, all the entries whose name contains `structure` (as MOFXDB does).
+
+    Args:
+        structure (str): Name of the structure (e.g. a refcode).
+
+    Returns:
+        entries (list): A list of (name, database, version, CIF path) of the matching entries,
+                        empty if the structure is not in the store.
+    """
+    if not os.path.isfile(f"{get_db_dir()}/index.sqlite"):
+        return []
+    connection = _connect()
+    entries = connection.execute("SELECT name,database,version,path FROM structures WHERE refcode = ? "
+                                 "ORDER BY name,database",(structure,)).fetchall()
+    if len(entries) == 0:
+        entries = connection.execute("SELECT name,database,version,path FROM structures WHERE instr(name,?) > 0 "
+                                     "ORDER BY name,database",(structure,)).fetchall()
+    connection.close()
+    return entries
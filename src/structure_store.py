@@ -0,0 +1,132 @@
+"""
+Store of the parsed structures of a run, so that each CIF file is parsed once per campaign.
+
+Each CIF file `<cif_dir>/<name>.cif` is parsed once by ASE (with its symmetry operations applied)
+into a compact array form, saved in the sidecar file `<cif_dir>/.store/<name>.npz`:
+- `cell` (3,3) : cell matrix (angstrom), `cellpar` (6) : a, b, c, alpha, beta, gamma,
+- `frac` (N,3) : fractional coordinates of the atoms,
+- `numbers` (N) : atomic numbers, `charges` (N) : partial charges (NaN if the CIF file has none),
+- `sha256` : hash of the content of the CIF file.
+
+The Python steps of the workflow read the structures with `load_structure`, which parses the CIF
+file again only if its content changed. `build_structure_store` parses all the structures of a run
+in parallel once they are fetched, when a step needs their atoms (validation, canonical CIF files).
+"""
+import os,warnings
+from types import SimpleNamespace
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from ase.io import read
+from src.cache import hash_file
+
+STORE_FIELDS = ["cell","cellpar","frac","numbers","charges","sha256"]
+
+def get_store_filename(cif_path_filename):
+    """
+    Path of the sidecar file of a CIF file in the structure store.
+    """
+    cif_dir,filename = os.path.split(os.path.abspath(cif_path_filename))
+    return f"{cif_dir}/.store/{os.path.splitext(filename)[0]}.npz"
+
+def parse_structure(cif_path_filename):
+    """
+    Parse a CIF file into the array form of the structure store.
+
+    Args:
+        cif_path_filename (str): Path of the CIF file.
+
+    Returns:
+        structure (dict): A dictionary with the fields `STORE_FIELDS`.
+    """
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", category=UserWarning, message="crystal system 'triclinic' is not interpreted")
+        atoms = read(cif_path_filename, store_tags=True)
+    # Charges of the asymmetric unit, expanded to all the atoms of the cell
+    charges = np.full(len(atoms),np.nan)
+    kinds = atoms.arrays.get("spacegroup_kinds")
+    if "_atom_site_charge" in atoms.info and kinds is not None:
+        charges = np.asarray(atoms.info["_atom_site_charge"],dtype=float)[kinds]
+    return {"cell":np.array(atoms.cell),
+            "cellpar":atoms.cell.cellpar(),
+            "frac":atoms.get_scaled_positions(wrap=False),
+            "numbers":atoms.numbers,
+            "charges":charges,
+            "sha256":np.array(hash_file(cif_path_filename))}
+
+def store_structure(cif_path_filename):
+    """
+    Parse a CIF file and write its sidecar file in the structure store.
+
+    Returns:
+        store_filename (str): Path of the sidecar file.
+    """
+    structure = parse_structure(cif_path_filename)
+    store_filename = get_store_filename(cif_path_filename)
+    os.makedirs(os.path.dirname(store_filename),exist_ok=True)
+    # Write in a temporary file, then rename it, so that a partial file is never read
+    tmp_filename = f"{store_filename[:-len('.npz')]}.tmp{os.getpid()}.npz"
+    np.savez(tmp_filename,**structure)
+    os.replace(tmp_filename,store_filename)
+    return store_filename
+
+def _read_store_file(store_filename):
+    '''
+    Read the fields of a sidecar file.
+    '''
+    with np.load(store_filename) as data:
+        return {field:data[field] for field in STORE_FIELDS}
+
+def is_stored(cif_path_filename):
+    """
+    True if the sidecar file of a CIF file exists and matches its content.
+    """
+    store_filename = get_store_filename(cif_path_filename)
+    if not os.path.isfile(store_filename):
+        return False
+    with np.load(store_filename) as data:
+        return str(data["sha256"]) == hash_file(cif_path_filename)
+
+def load_structure(cif_path_filename):
+    """
+    Read a structure from the structure store, parsing the CIF file if it is not stored or if it changed.
+
+    Args:
+        cif_path_filename (str): Path of the CIF file.
+
+    Returns:
+        structure (SimpleNamespace): The fields `STORE_FIELDS` of the structure.
+    """
+    if not is_stored(cif_path_filename):
+        store_structure(cif_path_filename)
+    return SimpleNamespace(**_read_store_file(get_store_filename(cif_path_filename)))
+
+def _update_store(cif_path_filename):
+    '''
+    Parse a CIF file if it is not stored or if it changed (task of `build_structure_store`).
+    '''
+    if not is_stored(cif_path_filename):
+        store_structure(cif_path_filename)
+
+def build_structure_store(cif_dir,cifnames,max_workers=None):
+    """
+    Parse the structures of a run in parallel and write their sidecar files.
+
+    Args:
+        cif_dir (str): Directory of the CIF files.
+        cifnames (list): CIF names, without the extension.
+        max_workers (int, optional): Number of processes; default is the number of CPUs.
+
+    Returns:
+        failures (dict): A dictionary CIF name -> error, for the CIF files which could not be parsed.
+    """
+    cif_path_filenames = {cifname:f"{cif_dir}/{cifname}.cif" for cifname in cifnames}
+    failures = {}
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {cifname:executor.submit(_update_store,path) for cifname,path in cif_path_filenames.items()}
+        for cifname,future in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                failures[cifname] = repr(e)
+                warnings.warn(f"{cifname}.cif could not be parsed : {e!r}")
+    return failures
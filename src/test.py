@@ -1,6 +1,7 @@
 from deepdiff import DeepDiff
 import traceback
 import os,glob,json
+import importlib.util
 from src.wraspa2 import *
 from src.input_parser import *
 from src.convert_data import *
@@ -20,7 +21,7 @@ def run_test_isotherms_csv(args):
     try:
         if not args.input_file : args.input_file = f"{os.getenv('PACKAGE_DIR')}/tests/test_isotherms_csv/input.json"
         print(f"Reading input file in {args.input_file}")
-        cif_names, sim_dir_names, grid_use = prepare_input_files(args)
+        cif_names, sim_dir_names, grid_dir_names = prepare_input_files(args)
         run_simulations(args,sim_dir_names)
         reconstruct_isotherms_to_csv(args.output_dir,sim_dir_names)
         test_isotherms(args)
@@ -45,7 +46,7 @@ def run_test_output_json(args):
         if not args.input_file : args.input_file  = f"{os.getenv('PACKAGE_DIR')}/tests/test_output_json/input.json"
         output_test_file = f"{os.getenv('PACKAGE_DIR')}/tests/test_output_json/runtest.json"
         print(f"Reading input file in {args.input_file}")
-        cif_names, sim_dir_names, grid_use = prepare_input_files(args)
+        cif_names, sim_dir_names, grid_dir_names = prepare_input_files(args)
         run_simulations(args,sim_dir_names)
         reconstruct_isotherms_to_csv(args.output_dir,sim_dir_names)
         export_simulation_result_to_json(args.input_file,args.output_dir,sim_dir_names,verbose=False)
@@ -183,7 +184,7 @@ def run_test_charges(args):
     try:
         if not args.input_file : args.input_file      = f"{os.getenv('PACKAGE_DIR')}/tests/test_charges/input.json"
         print(f"Reading input file in {args.input_file}")
-        cif_names, sim_dir_names, grid_use = prepare_input_files(args,verbose=True)
+        cif_names, sim_dir_names, grid_dir_names = prepare_input_files(args,verbose=True)
         print("\nTest successful :)")
     except Exception as e:
         print(traceback.format_exc())
@@ -202,7 +203,7 @@ def run_test_charges_pacmof(args):
     try:
         if not args.input_file : args.input_file      = f"{os.getenv('PACKAGE_DIR')}/tests/test_charges_pacmof/input.json"
         print(f"Reading input file in {args.input_file}")
-        cif_names, sim_dir_names, grid_use = prepare_input_files(args,verbose=True)
+        cif_names, sim_dir_names, grid_dir_names = prepare_input_files(args,verbose=True)
         print("\nTest successful :)")
     except Exception as e:
         print(traceback.format_exc())
@@ -222,8 +223,8 @@ def run_test_grids(args):
     try:
         if not args.input_file : args.input_file      = f"{os.getenv('PACKAGE_DIR')}/tests/test_grids/input.json"
         print(f"Reading input file in {args.input_file}")
-        cif_names, sim_dir_names, grid_use = prepare_input_files(args)
-        run_simulations(args,sim_dir_names,grid_use = grid_use)
+        cif_names, sim_dir_names, grid_dir_names = prepare_input_files(args)
+        run_simulations(args,sim_dir_names,grid_dir_names=grid_dir_names)
         #export_simulation_result_to_json(args,sim_dir_names,verbose=False)
         print("\nTest successful :)")
     except Exception as e:
@@ -245,12 +246,89 @@ def run_test_cif_local_directory(args):
         shutil.copytree(f"{input_directory_test}/cif",Path.cwd() / 'cif')
         args.input_file = f"{input_directory_test}/input.json"
         print(f"Reading input file in {args.input_file}")
-        cif_names, sim_dir_names, grid_use = prepare_input_files(args)
-        run_simulations(args,sim_dir_names,grid_use = grid_use)
+        cif_names, sim_dir_names, grid_dir_names = prepare_input_files(args)
+        run_simulations(args,sim_dir_names,grid_dir_names=grid_dir_names)
         #export_simulation_result_to_json(args,sim_dir_names,verbose=False)
         print("\nTest successful :)")
     except Exception as e:
         print(traceback.format_exc())
         print("\nTest NOT successful :(")
     print(f"------------------------ End of the test ------------------------\n")
-    exit(0)
\ No newline at end of file
+    exit(0)
+
+def run_test_slurm(args):
+    """
+    Run a test that launch the whole workflow with the SLURM job-array backend.
+    The commands sbatch and squeue are replaced by local stand-ins which run the array tasks on this machine.
+
+    Args:
+        args (argparse.Namespace): Parsed command-line arguments.
+    """
+    print(f"------------------------ Running test ---------------------------\n")
+    try:
+        if not args.input_file : args.input_file = f"{os.getenv('PACKAGE_DIR')}/tests/test_slurm/input.json"
+        os.environ["PATH"] = f"{os.getenv('PACKAGE_DIR')}/tests/test_slurm/bin:{os.environ['PATH']}"
+        args.backend,args.sims_per_task,args.poll_interval = "slurm",4,2
+        print(f"Reading input file in {args.input_file}")
+        cif_names, sim_dir_names, grid_dir_names = prepare_input_files(args)
+        run_simulations(args,sim_dir_names,grid_dir_names=grid_dir_names)
+        reconstruct_isotherms_to_csv(args.output_dir,sim_dir_names)
+        test_isotherms(args)
+        print("\nTest successful :)")
+    except Exception as e:
+        print(traceback.format_exc())
+        print("\nTest NOT successful :(")
+    print(f"------------------------ End of the test ------------------------\n")
+    exit(0)
+
+def run_test_fetch(args):
+    """
+    Run a test that fetch CIF files concurrently from a local stand-in for the MOFXDB API
+    (see `tests/test_fetch/stub_mofxdb.py`), which fails the first query of each structure.
+    It checks the retries, the report of the structures which cannot be fetched, and a second
+    fetch of the same structures from the CIF cache in offline mode.
+
+    Args:
+        args (argparse.Namespace): Parsed command-line arguments.
+    """
+    print(f"------------------------ Running test ---------------------------\n")
+    try:
+        test_dir = f"{os.getenv('PACKAGE_DIR')}/tests/test_fetch"
+        cif_dir = f"{os.getenv('PACKAGE_DIR')}/tests/test_cif_local_directory/cif"
+        if not args.input_file : args.input_file = f"{test_dir}/input.json"
+        print(f"Reading input file in {args.input_file}")
+        with open(args.input_file) as f:
+            structures = json.load(f)["parameters"]["structure"]
+        spec = importlib.util.spec_from_file_location("stub_mofxdb",f"{test_dir}/stub_mofxdb.py")
+        stub_mofxdb = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(stub_mofxdb)
+        server = stub_mofxdb.serve(cif_dir)
+        os.environ["SAW_MOFXDB_URL"] = f"http://127.0.0.1:{server.server_port}"
+        os.environ["SAW_CACHE_DIR"] = f"{args.output_dir}/cache"
+        os.makedirs(f"{args.output_dir}/cif",exist_ok=True)
+
+        cifnames,errors = fetch_cifs_from_mofxdb(structures,args.output_dir,max_workers=4,retries=2,backoff=0.1)
+        server.shutdown()
+        assert list(errors.keys()) == ["BROKEN"], f"Unexpected fetch errors : {errors}"
+        assert os.path.isfile(f"{args.output_dir}/cif/fetch_errors.csv")
+        for structure in structures:
+            expected = [f"{args.output_dir}/cif/{structure}_coremof-2019.cif"] if os.path.isfile(f"{cif_dir}/{structure}.cif") else []
+            assert cifnames[structure] == expected, f"{structure} : {cifnames[structure]} instead of {expected}"
+        sources = read_cif_sources(f"{args.output_dir}/cif")
+        assert all(record["source"] == "mofxdb" for record in sources.values()), f"Unexpected CIF sources : {sources}"
+        print(f"{len(structures)} structures fetched, errors reported in {args.output_dir}/cif/fetch_errors.csv")
+
+        # The same structures, without network
+        os.environ["SAW_OFFLINE"] = "1"
+        structures = [structure for structure in structures if structure not in errors]
+        cifnames_cached,errors = fetch_cifs_from_mofxdb(structures,args.output_dir,max_workers=4)
+        assert len(errors) == 0 and all(cifnames_cached[s] == cifnames[s] for s in structures)
+        sources = read_cif_sources(f"{args.output_dir}/cif")
+        assert all(record["source"] == "cache" for record in sources.values()), f"Unexpected CIF sources : {sources}"
+        print(f"{len(structures)} structures read from the CIF cache in offline mode")
+        print("\nTest successful :)")
+    except Exception as e:
+        print(traceback.format_exc())
+        print("\nTest NOT successful :(")
+    print(f"------------------------ End of the test ------------------------\n")
+    exit(0)
@@ -0,0 +1,234 @@
+"""
+Pre-flight validation of a campaign, before any simulation is launched.
+
+The checks cover everything a simulation needs and which would otherwise only fail inside
+the running simulations:
+- each molecule has a definition in `$RASPA_DIR/share/raspa/molecules/ExampleDefinitions`,
+- each forcefield is a directory of `$RASPA_DIR/share/raspa/forcefield` with its
+  `pseudo_atoms.def` and `force_field_mixing_rules.def` files,
+- with grids, the atom types of each molecule are listed in `parameters/molecules.csv`
+  and defined in `pseudo_atoms.def`,
+- each structure has a CIF file whose cell can be read from its header and which ASE can
+  parse, and whose elements are defined in the forcefield.
+
+The checks are run in parallel and all the problems are reported at once. `saw.py validate`
+runs them on an input file (fetching the structures without charge assignment), and
+`saw.py run` runs them before writing the simulation inputs.
+"""
+import os,json
+from concurrent.futures import ThreadPoolExecutor,ProcessPoolExecutor
+import pandas as pd
+from ase.data import chemical_symbols
+from src.input_parser import *
+from src.structure_store import load_structure
+
+def _as_list(value):
+    '''
+    A parameter value as a list (parameters may be given as a single value or a list).
+    '''
+    return value if isinstance(value,list) else [value]
+
+def get_raspa_share_dir():
+    """
+    Directory of the RASPA data files (molecules, forcefields).
+    """
+    return f"{os.environ.get('RASPA_DIR')}/share/raspa"
+
+def read_forcefield_types(forcefield):
+    """
+    Read the pseudo-atom types of a forcefield of the RASPA directory.
+
+    Args:
+        forcefield (str): Name of the forcefield.
+
+    Returns:
+        pseudo_atoms (set): The types of `pseudo_atoms.def`.
+        framework_types (set): The names under which a framework atom is recognized : the types
+                               of `pseudo_atoms.def` and `force_field_mixing_rules.def`, without
+                               their trailing underscore, and the chemical elements of `pseudo_atoms.def`.
+    """
+    forcefield_dir = f"{get_raspa_share_dir()}/forcefield/{forcefield}"
+    pseudo_atoms,framework_types = set(),set()
+    with open(f"{forcefield_dir}/pseudo_atoms.def") as f:
+        rows = [line.split() for line in f if line.strip() and not line.startswith("#")]
+    # The first row is the number of pseudo atoms
+    for row in rows[1:]:
+        pseudo_atoms.add(row[0])
+        framework_types.update([row[0].rstrip("_")] + ([row[3]] if len(row) > 3 else []))
+    with open(f"{forcefield_dir}/force_field_mixing_rules.def") as f:
+        for line in f:
+            words = line.split()
+            if len(words) >= 3 and not line.startswith("#"):
+                framework_types.add(words[0].rstrip("_"))
+    return pseudo_atoms,framework_types
+
+def check_molecule(molecule):
+    """
+    Check that a molecule is defined in RASPA; returns a list of problems.
+    """
+    if not os.path.isfile(f"{get_raspa_share_dir()}/molecules/ExampleDefinitions/{molecule}.def"):
+        return [f"molecule {molecule} : not found in {get_raspa_share_dir()}/molecules/ExampleDefinitions"]
+    return []
+
+def check_forcefield(forcefield,grid_atoms=()):
+    """
+    Check that a forcefield is installed in RASPA and defines the grid atom types; returns a list of problems.
+    """
+    forcefield_dir = f"{get_raspa_share_dir()}/forcefield/{forcefield}"
+    if not os.path.isdir(forcefield_dir):
+        problem = f"forcefield {forcefield} : not found in {get_raspa_share_dir()}/forcefield"
+        if os.path.isdir(f"{os.environ.get('PACKAGE_DIR')}/parameters/forcefield/{forcefield}"):
+            problem += f" (copy it from {os.environ.get('PACKAGE_DIR')}/parameters/forcefield)"
+        return [problem]
+    problems = [f"forcefield {forcefield} : {filename} not found in {forcefield_dir}"
+                for filename in ["pseudo_atoms.def","force_field_mixing_rules.def"]
+                if not os.path.isfile(f"{forcefield_dir}/{filename}")]
+    if len(problems) > 0:
+        return problems
+    pseudo_atoms,_ = read_forcefield_types(forcefield)
+    return [f"forcefield {forcefield} : grid atom type {atom} not defined in pseudo_atoms.def"
+            for atom in grid_atoms if atom not in pseudo_atoms]
+
+def check_structure(cif_path_filename,framework_types=None):
+    """
+    Check that a CIF file can be read, and that its elements are defined in the forcefields.
+
+    Args:
+        cif_path_filename (str): Path of the CIF file.
+        framework_types (dict, optional): A dictionary forcefield -> framework types (see `read_forcefield_types`).
+
+    Returns:
+        problems (list): A list of problems.
+    """
+    name = os.path.basename(cif_path_filename)
+    try:
+        read_cif_cell(cif_path_filename)
+        structure = load_structure(cif_path_filename)
+    except Exception as e:
+        return [f"structure {name} : cannot be read ({e!r})"]
+    elements = sorted(set(chemical_symbols[number] for number in structure.numbers))
+    problems = []
+    for forcefield,types in (framework_types or {}).items():
+        missing = [element for element in elements if element not in types]
+        if len(missing) > 0:
+            problems.append(f"structure {name} : element(s) {' '.join(missing)} not defined in forcefield {forcefield}")
+    return problems
+
+def validate_input(input_file,max_workers=None):
+    """
+    Check the molecules, forcefields and grid atom types of an input file.
+
+    Args:
+        input_file (str): Path of the JSON input file.
+        max_workers (int, optional): Number of threads running the checks.
+
+    Returns:
+        problems (list): A list of problems, empty if the input is valid.
+    """
+    with open(input_file) as f:
+        data = json.load(f)
+    params = dict(data["parameters"])
+    params.update(data["defaults"])
+    molecules = _as_list(params["molecule_name"])
+    forcefields = _as_list(params.get("forcefield","ExampleMOFsForceField"))
+
+    problems = []
+    grid_atoms = []
+    if params.get("grid_use","no") == "yes":
+        df_mol = pd.read_csv(f"{os.environ.get('PACKAGE_DIR')}/parameters/molecules.csv", encoding='utf-8')
+        mol2atoms = {row['MOLECULE']: row['ATOMS'] for _,row in df_mol.iterrows()}
+        for molecule in molecules:
+            if molecule not in mol2atoms:
+                problems.append(f"molecule {molecule} : atom types not found in {os.environ.get('PACKAGE_DIR')}/parameters/molecules.csv")
+            else:
+                grid_atoms += [atom for atom in mol2atoms[molecule].split() if atom not in grid_atoms]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = [executor.submit(check_molecule,molecule) for molecule in molecules]
+        results += [executor.submit(check_forcefield,forcefield,grid_atoms) for forcefield in forcefields]
+        for result in results:
+            problems += result.result()
+    return problems
+
+def validate_structures(cif_dir,cifnames,forcefields,max_workers=None):
+    """
+    Check the CIF files of a run, in parallel.
+
+    Args:
+        cif_dir (str): Directory of the CIF files.
+        cifnames (list): CIF names, without the extension.
+        forcefields (list): Names of the forcefields of the run.
+        max_workers (int, optional): Number of processes running the checks.
+
+    Returns:
+        problems (list): A list of problems, empty if all the structures are valid.
+    """
+    framework_types = {}
+    for forcefield in forcefields:
+        try:
+            framework_types[forcefield] = read_forcefield_types(forcefield)[1]
+        except OSError:
+            # Missing forcefield, reported by validate_input
+            pass
+    problems = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        results = [executor.submit(check_structure,f"{cif_dir}/{cifname}.cif",framework_types) for cifname in cifnames]
+        for result in results:
+            problems += result.result()
+    return problems
+
+def report_problems(problems,output_dir=None):
+    """
+    Print the problems found by the validation, and write them in `<output_dir>/validation_errors.txt`.
+
+    Raises:
+        ValueError: If there is any problem, so that the campaign is not launched.
+    """
+    report = f"{output_dir}/validation_errors.txt" if output_dir is not None else None
+    if len(problems) == 0:
+        if report is not None and os.path.isfile(report):
+            os.remove(report)
+        print("Validation : no problem found.")
+        return
+    print(f"Validation : {len(problems)} problem(s) found.")
+    for problem in problems:
+        print(f"  - {problem}")
+    if report is not None:
+        with open(report,"w") as f:
+            f.write("\n".join(problems) + "\n")
+    raise ValueError(f"The campaign would fail : {len(problems)} problem(s) found by the validation"
+                     + (f", see {report}." if report is not None else "."))
+
+def validate_campaign(args):
+    """
+    Validate an input file and its structures (`saw.py validate`), without running any simulation.
+
+    The structures are fetched in `<output_dir>/cif` as in a run, without charge assignment.
+
+    Args:
+        args (argparse.Namespace): Parsed command-line arguments.
+
+    Returns:
+        problems (list): A list of problems, empty if the campaign is valid.
+    """
+    max_workers = getattr(args,"max_workers",None)
+    os.makedirs(args.output_dir,exist_ok=True)
+    problems = validate_input(args.input_file,max_workers=max_workers)
+
+    with open(args.input_file) as f:
+        data = json.load(f)
+    params = dict(data["parameters"])
+    params.update(data["defaults"])
+    structures = _as_list(params["structure"])
+    l_params = [{"structure":structure,"charge_method":None} for structure in structures]
+    cifnames,l_params = get_cifs(l_params,args.output_dir,database=params.get("database","mofxdb"),
+                                 substring="coremof-2019",fetch_workers=params.get("fetch_workers",8))
+    problems += [f"structure {structure} : no CIF file found in database {params.get('database','mofxdb')}"
+                 for structure in structures if not any(structure in cifname for cifname in cifnames)]
+    problems += validate_structures(f"{args.output_dir}/cif",cifnames,
+                                    _as_list(params.get("forcefield","ExampleMOFsForceField")),max_workers=max_workers)
+    try:
+        report_problems(problems,args.output_dir)
+    except ValueError as e:
+        print(e)
+    return problems
@@ -10,12 +10,19 @@ from ctypes import cdll, c_void_p, c_char_p, c_bool, cast
 import os,sys,stat
 from textwrap import dedent
 from multiprocessing import Process, Pipe
+from multiprocessing.connection import wait
 import argparse
 
 import os,shutil
 import time
 from src.input_parser import *
 from src.convert_data import *
+from src.scheduler import *
+from src.scheduler import _read_raspa_input
+from src.convergence import write_convergence_settings
+from src.grid_cache import *
+from src.canonical_cif import *
+from src.validate import *
 
 from .__init__ import __version__
 
@@ -71,7 +78,7 @@ def prepare_input_files(args,verbose=False):
     Returns:
         cifnames (list) : List of structure names from the database
         sim_dir_names (list): List of simulation directory names.
-        grid_use (bool) : if True, GCMC use grid calculations
+        grid_dir_names (list) : List of the grid directory names of the grids to compute (empty without grids)
     """
     # 1. Creates the output directory if it doesn't exist.
     try:
@@ -82,6 +89,10 @@ def prepare_input_files(args,verbose=False):
     print(f"Output directory : {args.output_dir}")
 
     # 2. Parses the JSON input file and extracts input parameters for simulations.
+    # The molecules, forcefields and grid atom types are checked first, all the problems being reported at once
+    validation = not getattr(args,"skip_validation",False)
+    if validation:
+        report_problems(validate_input(args.input_file,max_workers=getattr(args,"max_workers",None)),args.output_dir)
     l_params = parse_json_to_list(args.input_file)
     params = parse_json_to_dict(args.input_file)
     
@@ -90,23 +101,63 @@ def prepare_input_files(args,verbose=False):
     database = params["database"] if 'database' in params.keys() else 'mofxdb'
     cifnames,l_params = get_cifs(l_params,args.output_dir,
                                  database=database, substring="coremof-2019",
+                                 fetch_workers=params.get("fetch_workers",8),
+                                 charge_workers=params.get("charge_workers"),
+                                 charge_timeout=params.get("charge_timeout",600),
+                                 charge_cache=params.get("charge_cache","yes"),
+                                 qmof_fallback=params.get("qmof_fallback"),
                                  verbose=verbose)
+
+    # Parse each structure once for the steps reading the atoms (validation, canonical CIF files),
+    # which then read the parsed structures from the structure store
+    canonical = params.get("canonical_cif","no") == "yes"
+    if validation or canonical:
+        build_structure_store(f"{args.output_dir}/cif",cifnames,max_workers=params.get("charge_workers"))
+    # Minimal supercells of all the structures in one vectorized calculation, memoized for the next steps
+    compute_minimal_unit_cells([f"{args.output_dir}/cif/{cifname}.cif" for cifname in cifnames])
+    # Check the structures of the simulations before writing any input
+    if validation:
+        report_problems(validate_structures(f"{args.output_dir}/cif",sorted(set(p["structure"] for p in l_params)),
+                                            sorted(set(p.get("forcefield","ExampleMOFsForceField") for p in l_params)),
+                                            max_workers=getattr(args,"max_workers",None)),args.output_dir)
+
+    # Convert each structure once to a canonical P1 CIF file, read by all its simulations
+    if canonical:
+        canonicalize_cifs(f"{args.output_dir}/cif",cifnames,max_workers=params.get("charge_workers"))
     
     # 4. Generate grids for GCMC calculations
     params["grid_use"] = params.get("grid_use", "no")
     grid_use = params["grid_use"] == "yes"
+    grid_dir_names = []
     if params["grid_use"] == "yes":
         molecules = params["molecule_name"]
         # Delete useless keywords for grids
         for keyword in  ["temperature","pressure","molecule_name"]:
             params.pop(keyword)
         
+        # Spacing of the grids of each structure, within the memory budget of a simulation
+        grid_spacings = get_grid_spacings(cifnames,args.output_dir,params,molecules)
+
         # Loop on each unique structure file
         for cifname in cifnames:
             cif_path_filename = f'{args.output_dir}/cif/{cifname}.cif'
+            # The grids are keyed by the CIF file read by RASPA
+            raspa_cif = get_raspa_cif(cif_path_filename,canonical)
            
             # Read adsorbate atom types
             grid_atoms, grid_n_atoms = _read_atom_types(f"{os.getenv('PACKAGE_DIR')}/parameters/molecules.csv",molecules)
+            grid_types = grid_atoms.split()
+            if params.get("charge_method") not in [None,""]:
+                grid_types.append(ELECTROSTATICS)
+
+            # Reuse the grids already computed for the same CIF, forcefield and spacing, compute the missing ones
+            forcefield = params.get("forcefield","ExampleMOFsForceField")
+            grid_spacing = params["grid_spacing"] = grid_spacings[cifname]
+            if params.get("grid_cache","yes") == "yes":
+                grid_types = restore_grids(raspa_cif,cifname,forcefield,grid_spacing,grid_types)
+                if len(grid_types) == 0:
+                    print(f"Grids of {cifname} found in the cache.")
+                    continue
             
             # Update keywords
             params["structure"] = cifname
@@ -114,20 +165,40 @@ def prepare_input_files(args,verbose=False):
             params["init_cycles"] = 0
             params["simulation_type"] = "MakeGrid"
             params["unit_cells"] = get_minimal_unit_cells(cif_path_filename)
-            params["grid_atoms"] = grid_atoms
-            params["grid_n_atoms"] = grid_n_atoms
-
-            # Create a directory, add cif and input for grid calculations
-            work_dir = f"{args.output_dir}/grids/{cifname}"
-            os.makedirs(work_dir,exist_ok=True)
-            shutil.copy(cif_path_filename, work_dir)
-            create_script(**params, save=True, filename=f'{work_dir}/simulation.input')
-            create_run_script(path=work_dir, save=True)
-        create_job_script(args.output_dir, cifnames,type='grids')
+
+            # One job per atom type, so that the grids are computed concurrently
+            jobs_types = _split_grid_jobs(grid_types,grid_atoms.split())
+            if len(jobs_types) == 0:
+                warnings.warn(f"No atom type to compute the Coulomb grid of {cifname} with, the grid is skipped.")
+                continue
+            for job_types in jobs_types:
+                atoms = [grid_type for grid_type in job_types if grid_type != ELECTROSTATICS]
+                params["grid_atoms"] = " ".join(atoms)
+                params["grid_n_atoms"] = len(atoms)
+                params["ewald_use"] = "yes" if ELECTROSTATICS in job_types else "no"
+
+                # Create a directory, add cif and input for grid calculations
+                grid_dir_name = f"{cifname}_{job_types[0]}"
+                work_dir = f"{args.output_dir}/grids/{grid_dir_name}"
+                os.makedirs(work_dir,exist_ok=True)
+                copy_framework_cif(cif_path_filename, work_dir, canonical=canonical)
+                create_script(**params, save=True, filename=f'{work_dir}/simulation.input')
+                create_run_script(path=work_dir, save=True)
+                if params.get("grid_cache","yes") == "yes":
+                    write_grid_keys(work_dir,raspa_cif,cifname,forcefield,grid_spacing,job_types)
+                grid_dir_names.append(grid_dir_name)
+        if len(grid_dir_names) > 0:
+            create_job_script(args.output_dir, grid_dir_names,type='grids')
     
     # 4. Generates the simulation directories, copies CIF files, and creates the input scripts for RASPA.
     print("Writing input/running files for RASPA ...")
+    index_file = f"{args.output_dir}/gcmc/index.csv"
+    df_index = None
+    if getattr(args,"resume",False) and os.path.isfile(index_file):
+        df_index = pd.read_csv(index_file)
+        print(f"Resuming the simulations indexed in {index_file}.")
     sim_dir_names = []
+    resumed = set()
     for params in l_params:
         # Get CIF name
         cif_path_filename = f'{args.output_dir}/cif/{params["structure"]}.cif'
@@ -135,18 +206,139 @@ def prepare_input_files(args,verbose=False):
         # Correct unit cell to avoid bias from periodic boundary conditions
         params["unit_cells"] = get_minimal_unit_cells(cif_path_filename)
 
-        # Create a working directory, add CIF file, and generate input script
-        work_dir = create_dir(params, args.output_dir)
+        # The grids read by the simulation are the ones of the atom types of its molecule
+        if grid_use:
+            params["grid_atoms"],params["grid_n_atoms"] = _read_atom_types(f"{os.getenv('PACKAGE_DIR')}/parameters/molecules.csv",[params["molecule_name"]])
+            params["grid_spacing"] = grid_spacings[params["structure"]]
+
+        # Create a working directory, add CIF file, and generate input script.
+        # When resuming, the directory of a previous run is kept as it is (finished output, restart files, chunks)
+        simkey = find_simkey(df_index, params) if df_index is not None else None
+        if simkey is not None and _has_simulation_inputs(f"{args.output_dir}/gcmc/{simkey}"):
+            params["simkey"] = simkey
+            resumed.add(simkey)
+        else:
+            write_simulation_inputs(params, args.output_dir, simkey=simkey)
         sim_dir_names.append(params["simkey"])
-        shutil.copy(cif_path_filename, work_dir)
         if verbose : print(params)
-        create_script(**params, save=True, filename=f'{work_dir}/simulation.input')
-        create_run_script(path=work_dir, save=True)
+
+    # Warm-start mode : each isotherm point starts from the final configuration of the previous one
+    if any(params.get("warm_start","no") == "yes" for params in l_params):
+        chain_isotherm_points(l_params, args.output_dir, keep=resumed)
 
     # 5. Creates the job scripts for running simulations on multiple CPUs.
     create_job_script(args.output_dir, sim_dir_names)
 
-    return cifnames,sim_dir_names,grid_use
+    return cifnames,sim_dir_names,grid_dir_names
+
+def write_simulation_inputs(params,output_dir,simkey=None):
+    """
+    Create the directory of a GCMC simulation with its CIF file, RASPA input and run script.
+
+    Args:
+        params (dict): The simulation parameters (with `unit_cells`); its `simkey` is set here.
+        output_dir (str): Output directory path.
+        simkey (str, optional): The key of an existing simulation directory to reuse
+                                (e.g. when resuming a run). By default, a new directory is created
+                                and indexed in `gcmc/index.csv`.
+
+    Returns:
+        work_dir (str): Path of the simulation directory.
+    """
+    cif_path_filename = f'{output_dir}/cif/{params["structure"]}.cif'
+    if simkey is not None:
+        params["simkey"] = simkey
+        work_dir = f'{output_dir}/gcmc/{simkey}'
+        os.makedirs(work_dir,exist_ok=True)
+    else:
+        work_dir = create_dir(params, output_dir)
+    copy_framework_cif(cif_path_filename, work_dir, canonical=params.get("canonical_cif","no") == "yes")
+    create_script(**params, save=True, filename=f'{work_dir}/simulation.input')
+    check_convergence = params.get("target_uncertainty") is not None
+    if check_convergence:
+        write_convergence_settings(work_dir, params["molecule_name"], params["target_uncertainty"],
+                                   max_cycles=params.get("max_cycles"), cycles=params.get("cycles",2000))
+    create_run_script(path=work_dir, save=True, check_convergence=check_convergence)
+    return work_dir
+
+def _has_simulation_inputs(work_dir):
+    '''
+    True if a simulation directory has its RASPA input and run script (written by a previous run).
+    '''
+    return os.path.isfile(f"{work_dir}/simulation.input") and os.path.isfile(f"{work_dir}/run.sh")
+
+def chain_isotherm_points(l_params,output_dir,keep=()):
+    """
+    Chain the points of each isotherm to warm-start them from restart configurations.
+
+    The simulations which only differ by their pressure (same structure, molecule,
+    temperature, ...) are sorted by increasing pressure. Each point, except the first one,
+    reads the final configuration of the previous point (RASPA restart file) and runs
+    `warm_start_init_cycles` initialization cycles (default : a tenth of `init_cycles`)
+    instead of equilibrating from an empty box. The chains are stored in
+    `<output_dir>/gcmc/warm_start.json` (simkey -> simkey of the previous point),
+    which `run_simulations` reads to launch the points of a chain one after the other.
+
+    Args:
+        l_params (list): A list of dictionaries with the parameters of each simulation (with simkeys).
+        output_dir (str): Output directory path.
+        keep (set, optional): Simkeys of the simulations resumed from a previous run, whose inputs
+                              are already chained and are not rewritten.
+
+    Returns:
+        previous (dict): A dictionary simkey -> simkey of the previous point of the isotherm.
+    """
+    groups = {}
+    for params in l_params:
+        key = tuple((k,str(v)) for k,v in sorted(params.items()) if k not in ["pressure","simkey"])
+        groups.setdefault(key,[]).append(params)
+
+    previous = {}
+    for group in groups.values():
+        group.sort(key=lambda params: params["pressure"])
+        for params_previous,params in zip(group[:-1],group[1:]):
+            previous[params["simkey"]] = params_previous["simkey"]
+            if params["simkey"] not in keep:
+                write_warm_start_inputs(params,params_previous["simkey"],output_dir)
+
+    with open(f"{output_dir}/gcmc/warm_start.json","w") as f:
+        json.dump(previous,f,indent=4)
+    print(f"Warm start : {len(previous)} isotherm points will start from the configuration of the previous point.")
+    return previous
+
+def write_warm_start_inputs(params,simkey_previous,output_dir):
+    """
+    Rewrite the RASPA input and run script of a simulation to start from the final
+    configuration of the simulation `simkey_previous`, with fewer initialization cycles.
+
+    Args:
+        params (dict): The simulation parameters (with `simkey` and `unit_cells`).
+        simkey_previous (str): The key of the simulation providing the restart file.
+        output_dir (str): Output directory path.
+    """
+    init_cycles = params.get("init_cycles","auto")
+    if init_cycles == "auto":
+        init_cycles = min(params.get("cycles",2000) // 2, 10000)
+    init_cycles = params.get("warm_start_init_cycles", init_cycles // 10)
+    work_dir = f'{output_dir}/gcmc/{params["simkey"]}'
+    create_script(**{**params, "init_cycles": init_cycles, "restart_file": "yes"},
+                  save=True, filename=f'{work_dir}/simulation.input')
+    create_run_script(path=work_dir, save=True,
+                      restart_from=f'../{simkey_previous}',
+                      restart_names=_get_restart_names(params),
+                      check_convergence=params.get("target_uncertainty") is not None)
+
+def _get_restart_names(params):
+    '''
+    Names of the restart file RASPA reads in RestartInitial/System_0 for a simulation.
+
+    RASPA formats the pressure with '%lg' after a unit conversion; neighbouring
+    values are included so that a rounding difference does not hide the file.
+    '''
+    a, b, c = params["unit_cells"]
+    temperature = params["temperature"]
+    return sorted({f'restart_{params["structure"]}_{a}.{b}.{c}_{temperature:f}_{pressure:g}'
+                   for pressure in [params["pressure"]*(1-1e-12),params["pressure"],params["pressure"]*(1+1e-12)]})
 
 def _read_atom_types(molecules_path,molecules):
     df_mol = pd.read_csv(molecules_path, encoding='utf-8')
@@ -157,31 +349,271 @@ def _read_atom_types(molecules_path,molecules):
     N_ATOMS = len(ATOMS.split())
     return ATOMS,N_ATOMS
 
-def run_simulations(args,sim_dir_names,grid_use=False):
+# Memory of a grid point : energy and derivatives used by the interpolation, in double precision
+GRID_BYTES_PER_POINT = 64
+# Memory of a RASPA process without grids
+RASPA_BASE_MEMORY = 100e6
+
+def estimate_grid_memory(cif_path_filename,unit_cells,spacing,n_grids):
+    """
+    Estimate the memory (bytes) taken by the energy grids of a structure in a RASPA process.
+
+    The number of grid points is the volume of the simulation box (unit cell volume times
+    the number of unit cells) divided by the volume of a grid cell (spacing^3).
+
+    Args:
+        cif_path_filename (str): Path of the CIF file of the structure.
+        unit_cells (tuple): Number of unit cells in each direction.
+        spacing (float): Grid spacing (angstrom).
+        n_grids (int): Number of grids (atom types, and the Coulomb grid).
+
+    Returns:
+        memory (float): Estimated memory in bytes.
+    """
+    n_points = get_cell_volume(cif_path_filename)*np.prod(unit_cells)/spacing**3
+    return n_points*n_grids*GRID_BYTES_PER_POINT
+
+def choose_grid_spacing(cif_path_filename,unit_cells,n_grids,spacing=0.1,memory_budget=None,max_spacing=0.3):
+    """
+    Choose the finest grid spacing, not finer than `spacing`, whose grids fit in a memory budget.
+
+    Args:
+        cif_path_filename (str): Path of the CIF file of the structure.
+        unit_cells (tuple): Number of unit cells in each direction.
+        n_grids (int): Number of grids loaded by a simulation.
+        spacing (float): Requested grid spacing (angstrom).
+        memory_budget (float, optional): Memory budget of a simulation (bytes). If None, `spacing` is returned.
+        max_spacing (float): Coarsest spacing accepted (angstrom); if the grids do not fit
+                             at this spacing, it is used anyway with a warning.
+
+    Returns:
+        spacing (float): The grid spacing (angstrom), rounded up to 0.01 angstrom.
+    """
+    if memory_budget is None:
+        return spacing
+    memory = estimate_grid_memory(cif_path_filename,unit_cells,spacing,n_grids)
+    if memory <= memory_budget:
+        return spacing
+    # The memory decreases as the cube of the spacing
+    new_spacing = ceil(100*spacing*(memory/memory_budget)**(1/3))/100
+    if new_spacing > max_spacing:
+        warnings.warn(f"The grids of {cif_path_filename} need {memory/1e9:.1f} GB with a {spacing} A spacing; "
+                      f"they exceed the memory budget of {memory_budget/1e9:.1f} GB even with the coarsest "
+                      f"spacing {max_spacing} A, which is used.")
+        return max_spacing
+    print(f"Grid spacing of {os.path.basename(cif_path_filename)} : {new_spacing} A, to fit in {memory_budget/1e9:.1f} GB.")
+    return new_spacing
+
+def get_grid_spacings(cifnames,output_dir,params,molecules):
+    """
+    Grid spacing of each structure, from the keywords `grid_spacing`, `grid_memory_budget` (GB per simulation)
+    and `grid_max_spacing` of the `defaults` field (see `choose_grid_spacing`).
+
+    The budget is applied to the simulation loading the most grids (molecule with the most atom types,
+    and the Coulomb grid for charged frameworks); all the simulations of a structure use the same spacing.
+
+    Returns:
+        grid_spacings (dict): A dictionary structure name -> grid spacing.
+    """
+    memory_budget = params.get("grid_memory_budget")
+    n_grids = max(_read_atom_types(f"{os.getenv('PACKAGE_DIR')}/parameters/molecules.csv",[molecule])[1]
+                  for molecule in molecules)
+    if params.get("charge_method") not in [None,""]:
+        n_grids += 1
+    grid_spacings = {}
+    for cifname in cifnames:
+        cif_path_filename = f'{output_dir}/cif/{cifname}.cif'
+        grid_spacings[cifname] = choose_grid_spacing(cif_path_filename,get_minimal_unit_cells(cif_path_filename),n_grids,
+                                                     spacing=params.get("grid_spacing",0.1),
+                                                     memory_budget=memory_budget*1e9 if memory_budget else None,
+                                                     max_spacing=params.get("grid_max_spacing",0.3))
+    return grid_spacings
+
+def estimate_job_memory(job_dir):
+    """
+    Estimate the memory (bytes) of a RASPA job from its input files : the grids it computes
+    or loads (see `estimate_grid_memory`), plus the memory of a RASPA process without grids.
+    """
+    keywords = _read_raspa_input(f"{job_dir}/simulation.input")
+    make_grid = keywords.get("SimulationType",[""])[0] == "MakeGrid"
+    if not make_grid and keywords.get("UseTabularGrid",["no"])[0] != "yes":
+        return RASPA_BASE_MEMORY
+    n_grids = int(keywords.get("NumberOfGrids",[0])[0])
+    if (keywords.get("UseChargesFromCIFFile",["no"])[0] == "yes"
+            and keywords.get("ChargeMethod",["Ewald"])[0] != "None"):
+        n_grids += 1
+    unit_cells = [int(n) for n in keywords.get("UnitCells",[1,1,1])]
+    spacing = float(keywords.get("SpacingVDWGrid",[0.1])[0])
+    cif_path_filename = f"{job_dir}/{keywords['FrameworkName'][0]}.cif"
+    return RASPA_BASE_MEMORY + estimate_grid_memory(cif_path_filename,unit_cells,spacing,n_grids)
+
+def run_simulations(args,sim_dir_names,grid_dir_names=None,append=False):
     '''
     Run different simulation type with RASPA.
+
+    With `append`, the exit codes are added to the files `jobs_<type>.csv` of the previous calls
+    (e.g. the rounds of the adaptive isotherms) instead of replacing them.
+
+    The grid jobs are the ones written by `prepare_input_files` for the grids missing from the cache;
+    the other directories of `<output_dir>/grids` (e.g. of a previous run) are not run.
+    In resume mode (`args.resume`), only the simulations which did not finish in a previous run are launched.
     '''
-    # Compute grids before GCMC
-    if grid_use == True:
-        _run_simulations(args,sim_dir_names,type="grids")
+    grid_dir_names = grid_dir_names or []
 
     # By default, always run GCMC
-    _run_simulations(args,sim_dir_names,type="gcmc")
+    sim_dir_names = _get_unfinished(args,sim_dir_names,type="gcmc")
+    unfinished_grid_dir_names = _get_unfinished(args,grid_dir_names,type="grids")
+    if len(grid_dir_names) > 0 and getattr(args,"backend","local") == "slurm":
+        # Compute all grids before GCMC in a first job array
+        if len(unfinished_grid_dir_names) > 0:
+            _run_simulations(args,unfinished_grid_dir_names,type="grids",append=append)
+        if len(sim_dir_names) > 0:
+            _run_simulations(args,sim_dir_names,type="gcmc",append=append)
+    elif len(sim_dir_names) + len(unfinished_grid_dir_names) > 0:
+        # Each GCMC simulation starts as soon as the grids of its structure are computed
+        _run_simulations(args,sim_dir_names,type="gcmc",grid_dir_names=unfinished_grid_dir_names,append=append)
+    else:
+        print("All the simulations already finished, nothing to run.")
 
-def _run_simulations(args,sim_dir_names,type="gcmc"):
+    # Add the new grids to the grid cache
+    for name in grid_dir_names:
+        if is_simulation_finished(f"{args.output_dir}/grids/{name}"):
+            store_grids(f"{args.output_dir}/grids/{name}")
+
+def _get_unfinished(args,sim_dir_names,type="gcmc"):
+    '''
+    In resume mode, remove from the list the simulations which already finished.
+    '''
+    if not getattr(args,"resume",False):
+        return sim_dir_names
+    unfinished = [name for name in sim_dir_names
+                  if not is_simulation_finished(f"{args.output_dir}/{type}/{name}")]
+    print(f"{len(sim_dir_names)-len(unfinished)} jobs type {type} already finished, {len(unfinished)} to run.")
+    return unfinished
+
+def _run_simulations(args,sim_dir_names,type="gcmc",grid_dir_names=None,append=False):
     """
     Run gas adsorption simulations with RASPA using prepared input files.
 
+    With the 'local' backend, the jobs are run by a pool of at most `args.max_workers`
+    concurrent processes (by default the number of usable cores), see `scheduler.run_jobs`,
+    whose estimated memory (see `estimate_job_memory`) fits in `args.max_memory` GB
+    (by default the available memory of the node).
+    With the 'slurm' backend, the jobs are submitted as a single SLURM job array of
+    `args.sims_per_task` simulations per task, see `scheduler.run_jobs_slurm`.
+    With the 'lpt' schedule (default), the jobs with the largest estimated cost are launched
+    first (see `scheduler.estimate_cost`); with the 'fifo' schedule, they are launched in order.
+    The exit code of each job is written in `<output_dir>/jobs_<type>.csv` (added to the file with `append`).
+
+    Jobs chained in warm-start mode (see `chain_isotherm_points`) run one after the other.
+    If grid jobs are given, they are run in the same pool as the GCMC simulations, and each
+    simulation starts as soon as the grids of its structure are computed (local backend only).
+
     Args:
         args (argparse.Namespace): Parsed command-line arguments.
         sim_dir_names (list): List of simulation directory names.
+        type (str): Simulation type, i.e. the subdirectory of the jobs ('gcmc' or 'grids').
+        grid_dir_names (list, optional): List of grid directory names to run with the GCMC simulations.
+        append (bool): If True, the exit codes are added to the files `jobs_<type>.csv` instead of replacing them.
+
+    Returns:
+        exit_codes (dict): A dictionary job directory -> exit code.
     """
-    print(f"Running {len(sim_dir_names)} jobs type {type} with RASPA ...")
+    backend = getattr(args,"backend","local")
     os.chdir(args.output_dir)
     start_time = time.time()
-    os.system(f"./job_{type}.sh > sim.log 2>&1")
+    job_dirs = [f"{args.output_dir}/{type}/{name}" for name in sim_dir_names]
+    dependencies = _get_dependencies(args.output_dir,type)
+    grid_dirs = [f"{args.output_dir}/grids/{name}" for name in grid_dir_names or []]
+    if len(grid_dirs) > 0:
+        if backend != "local":
+            raise ValueError("Grid and GCMC jobs can only be run together with the 'local' backend.")
+        for job_dir,prerequisites in _get_grid_dependencies(job_dirs,grid_dirs).items():
+            dependencies.setdefault(job_dir,[]).extend(prerequisites)
+        job_dirs = grid_dirs + job_dirs
+    priorities = None
+    if getattr(args,"schedule","lpt") == "lpt":
+        costs = {job_dir: estimate_cost(job_dir) for job_dir in job_dirs}
+        job_dirs, priorities = sort_by_cost(job_dirs,get_critical_path_costs(costs,dependencies))
+    if backend == "local":
+        max_workers = getattr(args,"max_workers",None) or get_usable_cores()
+        print(f"Running {len(sim_dir_names)} jobs type {type}"
+              + (f" and {len(grid_dirs)} jobs type grids" if grid_dirs else "")
+              + f" with RASPA on {max_workers} cores ...")
+        memory = {job_dir: estimate_job_memory(job_dir) for job_dir in job_dirs}
+        max_memory = getattr(args,"max_memory",None)
+        exit_codes = run_jobs(job_dirs,max_workers=max_workers,priorities=priorities,
+                              dependencies=dependencies,stagger=getattr(args,"stagger",0.0),
+                              memory=memory,max_memory=max_memory*1e9 if max_memory else None)
+    elif backend == "slurm":
+        print(f"Running {len(sim_dir_names)} jobs type {type} with RASPA in a SLURM job array ...")
+        exit_codes = run_jobs_slurm(args.output_dir,job_dirs,type=type,
+                                    sims_per_task=getattr(args,"sims_per_task",1),
+                                    slurm_options=getattr(args,"slurm_option",None),
+                                    dependencies=dependencies,
+                                    poll_interval=getattr(args,"poll_interval",30))
+    else:
+        raise ValueError(f"Invalid backend '{backend}'. Expected 'local' or 'slurm'.")
     execution_time = time.time()- start_time
     print(f"Simulations completed in {execution_time:.2f} seconds.")
+    if len(grid_dirs) > 0:
+        write_exit_codes({job_dir: exit_codes[job_dir] for job_dir in grid_dirs},f"{args.output_dir}/jobs_grids.csv",
+                         append=append)
+    write_exit_codes({job_dir: code for job_dir,code in exit_codes.items() if job_dir not in grid_dirs},
+                     f"{args.output_dir}/jobs_{type}.csv",append=append)
+    return exit_codes
+
+def _split_grid_jobs(grid_types,atom_types):
+    """
+    Split the grids of a structure into MakeGrid jobs, one per atom type.
+
+    The Coulomb grid only depends on the framework : it is computed by the first job. RASPA needs
+    at least one atom grid per job, so if the Coulomb grid is the only one to compute (the atom grids
+    being in the cache), it is computed with the grid of the first atom type of the molecules.
+
+    Args:
+        grid_types (list): Grids to compute, atom types and `ELECTROSTATICS`.
+        atom_types (list): All the atom types of the molecules.
+
+    Returns:
+        jobs_types (list): The grids of each job; empty if there is no atom type.
+    """
+    jobs_types = [[grid_type] for grid_type in grid_types if grid_type != ELECTROSTATICS]
+    if ELECTROSTATICS in grid_types:
+        if len(jobs_types) == 0:
+            if len(atom_types) == 0:
+                return []
+            jobs_types.append([atom_types[0]])
+        jobs_types[0].append(ELECTROSTATICS)
+    return jobs_types
+
+def _get_grid_dependencies(job_dirs,grid_dirs):
+    '''
+    Make each simulation depend on the grid jobs of its structure (same `FrameworkName`), as a dictionary
+    job directory -> list of grid job directories.
+    '''
+    framework = lambda job_dir: _read_raspa_input(f"{job_dir}/simulation.input").get("FrameworkName",[None])[0]
+    structure_grids = {}
+    for grid_dir in grid_dirs:
+        structure_grids.setdefault(framework(grid_dir),[]).append(grid_dir)
+    dependencies = {}
+    for job_dir in job_dirs:
+        prerequisites = structure_grids.get(framework(job_dir),[])
+        if len(prerequisites) > 0:
+            dependencies[job_dir] = prerequisites
+    return dependencies
+
+def _get_dependencies(output_dir,type="gcmc"):
+    '''
+    Read the dependencies between jobs (warm-start chains), as a dictionary job directory -> list of job directories.
+    '''
+    dependencies = {}
+    chain_file = f"{output_dir}/{type}/warm_start.json"
+    if os.path.isfile(chain_file):
+        with open(chain_file) as f:
+            for simkey,simkey_previous in json.load(f).items():
+                dependencies[f"{output_dir}/{type}/{simkey}"] = [f"{output_dir}/{type}/{simkey_previous}"]
+    return dependencies
 
 # ADAPTED FROM WRASPA IN RASPA GITUB REPO
 
@@ -243,13 +675,7 @@ def run_script(input_script, structure=None, stream=True):
     will output files and folders. Otherwise, this function will return the
     output of RASPA, as a string.
     """
-    # This supports `pybel.Molecule` objects with charge data by converting
-    # them into RASPA-formatted cif strings
-    if PYBEL_LOADED and isinstance(structure, pybel.Molecule):
-        structure = pybel_to_raspa_cif(structure)
-    # This supports python objects grabbed from json files or databases
-    elif isinstance(structure, dict):
-        structure = pybel_to_raspa_cif(json_to_pybel(structure))
+    structure = _to_raspa_structure(structure)
     # RASPA leaks a lot of memory, which is an issue in high-throughput
     # screening. Calling each simulation in a subprocess adds complexity and
     # time, but allows still reachable memory to be garbage collected by the
@@ -283,6 +709,167 @@ def _script_subprocess(input_script, structure, raspa_dir, stream, conn):
         conn.send(cast(ptr, c_char_p).value[:].decode("utf-8"))
     conn.close()
 
+def _to_raspa_structure(structure):
+    """Converts a structure to a string that can be streamed to RASPA."""
+    # This supports `pybel.Molecule` objects with charge data by converting
+    # them into RASPA-formatted cif strings
+    if PYBEL_LOADED and isinstance(structure, pybel.Molecule):
+        structure = pybel_to_raspa_cif(structure)
+    # This supports python objects grabbed from json files or databases
+    elif isinstance(structure, dict):
+        structure = pybel_to_raspa_cif(structure)
+    return structure
+
+class RaspaPool:
+    """A pool of long-lived processes running streamed RASPA simulations.
+
+    `run_script` starts a new process and loads libraspa for every simulation.
+    Here, each worker process loads libraspa once and runs many simulations
+    (stream mode: nothing is written on disk), which makes high-throughput
+    short runs (Widom insertions, helium void fractions, short GCMC) much
+    cheaper. As RASPA leaks memory, a worker is replaced by a fresh one after
+    `max_tasks_per_worker` simulations or when its resident memory exceeds
+    `max_rss_mb`. A worker which crashes (e.g. segfault) is replaced as well,
+    and the result of the simulation it was running is None.
+
+    Usage:
+    ```
+    with RaspaPool(n_workers=8) as pool:
+        results = pool.map(scripts, structures)
+    ```
+    where `scripts` are RASPA input scripts with `FrameworkName streamed`,
+    e.g. from `create_script("streamed", molecule_name="CO2", cycles=500)`.
+    """
+
+    def __init__(self, n_workers=None, max_tasks_per_worker=100, max_rss_mb=2000,
+                 parse_output=True):
+        """
+        Args:
+            n_workers: (Optional) Number of worker processes. Defaults to the
+                number of usable cores.
+            max_tasks_per_worker: (Optional) Number of simulations run by a
+                worker before it is replaced.
+            max_rss_mb: (Optional) Resident memory (in MB) above which a worker
+                is replaced after its current simulation.
+            parse_output: (Optional) If True, results are parsed with
+                `output_parser.parse`, otherwise the raw RASPA output is returned.
+        """
+        self.n_workers = n_workers or get_usable_cores()
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self.max_rss_mb = max_rss_mb
+        self.parse_output = parse_output
+        self.workers = [self._start_worker() for _ in range(self.n_workers)]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _start_worker(self):
+        parent_conn, child_conn = Pipe()
+        process = Process(target=_pool_worker, args=(child_conn, raspa_dir,
+                                                      self.max_tasks_per_worker,
+                                                      self.max_rss_mb), daemon=True)
+        process.start()
+        child_conn.close()
+        return {"process": process, "conn": parent_conn, "task": None}
+
+    def _replace_worker(self, worker):
+        worker["conn"].close()
+        worker["process"].join()
+        self.workers[self.workers.index(worker)] = self._start_worker()
+
+    def map(self, scripts, structures=None):
+        """Runs RASPA scripts on the pool and returns their results in order.
+
+        Args:
+            scripts: A list of RASPA simulation scripts, as loaded strings.
+            structures: (Optional) A list of structures, one per script (CIF
+                strings, `pybel.Molecule` objects or python objects, see
+                `run_script`). Defaults to no streamed structure.
+        Returns:
+            A list of results (parsed outputs, raw outputs or None for crashed
+            simulations).
+        """
+        if structures is None:
+            structures = [""] * len(scripts)
+        pending = list(range(len(scripts)))[::-1]
+        results = [None] * len(scripts)
+        while pending or any(w["task"] is not None for w in self.workers):
+            for worker in self.workers:
+                if worker["task"] is None and pending:
+                    worker["task"] = pending.pop()
+                    worker["conn"].send((scripts[worker["task"]],
+                                         _to_raspa_structure(structures[worker["task"]]) or ""))
+            busy = [w for w in self.workers if w["task"] is not None]
+            wait([w["conn"] for w in busy] + [w["process"].sentinel for w in busy])
+            for worker in busy:
+                if not worker["conn"].poll() and worker["process"].is_alive():
+                    continue
+                try:
+                    output, recycle = worker["conn"].recv()
+                except (EOFError, OSError):
+                    print(f"RASPA worker crashed on task {worker['task']}, restarting it.")
+                    worker["task"] = None
+                    self._replace_worker(worker)
+                    continue
+                results[worker["task"]] = parse(output) if self.parse_output else output
+                worker["task"] = None
+                if recycle:
+                    self._replace_worker(worker)
+        return results
+
+    def close(self):
+        """Stops all worker processes."""
+        for worker in self.workers:
+            try:
+                worker["conn"].send(None)
+            except (BrokenPipeError, OSError):
+                pass
+            worker["conn"].close()
+            worker["process"].join()
+        self.workers = []
+
+def _pool_worker(conn, raspa_dir, max_tasks, max_rss_mb):
+    """Loads libraspa2 once and runs streamed simulations received from `conn`.
+
+    Called through multiprocessing.Process by `RaspaPool`. Returns after
+    `max_tasks` simulations, when the resident memory exceeds `max_rss_mb`, or
+    when it receives None.
+    """
+    libraspa = cdll.LoadLibrary(os.path.join(libraspa_dir, libraspa_file))
+    libraspa.run.argtypes = (c_char_p, c_char_p, c_char_p, c_bool)
+    libraspa.run.restype = c_void_p
+    n_tasks = 0
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+        input_script, structure = task
+        ptr = libraspa.run(input_script.encode("ascii"),
+                           structure.encode("ascii"),
+                           raspa_dir.encode("ascii"), True)
+        output = cast(ptr, c_char_p).value[:].decode("utf-8")
+        n_tasks += 1
+        recycle = n_tasks >= max_tasks or _get_rss_mb() > max_rss_mb
+        conn.send((output, recycle))
+        if recycle:
+            break
+    conn.close()
+
+def _get_rss_mb():
+    """Returns the resident memory of the current process, in MB."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024**2
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
 def create_script(structure,molecule_name="N2", temperature=273.15, pressure=101325,
                   helium_void_fraction=1.0, unit_cells=(1, 1, 1),
                   simulation_type="MonteCarlo", cycles=2000,
@@ -290,7 +877,7 @@ def create_script(structure,molecule_name="N2", temperature=273.15, pressure=101
                   charge_method=None,input_file_type="cif",
                   save=False,filename="simulation.input",
                   grid_use="no",grid_spacing=0.1,grid_n_atoms=2,grid_atoms="C_co2 O_co2",
-                  binary_use="yes",binary_every=1000,
+                  binary_use="yes",binary_every=1000,restart_file="no",ewald_use="yes",
                   **kwargs):
     """Creates a RASPA simulation input file from parameters.
 
@@ -313,6 +900,10 @@ def create_script(structure,molecule_name="N2", temperature=273.15, pressure=101
         input_file_type: (Optional) The type of input structure. Assumes cif.
         charged: (Optional) A boolean indicating whether or not to use Ewald
             charge parameters.
+        restart_file: (Optional) "yes" to start from the configuration found in
+            `RestartInitial/System_0`, defaults to "no".
+        ewald_use: (Optional) "no" to switch off the electrostatic interactions
+            (e.g. to skip the Coulomb grid of a MakeGrid job), defaults to "yes".
     Returns:
         A string representing the contents of a simulation input file.
 
@@ -323,6 +914,7 @@ def create_script(structure,molecule_name="N2", temperature=273.15, pressure=101
     passing it to `RASPA.run_script`.
     """
     charges_from_cif = "yes" if charge_method not in [None,"",""] else "no"
+    raspa_charge_method = "Ewald" if ewald_use == "yes" else "None"
     print_every = cycles // 10
     a, b, c = unit_cells
     if init_cycles == "auto":
@@ -333,13 +925,13 @@ def create_script(structure,molecule_name="N2", temperature=273.15, pressure=101
                   NumberOfCycles                {cycles}
                   NumberOfInitializationCycles  {init_cycles}
                   PrintEvery                    {print_every}
-                  RestartFile                   no
+                  RestartFile                   {restart_file}
                   ContinueAfterCrash            {binary_use}
                   WriteBinaryRestartFileEvery   {binary_every}
 
                   Forcefield                    {forcefield}
                   CutOff                        12
-                  ChargeMethod                  Ewald
+                  ChargeMethod                  {raspa_charge_method}
                   EwaldPrecision                1e-6
                   UseChargesFromCIFFile         {charges_from_cif}
 
@@ -716,13 +1308,43 @@ def json_to_pybel(data):
     return mol
 
 def pybel_to_raspa_cif(structure):
-    """Converts instances of `pybel.Molecule` to a RASPA charged cif format."""
+    """Converts instances of `pybel.Molecule` to a RASPA charged cif format.
+
+    The python data structure of `json_to_pybel` is also accepted; when its atoms have
+    charges, it is converted directly, without building an Open Babel molecule.
+    The fractional coordinates of all the atoms are computed and wrapped at once with numpy.
+    """
+    if isinstance(structure, dict):
+        if "building_blocks" in structure:
+            atoms = [a for bb in structure["building_blocks"] for a in bb["atoms"]]
+        else:
+            atoms = structure.get("atoms", [])
+        if len(atoms) > 0 and "charge" in atoms[0]:
+            return _arrays_to_raspa_cif(np.array(structure["unitcell"], dtype=float),
+                                        [str(atom["element"]) for atom in atoms],
+                                        np.array([atom["location"] for atom in atoms], dtype=float),
+                                        np.array([atom["charge"] for atom in atoms], dtype=float))
+        # Charges are perceived by Open Babel
+        structure = json_to_pybel(structure)
+
     if not PYBEL_LOADED:
         raise ImportError("Open Babel not installed.")
 
     uc = structure.unitcell
-    a, b, c = uc.GetA(), uc.GetB(), uc.GetC()
-    alpha, beta, gamma = uc.GetAlpha(), uc.GetBeta(), uc.GetGamma()
+    vectors = np.array([[v.GetX(), v.GetY(), v.GetZ()] for v in uc.GetCellVectors()])
+    atoms = list(structure)
+    return _arrays_to_raspa_cif(vectors,
+                                [GetSymbol(atom.atomicnum) for atom in atoms],
+                                np.array([atom.coords for atom in atoms], dtype=float),
+                                np.array([atom.partialcharge for atom in atoms], dtype=float))
+
+def _arrays_to_raspa_cif(vectors, elements, locations, charges):
+    """Writes a RASPA charged cif from the cell vectors (rows), the elements,
+    the cartesian coordinates and the partial charges of the atoms."""
+    a, b, c = np.linalg.norm(vectors, axis=1)
+    alpha, beta, gamma = [np.degrees(np.arccos(np.dot(vectors[i], vectors[j]) /
+                                               (np.linalg.norm(vectors[i])*np.linalg.norm(vectors[j]))))
+                          for i, j in [(1, 2), (0, 2), (0, 1)]]
 
     cif = dedent("""
                  data_I
@@ -747,26 +1369,38 @@ def pybel_to_raspa_cif(structure):
                      _atom_site_charge
                  """.format(**locals())).strip()
 
-    for atom in structure:
-        element = GetSymbol(atom.atomicnum)
-        label = "Mof_" + element
-        charge = atom.partialcharge
-        c = uc.WrapFractionalCoordinate(uc.CartesianToFractional(atom.vector))
-        x, y, z = c.GetX(), c.GetY(), c.GetZ()
+    # Fractional coordinates wrapped into [0, 1)
+    fractional = np.linalg.solve(vectors.T, np.reshape(locations, (-1, 3)).T).T
+    fractional -= np.floor(fractional)
+    fractional[fractional > 1 - 1e-10] = 0.0
 
-        cif += ("\n    {label:<7s} {element:<4s} {x:.5f} {y:9.5f} {z:9.5f} "
-                "{charge:7.3f}").format(**locals())
-    cif += "\n_end\n"
+    lines = ["    {:<7s} {:<4s} {:.5f} {:9.5f} {:9.5f} {:7.3f}".format("Mof_" + element, element, x, y, z, charge)
+             for element, (x, y, z), charge in zip(elements, fractional, charges)]
+    return cif + "".join("\n" + line for line in lines) + "\n_end\n"
 
-    return cif
-
-def create_run_script(path,save=True):
+def create_run_script(path,save=True,restart_from=None,restart_names=None,check_convergence=False):
     """
     Returns the run command in bash.
+
+    If `restart_from` is given, the script first copies the restart file of the
+    simulation directory `restart_from` into `RestartInitial/System_0/`, under each
+    of the `restart_names` RASPA may look for.
+
+    If `check_convergence` is True, the simulation is continued in chunks until the
+    target uncertainty of its `convergence.json` is reached (see `src/convergence.py`).
     """
     raspa_dir = os.environ.get("RASPA_DIR")
     dyld_dir = os.environ.get("DYLD_LIBRARY_PATH")
     ld_dir = os.environ.get("DYLD_LIBRARY_PATH")
+    restart_string = ""
+    if restart_from is not None:
+        # RestartInitial already exists when the simulation is continued (see check_convergence)
+        restart_string = "if [ ! -d RestartInitial/System_0 ]; then\n"
+        restart_string += "mkdir -p RestartInitial/System_0\n"
+        restart_string += f"restart=$(ls {restart_from}/Restart/System_0/restart_* | head -n 1)\n"
+        for restart_name in restart_names:
+            restart_string += f'cp "$restart" RestartInitial/System_0/{restart_name}\n'
+        restart_string += "fi\n"
     run_string = dedent("""
                 #!/bin/bash
 
@@ -774,8 +1408,14 @@ def create_run_script(path,save=True):
                 export DYLD_LIBRARY_PATH={dyld_dir}
                 export LD_LIBRARY_PATH={ld_dir}
 
-                $RASPA_DIR/bin/simulate 'simulation.input'
-                 """.format(**locals())).strip()
+                """.format(**locals())).lstrip()
+    run_string += restart_string + "$RASPA_DIR/bin/simulate 'simulation.input'"
+    if check_convergence:
+        package_dir = os.environ.get("PACKAGE_DIR")
+        run_string += " || exit $?\n"
+        run_string += f"while PYTHONPATH={package_dir} {sys.executable} -m src.convergence . ; do\n"
+        run_string += "    $RASPA_DIR/bin/simulate 'simulation.input' || exit $?\n"
+        run_string += "done"
     if save is True :
         file_path = f"{path}/run.sh"
         with open(file_path,'w') as f:
@@ -787,15 +1427,17 @@ def create_run_script(path,save=True):
 def create_job_script(path,sim_dir_names,type="gcmc"):
     """
     Returns the job script in bash.
+
+    The script runs at most $SAW_MAX_WORKERS jobs at once (default : number of cores).
     """
 
     sim_dir_names_string = f'./{type}/'+ f' ./{type}/'.join(sim_dir_names)
     job_string = dedent(f"""
                 #!/bin/bash
+                MAX_WORKERS=${{SAW_MAX_WORKERS:-$(nproc)}}
                 for dir in {sim_dir_names_string} ; do
-                cd $dir
-                ./run.sh &
-                cd ../..
+                while [ $(jobs -rp | wc -l) -ge $MAX_WORKERS ]; do wait -n; done
+                (cd $dir && ./run.sh) &
                 done
                 echo "Simulations {type} running ..."
                 wait  # Wait for all background jobs to finish
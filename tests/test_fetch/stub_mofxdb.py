@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the MOFXDB API, used by `saw.py run -t9`.
+
+Serves `GET /mofs.json?name=<name>&page=<page>` like MOFXDB, one entry per page, from the
+CIF files `<cif_dir>/<name>.cif`: each structure is returned twice, in the 'CoREMOF 2019'
+and 'hMOF' databases. To exercise retries, the first query of each structure fails with
+an HTTP 503 error, and the structure 'BROKEN' always fails with an HTTP 500 error.
+
+Usage:
+    python stub_mofxdb.py <cif_dir> [port]
+"""
+import os
+import sys
+import json
+import threading
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+DATABASES = ["CoREMOF 2019", "hMOF"]
+
+def serve(cif_dir, port=0):
+    """
+    Start the server in a background thread; returns the server (its URL is `http://127.0.0.1:<server.server_port>`).
+    """
+    queried = set()
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urllib.parse.urlparse(self.path)
+            query = urllib.parse.parse_qs(url.query)
+            name = query.get("name", [""])[0]
+            page = int(query.get("page", ["1"])[0])
+            with lock:
+                first_query = name not in queried
+                queried.add(name)
+            if url.path != "/mofs.json":
+                return self.send_error(404)
+            if name == "BROKEN":
+                return self.send_error(500)
+            if first_query:
+                return self.send_error(503)
+
+            cif_file = os.path.join(cif_dir, f"{name}.cif")
+            results, pages = [], 0
+            if os.path.isfile(cif_file):
+                with open(cif_file) as f:
+                    cif = f.read()
+                pages = len(DATABASES)
+                results = [{"name": name, "database": DATABASES[page - 1], "cif": cif,
+                            "mofdb_version": "stub", "isotherms": []}]
+            body = json.dumps({"results": results, "page": page, "pages": pages}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if __name__ == "__main__":
+    server = serve(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 0)
+    print(f"http://127.0.0.1:{server.server_port}", flush=True)
+    threading.Event().wait()
@@ -0,0 +1,12 @@
+"""
+Unit tests of the workflow functions, run with `python -m pytest tests/unit` from the root of the package.
+
+They do not need RASPA; the tests of the modules depending on the optional packages
+(ASE, Open Babel, ...) are skipped when these packages are not installed.
+"""
+import os
+import sys
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, PACKAGE_DIR)
+os.environ.setdefault("PACKAGE_DIR", PACKAGE_DIR)
@@ -0,0 +1,33 @@
+"""
+Tests of the adaptive placement of the pressure points of isotherms.
+"""
+import os
+import numpy as np
+import pytest
+
+if not os.environ.get("RASPA_DIR") or not os.environ.get("LD_LIBRARY_PATH"):
+    pytest.skip("RASPA environment not set (see set_environment)", allow_module_level=True)
+adaptive = pytest.importorskip("src.adaptive")
+
+PRESSURES = [1e2, 1e3, 1e4, 1e5, 1e6]
+
+def test_linear_in_log_pressure():
+    uptakes = np.log10(PRESSURES)
+    assert adaptive.get_refinement_pressures(PRESSURES, uptakes) == []
+
+def test_step_is_refined():
+    # Langmuir isotherm with a step around 1e4 Pa
+    uptakes = [10*p/(p + 1e4) for p in PRESSURES]
+    new_pressures = adaptive.get_refinement_pressures(PRESSURES, uptakes, tolerance=0.05)
+    assert new_pressures == sorted(new_pressures) and len(new_pressures) > 0
+    assert all(1e2 < p < 1e6 and p not in PRESSURES for p in new_pressures)
+    # The largest errors first
+    assert adaptive.get_refinement_pressures(PRESSURES, uptakes, max_new_points=1)[0] in new_pressures
+    assert len(adaptive.get_refinement_pressures(PRESSURES, uptakes, max_new_points=1)) == 1
+
+def test_two_points_and_unsorted_input():
+    assert adaptive.get_refinement_pressures([1e5, 1e3], [2.0, 1.0]) == [pytest.approx(1e4)]
+
+@pytest.mark.parametrize("pressures,uptakes", [([1e3], [1.0]), (PRESSURES, [0.0]*5)])
+def test_nothing_to_refine(pressures, uptakes):
+    assert adaptive.get_refinement_pressures(pressures, uptakes) == []
@@ -0,0 +1,117 @@
+"""
+Tests of the persistent caches : least recently used eviction, and restoration of the cached files.
+"""
+import os
+import json
+import time
+import pytest
+from src.cache import evict_lru,get_cache_dir,get_size,touch
+from src.grid_cache import get_raspa_grid_dir,restore_grids,store_grids,write_grid_keys
+from src.cif_cache import read_cached_cifs,write_cached_cifs
+from src.charge_cache import evict_charge_cache,get_charged_cifname,restore_charged_cif,store_charged_cif
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("SAW_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setenv("RASPA_DIR", str(tmp_path / "raspa"))
+    return tmp_path / "cache"
+
+def _age(path, seconds):
+    # Last use `seconds` ago
+    os.utime(path, (time.time() - seconds, time.time() - seconds))
+
+def test_evict_lru(tmp_path):
+    cache = get_cache_dir("test")
+    for i, age in enumerate([30, 10, 20]):
+        os.makedirs(f"{cache}/entry_{i}")
+        with open(f"{cache}/entry_{i}/data", "w") as f:
+            f.write("x"*1000)
+        _age(f"{cache}/entry_{i}", age)
+    assert evict_lru(cache, 3000/1e9) == []
+    # Entry 0 is the least recently used, then entry 2
+    assert evict_lru(cache, 2500/1e9) == [f"{cache}/entry_0"]
+    touch(f"{cache}/entry_2")
+    assert evict_lru(cache, 1000/1e9) == [f"{cache}/entry_1"]
+    assert os.listdir(cache) == ["entry_2"] and get_size(cache) <= 1000
+
+def test_evict_lru_skips_entries_being_written():
+    cache = get_cache_dir("test")
+    for name, age in [("entry_0.tmp123", 10), ("entry_1.tmp456", 2*3600), ("entry_2", 100)]:
+        os.makedirs(f"{cache}/{name}")
+        with open(f"{cache}/{name}/data", "w") as f:
+            f.write("x"*1000)
+        _age(f"{cache}/{name}", age)
+    # The abandoned temporary entry is the least recently used one
+    assert evict_lru(cache, 0) == [f"{cache}/entry_1.tmp456", f"{cache}/entry_2"]
+    assert os.listdir(cache) == ["entry_0.tmp123"]
+
+def _make_grid_job(tmp_path, cif, atom_types, content="grid"):
+    work_dir = tmp_path / f"grid_{'_'.join(atom_types)}"
+    work_dir.mkdir()
+    write_grid_keys(str(work_dir), str(cif), "MOF", "UFF", 0.15, atom_types)
+    grid_dir = get_raspa_grid_dir("UFF", "MOF", 0.15)
+    os.makedirs(grid_dir, exist_ok=True)
+    for atom_type in atom_types:
+        with open(f"{grid_dir}/MOF_{atom_type}_shifted.grid", "w") as f:
+            f.write(content*250)
+    return str(work_dir)
+
+def test_grid_cache(tmp_path, cache_dir):
+    cif = tmp_path / "MOF.cif"
+    cif.write_text("data_MOF\n")
+    grid_dir = get_raspa_grid_dir("UFF", "MOF", 0.15)
+    assert store_grids(_make_grid_job(tmp_path, cif, ["C_co2"], "c"), max_size_gb=1) == ["C_co2"]
+    for entry in os.listdir(cache_dir / "grids"):
+        _age(cache_dir / "grids" / entry, 100)
+    assert store_grids(_make_grid_job(tmp_path, cif, ["O_co2"], "o"), max_size_gb=1) == ["O_co2"]
+
+    # A hit restores the grid file at the path read by RASPA
+    os.remove(f"{grid_dir}/MOF_O_co2_shifted.grid")
+    assert restore_grids(str(cif), "MOF", "UFF", 0.15, ["O_co2", "N_n2"]) == ["N_n2"]
+    with open(f"{grid_dir}/MOF_O_co2_shifted.grid") as f:
+        assert f.read() == "o"*250
+
+    # The least recently used grid is evicted first, with room left for two entries
+    max_size = 2.5*get_size(str(cache_dir / "grids"))/2
+    assert store_grids(_make_grid_job(tmp_path, cif, ["N_n2"], "n"), max_size_gb=max_size/1e9) == ["N_n2"]
+    assert restore_grids(str(cif), "MOF", "UFF", 0.15, ["C_co2", "O_co2", "N_n2"]) == ["C_co2"]
+    assert get_size(str(cache_dir / "grids")) <= max_size
+
+def test_cif_cache(tmp_path):
+    cifs = {"MOF_coremof-2019.cif": "data_MOF", "MOF_coremof-2014.cif": "data_MOF_2014"}
+    write_cached_cifs("MOF", cifs, version="v1")
+    cif_dir = tmp_path / "cif"
+    cif_dir.mkdir()
+    assert read_cached_cifs("MOF", str(cif_dir), version="v1") == [f"{cif_dir}/MOF_coremof-2019.cif"]
+    assert (cif_dir / "MOF_coremof-2019.cif").read_text() == "data_MOF\n"
+    assert read_cached_cifs("OTHER", str(cif_dir), version="v1") is None
+
+def test_charge_cache(tmp_path, cache_dir):
+    cif_dir = tmp_path / "cif"
+    cif_dir.mkdir()
+    charged = {}
+    for i, name in enumerate(["MOF_A", "MOF_B"]):
+        cif = cif_dir / f"{name}.cif"
+        cif.write_text(f"data_{name}\n")
+        charged[name] = get_charged_cifname(str(cif_dir), str(cif), "EQeq")
+        with open(charged[name], "w") as f:
+            f.write("q"*1000)
+        assert store_charged_cif(str(cif), charged[name], "EQeq")
+    entries = sorted(os.listdir(cache_dir / "charges"))
+    assert len(entries) == 2
+
+    # A hit restores the charged file under its name in the CIF directory
+    os.remove(charged["MOF_A"])
+    assert restore_charged_cif(str(cif_dir / "MOF_A.cif"), charged["MOF_A"], "EQeq")
+    with open(charged["MOF_A"]) as f:
+        assert f.read() == "q"*1000
+    assert not restore_charged_cif(str(cif_dir / "MOF_A.cif"), charged["MOF_A"], "pacmof2")
+
+    # MOF_B was used before MOF_A : it is evicted first
+    for entry in os.listdir(cache_dir / "charges"):
+        with open(cache_dir / "charges" / entry / "meta.json") as f:
+            _age(cache_dir / "charges" / entry, 100 if json.load(f)["source"] == "MOF_B.cif" else 10)
+    removed = evict_charge_cache(max_size_gb=1500/1e9)
+    assert len(removed) == 1
+    assert not restore_charged_cif(str(cif_dir / "MOF_B.cif"), charged["MOF_B"], "EQeq")
+    assert restore_charged_cif(str(cif_dir / "MOF_A.cif"), charged["MOF_A"], "EQeq")
@@ -0,0 +1,59 @@
+"""
+Tests of the canonical P1 CIF files.
+"""
+from types import SimpleNamespace
+import numpy as np
+import pytest
+
+pytest.importorskip("ase")
+from src import canonical_cif
+
+def _structure(charges):
+    return SimpleNamespace(cellpar=np.array([10.0, 10.0, 10.0, 90.0, 90.0, 90.0]),
+                           frac=np.array([[0.0, 0.0, 0.0], [0.5, 0.5, 1.0]]),
+                           numbers=np.array([6, 8]), charges=np.array(charges, dtype=float))
+
+def test_write_with_and_without_charges(tmp_path):
+    canonical_cif.write_canonical_cif(_structure([0.5, -0.5]), tmp_path / "charged.cif")
+    content = (tmp_path / "charged.cif").read_text()
+    assert "_atom_site_charge" in content and "O1" in content and "-0.500000" in content
+    canonical_cif.write_canonical_cif(_structure([np.nan, np.nan]), tmp_path / "neutral.cif")
+    assert "_atom_site_charge" not in (tmp_path / "neutral.cif").read_text()
+
+def test_partial_charges_are_not_dropped(tmp_path):
+    with pytest.raises(ValueError):
+        canonical_cif.write_canonical_cif(_structure([0.5, np.nan]), tmp_path / "partial.cif")
+
+@pytest.mark.parametrize("charges,header", [([0.5, np.nan], ""), ([np.nan, np.nan], "_atom_site_charge\n")])
+def test_fallback_to_original_cif(tmp_path, monkeypatch, charges, header):
+    monkeypatch.setenv("SAW_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(canonical_cif, "load_structure", lambda path: _structure(charges))
+    cif = tmp_path / "cif" / "MOF.cif"
+    cif.parent.mkdir()
+    cif.write_text(f"data_MOF\nloop_\n{header}")
+    work_dir = tmp_path / "sim"
+    work_dir.mkdir()
+    assert canonical_cif.get_raspa_cif(str(cif), canonical=True) == str(cif)
+    canonical_cif.copy_framework_cif(str(cif), str(work_dir), canonical=True)
+    assert (work_dir / "MOF.cif").read_text() == cif.read_text()
+    assert list((tmp_path / "cache" / "canonical").iterdir()) == []
+
+def test_cache_unchanged_by_simulation_files(tmp_path, monkeypatch):
+    monkeypatch.setenv("SAW_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(canonical_cif, "load_structure", lambda path: _structure([np.nan, np.nan]))
+    cif = tmp_path / "cif" / "MOF.cif"
+    cif.parent.mkdir()
+    cif.write_text("data_MOF\n")
+    work_dir = tmp_path / "sim"
+    work_dir.mkdir()
+    canonical_cif.copy_framework_cif(str(cif), str(work_dir), canonical=True)
+    cached = canonical_cif.get_raspa_cif(str(cif), canonical=True)
+    with open(cached) as f:
+        content = f.read()
+    assert (work_dir / "MOF.cif").read_text() == content
+    # Written over by a user, or by a resumed run without canonical CIF files
+    (work_dir / "MOF.cif").write_text("edited\n")
+    canonical_cif.copy_framework_cif(str(cif), str(work_dir), canonical=False)
+    assert (work_dir / "MOF.cif").read_text() == cif.read_text()
+    with open(cached) as f:
+        assert f.read() == content
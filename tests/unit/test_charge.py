@@ -0,0 +1,34 @@
+"""
+Tests of the batches of the PACMOF2 charge calculations.
+"""
+import pytest
+
+pytest.importorskip("openbabel")
+pytest.importorskip("pyeqeq")
+pytest.importorskip("pacmof2")
+from src import charge
+
+class Pacmof2:
+    """PACMOF2 without the option `multiple_cifs`, recording its calls."""
+    def __init__(self):
+        self.calls = []
+
+    def get_charges(self, path, output_dir, identifier="_pacmof2"):
+        self.calls.append(path)
+
+def test_batch_without_multiple_cifs(tmp_path, monkeypatch):
+    batch_dir = tmp_path / "batch_0"
+    batch_dir.mkdir()
+    for name in ["B", "A"]:
+        (batch_dir / f"{name}.cif").write_text(f"data_{name}\n")
+    pacmof2 = Pacmof2()
+    monkeypatch.setattr(charge, "pacmof2", pacmof2)
+    charge._run_pacmof_on_batch(str(batch_dir), str(tmp_path))
+    assert pacmof2.calls == [f"{batch_dir}/A.cif", f"{batch_dir}/B.cif"]
+
+def test_batch_error_not_hidden(tmp_path, monkeypatch):
+    def get_charges(path, output_dir, identifier="_pacmof2", multiple_cifs=False):
+        raise TypeError("unsupported CIF file")
+    monkeypatch.setattr(charge.pacmof2, "get_charges", get_charges)
+    with pytest.raises(TypeError, match="unsupported CIF file"):
+        charge._run_pacmof_on_batch(str(tmp_path), str(tmp_path))
@@ -0,0 +1,93 @@
+"""
+Tests of the convergence control of GCMC simulations, on a canned RASPA output.
+"""
+import os
+import json
+import math
+import pytest
+from src.output_parser import parse
+from src.convergence import (combine_chunks, get_loading, get_relative_standard_error,
+                             prepare_continuation, write_convergence_settings)
+
+DATA_FILE = os.path.join(os.path.dirname(__file__), "data", "output_N2.data")
+LOADING_LINE = "Average loading absolute [cm^3 (STP)/cm^3 framework]      12.0000000000 +/-       0.2400000000 [-]"
+
+def _output(loading="12.0000000000", error="0.2400000000"):
+    with open(DATA_FILE) as f:
+        content = f.read()
+    return content.replace(LOADING_LINE, LOADING_LINE.replace("12.0000000000", loading).replace("0.2400000000", error))
+
+@pytest.mark.parametrize("loading,error,expected", [("12.0000000000", "0.2400000000", 0.02),
+                                                    ("0.0000000000", "0.0000000000", 0.0),
+                                                    ("0.0000000000", "0.1000000000", math.inf)])
+def test_relative_standard_error(loading, error, expected):
+    mean, rse = get_relative_standard_error(parse(_output(loading, error)), "N2")
+    assert mean == float(loading)
+    assert rse == pytest.approx(expected)
+
+@pytest.mark.parametrize("error", ["-nan", "-nan(ind)"])
+def test_relative_standard_error_unknown(error):
+    mean, rse = get_relative_standard_error(parse(_output(error=error)), "N2")
+    assert mean == 12.0 and math.isnan(rse)
+
+def test_combine_chunks():
+    chunks = [{"cycles": 1000, "loading": 12.0, "error": 0.24}, {"cycles": 3000, "loading": 14.0, "error": 0.08}]
+    loading, rse = combine_chunks(chunks)
+    assert loading == pytest.approx(13.5)
+    assert rse == pytest.approx(math.sqrt(240**2 + 240**2)/4000/13.5)
+    assert math.isnan(combine_chunks(chunks + [{"cycles": 1000, "loading": 1.0, "error": math.nan}])[1])
+
+@pytest.fixture
+def work_dir(tmp_path):
+    with open(tmp_path / "simulation.input", "w") as f:
+        f.write("SimulationType                MonteCarlo\n"
+                "NumberOfCycles                1000\n"
+                "NumberOfInitializationCycles  500\n"
+                "PrintEvery                    100\n"
+                "RestartFile                   no\n")
+    write_convergence_settings(str(tmp_path), "N2", 0.01, max_cycles=10000, cycles=1000)
+    os.makedirs(tmp_path / "Restart" / "System_0")
+    (tmp_path / "Restart" / "System_0" / "restart_MOF_1.1.1_298.150000_1e+06").write_text("restart\n")
+    return tmp_path
+
+def _run_chunk(work_dir, output):
+    os.makedirs(work_dir / "Output" / "System_0", exist_ok=True)
+    (work_dir / "Output" / "System_0" / "output.data").write_text(output)
+    return prepare_continuation(str(work_dir))
+
+def _settings(work_dir):
+    with open(work_dir / "convergence.json") as f:
+        return json.load(f)
+
+def test_prepare_continuation(work_dir):
+    # Relative uncertainty 0.02 : about 4 times more cycles are needed in total
+    assert _run_chunk(work_dir, _output())
+    script = (work_dir / "simulation.input").read_text()
+    assert "NumberOfCycles                3400" in script and "RestartFile                   yes" in script
+    assert os.path.isfile(work_dir / "Chunks" / "chunk_1.data")
+    assert os.listdir(work_dir / "RestartInitial" / "System_0") == ["restart_MOF_1.1.1_298.150000_1e+06"]
+    assert _settings(work_dir)["status"] == "running"
+
+    # The second chunk alone is not converged (0.011), the combination of both chunks is
+    assert not _run_chunk(work_dir, _output("14.0000000000", "0.1540000000"))
+    settings = _settings(work_dir)
+    assert settings["status"] == "converged"
+    assert [chunk["cycles"] for chunk in settings["chunks"]] == [1000, 3400]
+    assert settings["loading"] == pytest.approx((1000*12 + 3400*14)/4400)
+    assert settings["relative_uncertainty"] == pytest.approx(math.hypot(1000*0.24, 3400*0.154)/4400/settings["loading"])
+    assert get_loading(str(work_dir), parse(_output("14.0000000000", "0.1540000000")), "N2") == settings["loading"]
+
+def test_prepare_continuation_zero_loading(work_dir):
+    assert not _run_chunk(work_dir, _output("0.0000000000", "0.0000000000"))
+    settings = _settings(work_dir)
+    assert settings["status"] == "converged" and settings["loading"] == 0.0
+
+@pytest.mark.parametrize("error", ["-nan", "-nan(ind)"])
+def test_prepare_continuation_unknown_uncertainty(work_dir, error):
+    assert not _run_chunk(work_dir, _output(error=error))
+    settings = _settings(work_dir)
+    assert settings["status"] == "not converged" and math.isnan(settings["relative_uncertainty"])
+    assert not os.path.isdir(work_dir / "Chunks")
+
+def test_get_loading_without_convergence_control(tmp_path):
+    assert get_loading(str(tmp_path), parse(_output()), "N2") == 12.0
@@ -0,0 +1,31 @@
+"""
+Tests of the dependencies between the grid calculations and the GCMC simulations.
+"""
+import os
+import pytest
+
+if not os.environ.get("RASPA_DIR") or not os.environ.get("LD_LIBRARY_PATH"):
+    pytest.skip("RASPA environment not set (see set_environment)", allow_module_level=True)
+wraspa2 = pytest.importorskip("src.wraspa2")
+
+def _make_job(tmp_path, name, framework):
+    job_dir = tmp_path / name
+    job_dir.mkdir()
+    (job_dir / "simulation.input").write_text(f"SimulationType  MonteCarlo\nFrameworkName   {framework}\n")
+    return str(job_dir)
+
+def test_grid_dependencies(tmp_path):
+    grids_a = [_make_job(tmp_path, f"MOF_A_{atom}", "MOF_A") for atom in ["C_co2", "O_co2"]]
+    grid_b = _make_job(tmp_path, "MOF_B_N_n2", "MOF_B")
+    sim_a = _make_job(tmp_path, "sim_a", "MOF_A")
+    sim_b = _make_job(tmp_path, "sim_b", "MOF_B")
+    sim_c = _make_job(tmp_path, "sim_c", "MOF_C")
+    dependencies = wraspa2._get_grid_dependencies([sim_a, sim_b, sim_c], grids_a + [grid_b])
+    assert dependencies == {sim_a: grids_a, sim_b: [grid_b]}
+
+def test_split_grid_jobs():
+    electrostatics = wraspa2.ELECTROSTATICS
+    assert wraspa2._split_grid_jobs(["C_co2", "O_co2", electrostatics], ["C_co2", "O_co2"]) == [["C_co2", electrostatics], ["O_co2"]]
+    # Only the Coulomb grid is missing : it is computed with the first atom grid, never alone
+    assert wraspa2._split_grid_jobs([electrostatics], ["C_co2", "O_co2"]) == [["C_co2", electrostatics]]
+    assert wraspa2._split_grid_jobs([electrostatics], []) == []
@@ -0,0 +1,26 @@
+"""
+Tests of the conversion of python structures to RASPA CIF files.
+"""
+import os
+import pytest
+
+if not os.environ.get("RASPA_DIR") or not os.environ.get("LD_LIBRARY_PATH"):
+    pytest.skip("RASPA environment not set (see set_environment)", allow_module_level=True)
+wraspa2 = pytest.importorskip("src.wraspa2")
+
+UNITCELL = [[10.0, 0.0, 0.0], [0.0, 10.0, 0.0], [0.0, 0.0, 10.0]]
+ATOMS = [{"location": [0.0, 0.0, 0.0], "element": "Zn", "charge": 1.0},
+         {"location": [5.0, 5.0, 12.5], "element": "O", "charge": -1.0}]
+
+def _atom_lines(cif):
+    return [line.split() for line in cif.splitlines() if line.split()[1:2] in (["Zn"], ["O"])]
+
+def test_atoms():
+    lines = _atom_lines(wraspa2.pybel_to_raspa_cif({"atoms": ATOMS, "unitcell": UNITCELL}))
+    assert [line[1] for line in lines] == ["Zn", "O"]
+    assert [float(x) for x in lines[1][2:5]] == [0.5, 0.5, 0.25]
+
+def test_building_blocks_only():
+    structure = {"building_blocks": [{"atoms": ATOMS[:1]}, {"atoms": ATOMS[1:]}], "unitcell": UNITCELL}
+    assert _atom_lines(wraspa2.pybel_to_raspa_cif(structure)) == \
+        _atom_lines(wraspa2.pybel_to_raspa_cif({"atoms": ATOMS, "unitcell": UNITCELL}))
@@ -0,0 +1,48 @@
+"""
+Tests of the persistent pool of RASPA workers, with a fake libraspa.
+"""
+import os
+import ctypes
+import pytest
+
+if not os.environ.get("RASPA_DIR") or not os.environ.get("LD_LIBRARY_PATH"):
+    pytest.skip("RASPA environment not set (see set_environment)", allow_module_level=True)
+wraspa2 = pytest.importorskip("src.wraspa2")
+
+class FakeLibraspa:
+    """Streamed RASPA returning '<pid>:<script>', and crashing on the script 'crash'."""
+    def __init__(self):
+        buffers = []
+        def run(input_script, structure, raspa_dir, stream):
+            if input_script == b"crash":
+                os._exit(1)
+            buffers.append(ctypes.create_string_buffer(f"{os.getpid()}:{input_script.decode()}".encode()))
+            return ctypes.addressof(buffers[-1])
+        self.run = run
+
+@pytest.fixture(autouse=True)
+def fake_libraspa(monkeypatch):
+    # The workers are forked : they load the fake library
+    monkeypatch.setattr(wraspa2.cdll, "LoadLibrary", lambda path: FakeLibraspa())
+
+def _run(scripts, **kwargs):
+    with wraspa2.RaspaPool(n_workers=1, parse_output=False, **kwargs) as pool:
+        results = pool.map(scripts)
+    return [result.split(":") if result is not None else None for result in results]
+
+def test_recycle_after_max_tasks():
+    results = _run(["a", "b", "c", "d", "e"], max_tasks_per_worker=2)
+    assert [script for _, script in results] == ["a", "b", "c", "d", "e"]
+    pids = [pid for pid, _ in results]
+    assert pids[0] == pids[1] != pids[2] == pids[3] != pids[4]
+
+def test_recycle_above_max_rss():
+    pids = [pid for pid, _ in _run(["a", "b", "c"], max_rss_mb=0)]
+    assert len(set(pids)) == 3
+
+def test_worker_crash():
+    results = _run(["a", "crash", "b"])
+    assert results[1] is None
+    assert results[0][1] == "a" and results[2][1] == "b"
+    # The crashed worker is replaced
+    assert results[0][0] != results[2][0]
@@ -0,0 +1,105 @@
+"""
+Tests of the resume mode of `prepare_input_files` and `run_simulations`.
+"""
+import os
+import json
+from argparse import Namespace
+import pytest
+
+if not os.environ.get("RASPA_DIR") or not os.environ.get("LD_LIBRARY_PATH"):
+    pytest.skip("RASPA environment not set (see set_environment)", allow_module_level=True)
+wraspa2 = pytest.importorskip("src.wraspa2")
+
+def _make_job(job_dir, finished):
+    os.makedirs(f"{job_dir}/Output/System_0")
+    with open(f"{job_dir}/Output/System_0/output.data", "w") as f:
+        f.write("Simulation finished\n" if finished else "Cycle: 100\n")
+
+@pytest.mark.parametrize("backend", ["local", "slurm"])
+def test_resume_all_finished(tmp_path, monkeypatch, backend):
+    for name in ["sim_0", "sim_1"]:
+        _make_job(f"{tmp_path}/gcmc/{name}", finished=True)
+    _make_job(f"{tmp_path}/grids/grid_0", finished=True)
+    calls = []
+    monkeypatch.setattr(wraspa2, "_run_simulations", lambda *args, **kwargs: calls.append((args, kwargs)))
+    monkeypatch.setattr(wraspa2, "store_grids", lambda grid_dir: None)
+    args = Namespace(output_dir=str(tmp_path), resume=True, backend=backend)
+    wraspa2.run_simulations(args, ["sim_0", "sim_1"], grid_dir_names=["grid_0"])
+    assert calls == []
+
+def test_resume_runs_unfinished_only(tmp_path, monkeypatch):
+    _make_job(f"{tmp_path}/gcmc/sim_0", finished=True)
+    _make_job(f"{tmp_path}/gcmc/sim_1", finished=False)
+    calls = []
+    monkeypatch.setattr(wraspa2, "_run_simulations", lambda args, names, **kwargs: calls.append(names))
+    args = Namespace(output_dir=str(tmp_path), resume=True, backend="local")
+    wraspa2.run_simulations(args, ["sim_0", "sim_1"])
+    assert calls == [["sim_1"]]
+
+def test_stale_grids_not_run(tmp_path, monkeypatch):
+    # Grids of a previous run, served by the cache in this run
+    _make_job(f"{tmp_path}/grids/grid_0", finished=False)
+    _make_job(f"{tmp_path}/gcmc/sim_0", finished=False)
+    calls = []
+    monkeypatch.setattr(wraspa2, "_run_simulations", lambda args, names, **kwargs: calls.append((names, kwargs["grid_dir_names"])))
+    args = Namespace(output_dir=str(tmp_path), resume=True, backend="local")
+    wraspa2.run_simulations(args, ["sim_0"], grid_dir_names=[])
+    assert calls == [(["sim_0"], [])]
+
+def _prepare(tmp_path, monkeypatch, resume):
+    raspa_dir = tmp_path / "raspa"
+    os.makedirs(raspa_dir / "share/raspa/molecules/ExampleDefinitions", exist_ok=True)
+    (raspa_dir / "share/raspa/molecules/ExampleDefinitions/N2.def").write_text("")
+    monkeypatch.setenv("RASPA_DIR", str(raspa_dir))
+    os.makedirs(tmp_path / "data/cif", exist_ok=True)
+    (tmp_path / "data/cif/MOF.cif").write_text("data_MOF\n")
+    input_file = tmp_path / "input.json"
+    input_file.write_text(json.dumps({"parameters": {"structure": ["MOF"], "molecule_name": ["N2"], "pressure": [1e4, 1e5],
+                                                     "npoints": 2, "temperature": [298.15]},
+                                      "defaults": {"cycles": 100, "warm_start": "yes", "target_uncertainty": 0.05}}))
+    monkeypatch.setattr(wraspa2, "get_cifs", lambda l_params, output_dir, **kwargs: (["MOF"], l_params))
+    monkeypatch.setattr(wraspa2, "compute_minimal_unit_cells", lambda cif_path_filenames: None)
+    monkeypatch.setattr(wraspa2, "get_minimal_unit_cells", lambda cif_path_filename: (1, 1, 1))
+    args = Namespace(input_file=str(input_file), output_dir=str(tmp_path / "data"), resume=resume, skip_validation=True)
+    return wraspa2.prepare_input_files(args)[1]
+
+def _read_dir(work_dir):
+    contents = {}
+    for root, _, files in os.walk(work_dir):
+        for filename in files:
+            with open(f"{root}/{filename}", "rb") as f:
+                contents[os.path.relpath(f"{root}/{filename}", work_dir)] = f.read()
+    return contents
+
+def test_resume_keeps_previous_dirs(tmp_path, monkeypatch):
+    sim_dir_names = _prepare(tmp_path, monkeypatch, resume=False)
+    finished, unfinished = [f"{tmp_path}/data/gcmc/{name}" for name in sim_dir_names]
+    _make_job(finished, finished=True)
+    _make_job(unfinished, finished=False)
+    # State of a simulation continued in chunks, and of a warm-started point
+    os.makedirs(f"{unfinished}/RestartInitial/System_0")
+    with open(f"{unfinished}/simulation.input", "a") as f:
+        f.write("# continued\n")
+    before = {work_dir: _read_dir(work_dir) for work_dir in [finished, unfinished]}
+
+    assert _prepare(tmp_path, monkeypatch, resume=True) == sim_dir_names
+    for work_dir in [finished, unfinished]:
+        assert _read_dir(work_dir) == before[work_dir]
+
+def test_resume_keeps_chunks(tmp_path, monkeypatch):
+    sim_dir_names = _prepare(tmp_path, monkeypatch, resume=False)
+    work_dir = f"{tmp_path}/data/gcmc/{sim_dir_names[0]}"
+    _make_job(work_dir, finished=False)
+    with open(f"{work_dir}/convergence.json") as f:
+        settings = json.load(f)
+    settings.update({"chunks": [{"cycles": 100, "loading": 2.0, "error": 0.2, "relative_uncertainty": 0.1}], "loading": 2.0})
+    with open(f"{work_dir}/convergence.json", "w") as f:
+        json.dump(settings, f)
+    # Interrupted while its inputs were written : they are written again
+    os.remove(f"{work_dir}/run.sh")
+
+    _prepare(tmp_path, monkeypatch, resume=True)
+    with open(f"{work_dir}/convergence.json") as f:
+        assert json.load(f)["chunks"] == settings["chunks"]
+    info = {"Number of molecules": {"N2": {"Average loading absolute [cm^3 (STP)/cm^3 framework]": [3.0]}}}
+    assert wraspa2.get_loading(work_dir, info, "N2") == 2.0
@@ -0,0 +1,85 @@
+"""
+Tests of the local job scheduler.
+"""
+import os
+import stat
+from src.scheduler import get_critical_path_costs,run_jobs,sort_by_cost,write_exit_codes
+
+def _make_job(tmp_path, name, duration=0.3, exit_code=0):
+    job_dir = tmp_path / name
+    job_dir.mkdir()
+    run_script = job_dir / "run.sh"
+    run_script.write_text("#!/bin/bash\n"
+                          "python3 -c 'import time; print(time.time())' > start\n"
+                          f"sleep {duration}\n"
+                          "python3 -c 'import time; print(time.time())' > end\n"
+                          f"exit {exit_code}\n")
+    run_script.chmod(run_script.stat().st_mode | stat.S_IEXEC)
+    return str(job_dir)
+
+def _interval(job_dir):
+    with open(f"{job_dir}/start") as f, open(f"{job_dir}/end") as g:
+        return float(f.read()), float(g.read())
+
+def _max_overlap(job_dirs):
+    events = sorted([(t, 1) for job_dir in job_dirs for t in _interval(job_dir)[:1]] +
+                    [(t, -1) for job_dir in job_dirs for t in _interval(job_dir)[1:]])
+    running = peak = 0
+    for _, change in events:
+        running += change
+        peak = max(peak, running)
+    return peak
+
+def test_concurrency_bound(tmp_path):
+    job_dirs = [_make_job(tmp_path, f"job_{i}") for i in range(6)]
+    exit_codes = run_jobs(job_dirs, max_workers=2, poll_interval=0.02)
+    assert exit_codes == {job_dir: 0 for job_dir in job_dirs}
+    assert _max_overlap(job_dirs) == 2
+    assert all(os.path.isfile(f"{job_dir}/run.log") for job_dir in job_dirs)
+
+def test_dependencies(tmp_path):
+    first = _make_job(tmp_path, "first")
+    second = _make_job(tmp_path, "second")
+    failed = _make_job(tmp_path, "failed", duration=0, exit_code=3)
+    skipped = _make_job(tmp_path, "skipped")
+    dependencies = {second: [first], skipped: [failed], first: [str(tmp_path / "not_a_job")]}
+    exit_codes = run_jobs([second, skipped, first, failed], max_workers=4, dependencies=dependencies,
+                          poll_interval=0.02)
+    assert exit_codes == {first: 0, second: 0, failed: 3, skipped: None}
+    assert _interval(second)[0] >= _interval(first)[1]
+    assert not os.path.exists(f"{skipped}/start")
+
+def test_memory_admission(tmp_path):
+    large = [_make_job(tmp_path, f"large_{i}") for i in range(2)]
+    small = _make_job(tmp_path, "small")
+    huge = _make_job(tmp_path, "huge")
+    memory = {large[0]: 6, large[1]: 6, small: 3, huge: 20}
+    exit_codes = run_jobs(large + [small, huge], max_workers=3, priorities={huge: 10},
+                          memory=memory, max_memory=10, poll_interval=0.02)
+    assert set(exit_codes.values()) == {0}
+    # The two large jobs never run together, the small one is backfilled next to a large one
+    assert _max_overlap(large) == 1
+    assert _max_overlap([large[0], small]) == 2
+    # A job larger than the memory budget runs alone
+    assert all(_max_overlap([huge, job_dir]) == 1 for job_dir in large + [small])
+
+def test_critical_path_costs():
+    costs = {"grid": 1, "sim_1": 5, "sim_2": 3, "single": 4}
+    dependencies = {"sim_1": ["grid"], "sim_2": ["sim_1"], "single": ["not_a_job"]}
+    path_costs = get_critical_path_costs(costs, dependencies)
+    assert path_costs == {"grid": 9, "sim_1": 8, "sim_2": 3, "single": 4}
+    assert get_critical_path_costs(costs) == costs
+
+def test_sort_by_cost():
+    job_dirs, costs = sort_by_cost(["a", "b", "c", "d"], {"a": 1, "b": 3, "c": 2, "d": 3})
+    assert job_dirs == ["b", "d", "c", "a"]
+    assert costs == {"a": 1, "b": 3, "c": 2, "d": 3}
+
+def test_write_exit_codes_append(tmp_path):
+    filename = tmp_path / "jobs_gcmc.csv"
+    write_exit_codes({"/out/gcmc/sim_0": 0}, filename)
+    # A refinement round of the adaptive isotherms
+    assert write_exit_codes({"/out/gcmc/sim_1": 1}, filename, append=True) == ["/out/gcmc/sim_1"]
+    assert filename.read_text() == "job,exit_code\nsim_0,0\nsim_1,1\n"
+    write_exit_codes({"/out/gcmc/sim_2": 0}, filename)
+    assert filename.read_text() == "job,exit_code\nsim_2,0\n"
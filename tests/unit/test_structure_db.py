@@ -0,0 +1,48 @@
+"""
+Tests of the local structure store (`saw.py db import`).
+"""
+import json
+import sqlite3
+import pytest
+from src.structure_db import get_db_dir,import_archive,lookup_structure,refcode_from_filename
+
+@pytest.fixture
+def archive(tmp_path, monkeypatch):
+    monkeypatch.setenv("SAW_CACHE_DIR", str(tmp_path / "cache"))
+    archive = tmp_path / "CoRE-MOF-2019"
+    archive.mkdir()
+    (archive / "MIBQAR_clean.cif").write_text("data_MIBQAR\n")
+    (archive / "VOGTIV_charged.cif").write_text("data_VOGTIV\n")
+    entries = [{"name": "ABAVIJ_clean", "database": "CoREMOF 2019", "cif": "data_ABAVIJ", "mofdb_version": "v1"},
+               {"name": "ABAVIJ_clean", "database": "CoREMOF 2014", "cif": "data_ABAVIJ", "mofdb_version": "v1"}]
+    (archive / "mofxdb.json").write_text(json.dumps({"results": entries}))
+    return archive
+
+def test_refcode_from_filename():
+    assert refcode_from_filename("ABAVIJ_clean.cif") == "ABAVIJ"
+    assert refcode_from_filename("/path/VOGTIV_charged.cif") == "VOGTIV"
+    assert refcode_from_filename("ABAVIJ_clean_coremof-2019.cif") == "ABAVIJ"
+
+def test_import_and_lookup(archive):
+    assert import_archive(str(archive), version="2019-v1") == 4
+    # CIF files and MOFXDB entries are named and matched the same way
+    assert [entry[:3] for entry in lookup_structure("MIBQAR")] == [("MIBQAR_clean", "CoREMOF 2019", "2019-v1")]
+    assert [entry[:3] for entry in lookup_structure("ABAVIJ")] == [("ABAVIJ_clean", "CoREMOF 2014", "v1"),
+                                                                   ("ABAVIJ_clean", "CoREMOF 2019", "v1")]
+    assert [entry[0] for entry in lookup_structure("VOGTIV_charged")] == ["VOGTIV_charged"]
+    assert lookup_structure("XXXXXX") == []
+    # The refcodes of the CIF files and of the MOFXDB entries are normalized the same way
+    with sqlite3.connect(f"{get_db_dir()}/index.sqlite") as connection:
+        refcodes = dict(connection.execute("SELECT name,refcode FROM structures"))
+    assert refcodes == {"MIBQAR_clean": "MIBQAR", "VOGTIV_charged": "VOGTIV", "ABAVIJ_clean": "ABAVIJ"}
+    # Refcodes are looked up with the index, names by substring
+    with sqlite3.connect(f"{get_db_dir()}/index.sqlite") as connection:
+        plan = connection.execute("EXPLAIN QUERY PLAN SELECT name FROM structures WHERE refcode = ?", ("MIBQAR",)).fetchall()
+    assert "structures_refcode" in str(plan)
+    assert [entry[0] for entry in lookup_structure("BQAR_cl")] == ["MIBQAR_clean"]
+    # The underscore is not a wildcard
+    assert lookup_structure("MIBQAR_c") != [] and lookup_structure("MIBQARXc") == []
+
+def test_lookup_without_store(tmp_path, monkeypatch):
+    monkeypatch.setenv("SAW_CACHE_DIR", str(tmp_path / "cache"))
+    assert lookup_structure("MIBQAR") == []
@@ -0,0 +1,48 @@
+"""
+Tests of the minimal supercells, computed from the header of the CIF files in one vectorized calculation.
+"""
+import glob
+import os
+from math import ceil
+import numpy as np
+import pytest
+
+input_parser = pytest.importorskip("src.input_parser")
+
+CIF_FILES = sorted(glob.glob(os.path.join(os.environ["PACKAGE_DIR"], "tests", "test_cif_local_directory", "cif", "*.cif")))
+
+def _per_cif_unit_cells(cellpar, cutoff=12):
+    # Calculation of a single structure, as done for each CIF file before the vectorization
+    mat = input_parser.mat_from_parameters(*cellpar)
+    cx, cy, cz = input_parser.perpendicular_lengths(mat[0], mat[1], mat[2])
+    return ceil(cutoff*2/cx), ceil(cutoff*2/cy), ceil(cutoff*2/cz)
+
+def test_random_cells():
+    rng = np.random.default_rng(0)
+    cellpars = np.column_stack([rng.uniform(3, 40, (500, 3)), rng.uniform(60, 120, (500, 3))])
+    # Keep the cells which exist (positive volume)
+    cos = np.cos(np.radians(cellpars[:, 3:]))
+    cellpars = cellpars[1 - (cos**2).sum(axis=1) + 2*cos.prod(axis=1) > 1e-3]
+    for cutoff in [12, 14.5]:
+        expected = [_per_cif_unit_cells(cellpar, cutoff) for cellpar in cellpars]
+        assert input_parser.minimal_unit_cells(cellpars, cutoff=cutoff).tolist() == [list(n) for n in expected]
+
+@pytest.mark.parametrize("cif", CIF_FILES, ids=os.path.basename)
+def test_cif_files(cif):
+    cellpar = input_parser.read_cif_cell(cif)
+    assert input_parser.get_minimal_unit_cells(cif) == _per_cif_unit_cells(cellpar)
+    assert input_parser.compute_minimal_unit_cells([cif]) == {cif: _per_cif_unit_cells(cellpar)}
+
+@pytest.mark.parametrize("cif", CIF_FILES, ids=os.path.basename)
+def test_read_cif_cell(cif):
+    ase_io = pytest.importorskip("ase.io")
+    assert np.allclose(input_parser.read_cif_cell(cif), ase_io.read(cif).cell.cellpar(), atol=1e-4)
+
+def test_read_cif_cell_uncertainty(tmp_path):
+    cif = tmp_path / "MOF.cif"
+    cif.write_text("data_MOF\n_cell_length_a 10.2345(6)\n_cell_length_b 11\n_cell_length_c 12.5\n"
+                   "_cell_angle_alpha 90\n_cell_angle_beta 95.5(1)\n_cell_angle_gamma 90\nloop_\n")
+    assert input_parser.read_cif_cell(str(cif)) == (10.2345, 11.0, 12.5, 90.0, 95.5, 90.0)
+    (tmp_path / "empty.cif").write_text("data_empty\n")
+    with pytest.raises(ValueError):
+        input_parser.read_cif_cell(str(tmp_path / "empty.cif"))